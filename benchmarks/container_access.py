@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""Time attribute access through read containers
+
+Compares calling a method on a list directly, through a ``DelayRead`` using
+the generic ``Passthrough.__getattr__`` (the path every access took before
+``PassthroughIO`` had its own), through a ``DelayRead`` as it is now, through
+a pooled ``DelayRead``, and on the object returned by ``unwrap``. Run as::
+
+    python benchmarks/container_access.py [number]
+"""
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+from __future__ import division, print_function
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import sys
+from timeit import Timer
+from pyqi.core.container import (ContainerPool, DelayRead, Passthrough,
+                                 default_read_object)
+
+class GenericDelayRead(DelayRead):
+    """A DelayRead using the generic pass through"""
+    __getattr__ = Passthrough.__getattr__
+
+# name -> object timed, filled in by main so that the timers can import it
+TARGETS = {}
+
+def main(number=1000000):
+    obj = list(range(10))
+    generic = GenericDelayRead(Object=obj, reader=default_read_object)
+    container = DelayRead(Object=obj, reader=default_read_object)
+    pooled = ContainerPool(1 << 20).add(
+            DelayRead(Object=obj, InPath='unused',
+                      reader=default_read_object))
+
+    cases = [('direct', obj),
+             ('generic __getattr__', generic),
+             ('PassthroughIO.__getattr__', container),
+             ('pooled', pooled),
+             ('unwrap()', container.unwrap())]
+
+    baseline = None
+    print("%-26s %12s %8s" % ('access', 'ns/call', 'ratio'))
+    for name, target in cases:
+        TARGETS[name] = target
+        timer = Timer('target.count(3)',
+                      setup='from __main__ import TARGETS; '
+                            'target = TARGETS[%r]' % name)
+        per_call = min(timer.repeat(3, number)) / number * 1e9
+        if baseline is None:
+            baseline = per_call
+        print("%-26s %12.1f %8.2f" % (name, per_call, per_call / baseline))
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
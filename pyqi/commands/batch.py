@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import sys
+import json
+import shlex
+import traceback
+from time import time
+from multiprocessing import Pool
+from pyqi.core.command import (Command, CommandIn, CommandOut,
+                               ParameterCollection)
+from pyqi.core.interface import get_command_config
+from pyqi.core.interfaces.optparse import optparse_factory, optparse_main
+from pyqi.util import get_version_string
+
+class JobRunner(object):
+    """Run batch jobs against a command configuration module
+
+    A job is a single line of text, either a command line (``<command>
+    [<args>]``, split with shell quoting rules) that is run through the
+    command's optparse interface, or a JSON object of the form ``{"command":
+    <command>, "kwargs": {<CommandIn name>: <value>, ...}}`` that calls the
+    ``Command`` directly. Interfaces and ``Command`` classes are loaded once
+    per command and reused for every job.
+    """
+
+    def __init__(self, command_config_module, driver_name):
+        self.CommandConfigModule = command_config_module
+        self.DriverName = driver_name
+        self._version_str = get_version_string(command_config_module)
+        self._interfaces = {}
+
+    def __call__(self, numbered_job):
+        """Run a ``(job_number, job_line)`` pair and return a JSON record"""
+        job_number, line = numbered_job
+        record = {'job': job_number, 'command': None, 'status': 0}
+
+        start = time()
+        # Anything the job prints goes to stderr, so that stdout only
+        # carries the records.
+        saved_stdout = sys.stdout
+        sys.stdout = sys.stderr
+        try:
+            if line.startswith('{'):
+                job = json.loads(line)
+                record['command'] = job['command']
+                self._run_kwargs(job['command'], job.get('kwargs', {}))
+            else:
+                argv = shlex.split(line)
+                record['command'] = argv[0]
+                self._run_argv(argv[0], argv[1:])
+        except SystemExit as e:
+            # optparse reports bad command lines by exiting.
+            record['status'] = _exit_status(e.code)
+        except Exception as e:
+            record['status'] = 1
+            record['error'] = '%s: %s' % (e.__class__.__name__, e)
+            record['traceback'] = traceback.format_exc()
+        finally:
+            sys.stdout = saved_stdout
+        record['elapsed'] = time() - start
+
+        return json.dumps(record, sort_keys=True)
+
+    def _run_argv(self, cmd, args):
+        interface = self._get_interface(cmd)
+        optparse_main(interface, [' '.join([self.DriverName, cmd])] + args)
+
+    def _run_kwargs(self, cmd, kwargs):
+        interface = self._get_interface(cmd)
+        interface.CommandConstructor()(**kwargs)
+
+    def _get_interface(self, cmd):
+        if cmd not in self._interfaces:
+            cmd_cfg, error_msg = get_command_config(self.CommandConfigModule,
+                                                    cmd, exit_on_failure=False)
+            if cmd_cfg is None:
+                raise ValueError("Unable to load command '%s': %s" %
+                                 (cmd, error_msg))
+
+            self._interfaces[cmd] = optparse_factory(
+                    cmd_cfg.CommandConstructor, cmd_cfg.usage_examples,
+                    cmd_cfg.inputs, cmd_cfg.outputs, self._version_str)
+
+        return self._interfaces[cmd]
+
+def _exit_status(code):
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    return 1
+
+def _iter_jobs(lines):
+    """Yield numbered jobs, skipping blank lines and comments"""
+    job_number = 0
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        yield job_number, line
+        job_number += 1
+
+_worker_runner = None
+
+def _init_worker(command_config_module, driver_name):
+    global _worker_runner
+    _worker_runner = JobRunner(command_config_module, driver_name)
+
+def _run_in_worker(numbered_job):
+    return _worker_runner(numbered_job)
+
+def _run_jobs(cfg_mod, driver_name, num_processes, jobs):
+    """Yield a JSON record per job"""
+    if num_processes > 1:
+        pool = Pool(num_processes, _init_worker, (cfg_mod, driver_name))
+        try:
+            for record in pool.imap(_run_in_worker, jobs, chunksize=16):
+                yield record
+        finally:
+            pool.terminate()
+            pool.join()
+    else:
+        runner = JobRunner(cfg_mod, driver_name)
+        for job in jobs:
+            yield runner(job)
+
+class Batch(Command):
+    BriefDescription = "Run many command invocations in one process"
+    LongDescription = ("Read command invocations, one per line, and run them "
+                       "without starting a new interpreter for each. A line "
+                       "is either a command line (<command> [<args>]) or a "
+                       "JSON object {\"command\": <command>, \"kwargs\": "
+                       "{...}} of CommandIns passed directly to the Command. "
+                       "Blank lines and lines starting with # are ignored. "
+                       "The exit status and wall time of each job are "
+                       "reported as JSON lines, as the jobs complete. "
+                       "Anything the jobs themselves print to stdout is "
+                       "written to stderr instead, so that it doesn't mix "
+                       "with the records.")
+
+    CommandIns = ParameterCollection([
+        CommandIn(Name='command_config_module', DataType=str,
+                  Description='CLI command configuration module',
+                  Required=True),
+        CommandIn(Name='jobs', DataType=list,
+                  Description='the job lines to run (any iterable of '
+                              'strings)', Required=True),
+        CommandIn(Name='driver_name', DataType=str,
+                  Description='name of the driver script, used as the '
+                              'program name in command usage messages',
+                  Required=False, Default='pyqi'),
+        CommandIn(Name='num_processes', DataType=int,
+                  Description='number of worker processes; jobs run in this '
+                              'process if 1', Required=False, Default=1)
+    ])
+
+    CommandOuts = ParameterCollection([
+        CommandOut(Name='result', DataType=list,
+                   Description='one JSON record per job, produced as the '
+                               'jobs run', Streaming=True)
+    ])
+
+    def run(self, **kwargs):
+        # Jobs run as the result is consumed, so records can be written out
+        # as they are produced rather than held until every job is done.
+        return {'result': _run_jobs(kwargs['command_config_module'],
+                                    kwargs['driver_name'],
+                                    kwargs['num_processes'],
+                                    _iter_jobs(kwargs['jobs']))}
+
+CommandConstructor = Batch
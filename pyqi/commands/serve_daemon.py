@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+from pyqi.core.command import (Command, CommandIn, CommandOut,
+                               ParameterCollection)
+from pyqi.core.daemon import serve
+
+class ServeDaemon(Command):
+    BriefDescription = "Start a pre-warmed driver daemon"
+    LongDescription = ("Preload a command configuration module and serve "
+                       "driver invocations over a Unix domain socket. Drivers "
+                       "forward their commands to the daemon when the "
+                       "PYQI_DAEMON_SOCKET environment variable is set to "
+                       "the socket path, and run them in-process when no "
+                       "daemon is listening.")
+
+    CommandIns = ParameterCollection([
+        CommandIn(Name='command_config_module', DataType=str,
+                  Description='CLI command configuration module to preload',
+                  Required=True),
+        CommandIn(Name='socket_path', DataType=str,
+                  Description='path of the Unix domain socket to listen on',
+                  Required=True)
+    ])
+
+    CommandOuts = ParameterCollection([
+        CommandOut(Name='result', DataType=str,
+                   Description='Signals the termination of the daemon')
+    ])
+
+    def run(self, **kwargs):
+        fin = serve(kwargs['socket_path'], kwargs['command_config_module'])
+
+        return {'result': fin}
+
+CommandConstructor = ServeDaemon
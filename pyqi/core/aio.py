@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+"""asyncio support for Commands and Interfaces
+
+``Command.acall`` and ``Interface.acall`` return the coroutines defined
+here. A ``Command`` whose ``run`` is a coroutine function is awaited on the
+event loop, so many I/O-bound calls can share one thread. Any other ``run``,
+and every synchronous input or output ``Handler``, runs in the loop's
+default executor (see ``loop.set_default_executor``), so blocking work
+doesn't stall the loop. Handlers may also be coroutine functions.
+
+Phase hooks (see ``Interface.add_phase_hook``) wrap synchronous phases as
+usual, in whichever thread runs them. Phases that are coroutines, and the
+overall ``input_handler`` and ``output_handler`` phases of interfaces whose
+handlers run concurrently, are not passed to the hooks.
+
+Interfaces keep per-call state (e.g., parsed command-line options), so run
+concurrent calls through separate interface instances. A ``Command``
+instance can be shared.
+
+This module uses ``async``/``await`` and so requires Python 3.5+; the rest of
+pyqi imports it only when an ``acall`` method is used.
+"""
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import asyncio
+from time import time
+from functools import partial
+from inspect import iscoroutinefunction
+from pyqi.core.cancellation import (CancellationToken, install_token,
+                                   run_with_token, uninstall_token)
+from pyqi.core.exception import CommandTimeoutError
+from pyqi.core.interface import _release_shared
+from pyqi.core.log import Logger, log_message
+
+# get_event_loop may create a loop outside a coroutine (and warns about it
+# since Python 3.10); get_running_loop is only missing before Python 3.7,
+# where get_event_loop called from a coroutine returns the running loop.
+_get_running_loop = getattr(asyncio, 'get_running_loop',
+                            asyncio.get_event_loop)
+
+async def run_in_executor(f, *args, **kwargs):
+    """Run ``f(*args, **kwargs)`` in the running loop's default executor"""
+    loop = _get_running_loop()
+    return await loop.run_in_executor(None, partial(f, *args, **kwargs))
+
+async def command_acall(command, kwargs, timeout=None):
+    """Safely execute ``command`` with ``kwargs``; see ``Command.acall``"""
+    cached, cache_key = command._start_call(kwargs)
+    if cached is not None:
+        return cached
+
+    monitor = command._start_usage()
+    failed = True
+    try:
+        result = await _run_and_finish(command, kwargs, cache_key, timeout)
+        failed = False
+    finally:
+        command._store_usage(monitor, failed)
+
+    return result
+
+async def _await_with_token(token, coro):
+    """Await ``coro`` with ``token`` installed as the current token"""
+    installed = install_token(token)
+    try:
+        return await coro
+    finally:
+        uninstall_token(installed)
+
+async def _run_and_finish(command, kwargs, cache_key, timeout):
+    """Run ``command`` and validate its result; see ``Command.acall``"""
+    # Coroutines are also cancelled by asyncio at the deadline; runs in the
+    # executor can only poll, as the thread running them can't be stopped.
+    token = CancellationToken(timeout, command.CancellationToken)
+    if iscoroutinefunction(command.run):
+        call = _await_with_token(token, command.run(**kwargs))
+    else:
+        call = run_in_executor(run_with_token, token, command.run, **kwargs)
+
+    self_str = command._get_validation_plan().ClassStr
+    start = time()
+    try:
+        if timeout is None:
+            result = await call
+        else:
+            result = await asyncio.wait_for(call, timeout)
+    except asyncio.TimeoutError:
+        token.cancel()
+        log_message(command._logger, Logger.FATAL,
+                    'Timed out after %ss executing command: %s',
+                    timeout, self_str, command=self_str, phase='run',
+                    duration=time() - start)
+        raise CommandTimeoutError("Command timed out after %ss." % timeout)
+    except Exception:
+        log_message(command._logger, Logger.FATAL,
+                    'Error executing command: %s', self_str,
+                    command=self_str, phase='run', duration=time() - start)
+        raise
+
+    return command._finish_call(result, cache_key, start)
+
+async def interface_acall(interface, in_, args, kwargs):
+    """Run ``interface`` on ``in_``; see ``Interface.acall``"""
+    interface._run_phase('in_validator', interface._the_in_validator, in_)
+
+    prepared = interface._prepare_input_handlers(in_, *args, **kwargs)
+    if prepared is None:
+        cmd_input = await run_in_executor(interface._run_phase,
+                                          'input_handler',
+                                          interface._input_handler, in_,
+                                          *args, **kwargs)
+    else:
+        cmd_input, handler_calls = prepared
+        cmd_input.update(await _run_handlers(interface, handler_calls))
+
+    cmd_result = await interface.CmdInstance.acall(**cmd_input)
+    interface._run_phase('out_validator', interface._the_out_validator,
+                         cmd_result)
+
+    handler_calls = interface._prepare_output_handlers(cmd_result)
+    if handler_calls is None:
+        output = await run_in_executor(interface._run_phase, 'output_handler',
+                                       interface._output_handler, cmd_result)
+    else:
+        output = await _run_handlers(interface, handler_calls)
+
+    _release_shared(cmd_result, output)
+    return output
+
+async def _run_handlers(interface, handler_calls):
+    """Run ``(key, phase, handler, args)`` calls concurrently
+
+    Returns a dict mapping each key to its handler's result.
+    """
+    keys = []
+    pending = []
+    for key, phase, handler, handler_args in handler_calls:
+        keys.append(key)
+        if iscoroutinefunction(handler):
+            pending.append(handler(*handler_args))
+        else:
+            pending.append(run_in_executor(interface._run_phase, phase,
+                                           handler, *handler_args))
+
+    return dict(zip(keys, await asyncio.gather(*pending)))
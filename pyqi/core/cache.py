@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import sys
+from copy import deepcopy, Error as copy_error
+from collections import OrderedDict
+from threading import Lock
+
+# Types whose values can be keyed; type(u'') and type(2 ** 64) are unicode
+# and long on Python 2.
+_IMMUTABLE_TYPES = (type(None), bool, int, type(2 ** 64), float, complex,
+                    str, bytes, type(u''))
+
+class ResultCache(object):
+    """A thread-safe LRU cache of ``Command`` results
+
+    The cache holds at most ``max_entries`` results and, if ``max_bytes`` is
+    not ``None``, at most roughly ``max_bytes`` of result data, evicting the
+    least recently used results first. Sizes are estimated with
+    ``estimate_size``, which only looks one level into each result, so the
+    byte bound is approximate.
+
+    Results are deep-copied when they are cached and, unless ``get`` is told
+    otherwise, when they are returned, so neither the caller who produced a
+    result nor later callers can modify the cached copy. Results that ``copy.deepcopy`` can't copy are not
+    cached.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=None):
+        if max_entries < 1:
+            raise ValueError("A ResultCache must hold at least one entry.")
+
+        self.MaxEntries = max_entries
+        self.MaxBytes = max_bytes
+        self.Hits = 0
+        self.Misses = 0
+        self.Evictions = 0
+        self.Bytes = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, copy=True):
+        """Return a copy of the cached result for ``key``, or ``None`` on a
+        miss
+
+        If ``copy`` is False the cached result itself is returned, which
+        saves the copy but must not be modified.
+        """
+        with self._lock:
+            try:
+                result, size = self._entries.pop(key)
+            except KeyError:
+                self.Misses += 1
+                return None
+
+            # Reinsert to mark as most recently used.
+            self._entries[key] = (result, size)
+            self.Hits += 1
+
+        return deepcopy(result) if copy else result
+
+    def put(self, key, result):
+        """Cache a copy of ``result`` under ``key``
+
+        Results larger than ``MaxBytes`` on their own, and results that can't
+        be copied, are not cached.
+        """
+        size = estimate_size(result)
+        if self.MaxBytes is not None and size > self.MaxBytes:
+            return
+
+        try:
+            result = deepcopy(result)
+        except (TypeError, copy_error):
+            # e.g. open files, generators or memoryviews
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self.Bytes -= self._entries.pop(key)[1]
+
+            self._entries[key] = (result, size)
+            self.Bytes += size
+
+            while len(self._entries) > self.MaxEntries or \
+                    (self.MaxBytes is not None and self.Bytes > self.MaxBytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.Bytes -= evicted_size
+                self.Evictions += 1
+
+    def clear(self):
+        """Drop all cached results, keeping the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.Bytes = 0
+
+    def stats(self):
+        """Return the cache counters as a dict"""
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.Bytes,
+                    'hits': self.Hits, 'misses': self.Misses,
+                    'evictions': self.Evictions}
+
+def make_key(kwargs):
+    """Return a hashable key for ``Command`` kwargs, or ``None``
+
+    Lists, tuples, sets and dicts are frozen recursively. Other values must
+    be of an immutable type (``None``, numbers, strings, bytes), as other
+    objects, such as open files, are hashed by identity and would be kept
+    alive by the cache. ``None`` is returned if any value is of another
+    type, in which case the call should bypass the cache. Values are keyed
+    with their types so that, e.g., ``1`` and ``True`` do not share a cached
+    result.
+    """
+    try:
+        key = frozenset((name, _freeze(value))
+                        for name, value in kwargs.items())
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return (type(value), tuple(_freeze(v) for v in value))
+    if isinstance(value, dict):
+        return (type(value), frozenset((k, _freeze(v))
+                                       for k, v in value.items()))
+    if isinstance(value, (set, frozenset)):
+        return (type(value), frozenset(_freeze(v) for v in value))
+    if not isinstance(value, _IMMUTABLE_TYPES):
+        raise TypeError("Values of type %s are not keyed." %
+                        type(value).__name__)
+    return (type(value), value)
+
+def estimate_size(result):
+    """Estimate the size in bytes of a ``Command`` result dict
+
+    Counts the dict, its keys and its values, plus the items of values that
+    are lists, tuples, sets or dicts, but nothing deeper.
+    """
+    size = sys.getsizeof(result)
+    for key, value in result.items():
+        size += sys.getsizeof(key) + estimate_value_size(value)
+    return size
+
+def estimate_value_size(value):
+    """Estimate the size in bytes of a value
+
+    Counts the value, plus its items if it is a list, tuple, set or dict,
+    but nothing deeper.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sys.getsizeof(k) + sys.getsizeof(v)
+                    for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(sys.getsizeof(v) for v in value)
+    return size
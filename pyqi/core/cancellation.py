@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+
+"""Timeouts and cooperative cancellation of ``Command`` execution
+
+While a ``Command`` runs, a ``CancellationToken`` is installed for the
+running thread (or, from Python 3.7, for the running asyncio task). Long-running ``run`` methods should poll it, e.g. once per
+input record, with ``Command.check_cancelled`` (or ``current_token()``), which
+raises once the call has been cancelled or its deadline has passed.
+
+How a timeout (``Command.Timeout``, or a call's ``timeout``) is enforced
+depends on ``Command.TimeoutEnforcement``:
+
+``'cooperative'``
+    ``run`` executes in the calling thread and stops only when it polls its
+    token.
+``'thread'``
+    ``run`` executes in a worker thread. The caller stops waiting at the
+    deadline, and the worker stops the next time it polls its token. Python
+    threads can't be killed, so a ``run`` that never polls is abandoned
+    rather than stopped: it runs to completion, side effects included,
+    after the caller has got ``CommandTimeoutError``. This frees the caller
+    even when ``run`` never polls.
+``'process'``
+    ``run`` executes in a child process which is killed at the deadline, so
+    even ``run`` methods stuck in C code stop. CommandIns and results must
+    be picklable.
+
+Async calls (``Command.acall``) are always bounded with
+``asyncio.wait_for``; see ``pyqi.core.aio``.
+"""
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import sys
+import threading
+import multiprocessing
+from time import time
+from pyqi.core.exception import (CommandCancelledError, CommandTimeoutError,
+                                 IncompetentDeveloperError)
+
+ENFORCEMENTS = ('cooperative', 'thread', 'process')
+
+# Seconds between checks for cancellation while waiting on a worker.
+_POLL_INTERVAL = 0.1
+
+# Tokens are kept in a context variable where there are any, so that
+# concurrent asyncio tasks each see their own token; new threads start with
+# an empty context, like a thread-local.
+try:
+    from contextvars import ContextVar
+except ImportError:
+    ContextVar = None
+    _local = threading.local()
+else:
+    _token_var = ContextVar('pyqi_cancellation_token', default=None)
+
+class CancellationToken(object):
+    """Signals that a ``Command`` call should stop
+
+    A token is cancelled explicitly with ``cancel``, when ``timeout`` seconds
+    have passed since it was created, or when its ``parent`` token is
+    cancelled.
+    """
+
+    def __init__(self, timeout=None, parent=None):
+        self.Deadline = None if timeout is None else time() + timeout
+        self.Timeout = timeout
+        self.Parent = parent
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return (self._cancelled.is_set() or self.expired or
+                (self.Parent is not None and self.Parent.cancelled))
+
+    @property
+    def expired(self):
+        return self.Deadline is not None and time() >= self.Deadline
+
+    def remaining(self):
+        """Return the seconds left until the deadline, or ``None``"""
+        if self.Deadline is None:
+            return None
+        return max(0.0, self.Deadline - time())
+
+    def raise_if_cancelled(self):
+        """Raise ``CommandTimeoutError`` or ``CommandCancelledError``"""
+        if self.expired:
+            raise CommandTimeoutError("Command timed out after %ss." %
+                                      self.Timeout)
+        if self.cancelled:
+            raise CommandCancelledError("Command was cancelled.")
+
+def current_token():
+    """Return the token of the ``Command`` running in this thread, if any"""
+    if ContextVar is None:
+        return getattr(_local, 'token', None)
+    return _token_var.get()
+
+def install_token(token):
+    """Make ``token`` the current token until ``uninstall_token`` is called
+
+    Returns the value to pass to ``uninstall_token``.
+    """
+    if ContextVar is None:
+        previous = current_token()
+        _local.token = token
+        return previous
+    return _token_var.set(token)
+
+def uninstall_token(installed):
+    """Restore the token current before ``install_token``"""
+    if ContextVar is None:
+        _local.token = installed
+    else:
+        _token_var.reset(installed)
+
+def run_with_token(token, f, *args, **kwargs):
+    """Call ``f`` with ``token`` installed as this thread's current token"""
+    installed = install_token(token)
+    try:
+        return f(*args, **kwargs)
+    finally:
+        uninstall_token(installed)
+
+def run_command(command, kwargs, timeout=None):
+    """Run ``command.run(**kwargs)``, enforcing a timeout
+
+    ``timeout`` defaults to ``command.Timeout``.
+    """
+    if timeout is None:
+        timeout = command.Timeout
+    token = CancellationToken(timeout, command.CancellationToken)
+    enforcement = command.TimeoutEnforcement
+
+    if enforcement not in ENFORCEMENTS:
+        raise IncompetentDeveloperError("Unknown TimeoutEnforcement '%s'. "
+                                        "Must be one of: %s" %
+                                        (enforcement, ', '.join(ENFORCEMENTS)))
+
+    if timeout is None or enforcement == 'cooperative':
+        result = run_with_token(token, command.run, **kwargs)
+    elif enforcement == 'thread':
+        result = _run_in_thread(token, command, kwargs)
+    else:
+        result = _run_in_process(token, command, kwargs)
+
+    # A run that ignored its token must not be mistaken for a complete one.
+    if token.expired:
+        token.raise_if_cancelled()
+    return result
+
+def _run_in_thread(token, command, kwargs):
+    outcome = {}
+
+    def target():
+        try:
+            outcome['result'] = run_with_token(token, command.run, **kwargs)
+        except BaseException:
+            outcome['error'] = sys.exc_info()[1]
+
+    worker = threading.Thread(target=target,
+                              name='pyqi-%s' % command.__class__.__name__)
+    # An abandoned worker must not keep the interpreter alive.
+    worker.daemon = True
+    worker.start()
+
+    while worker.is_alive() and not token.cancelled:
+        worker.join(_wait_slice(token))
+
+    if worker.is_alive():
+        token.cancel()
+        token.raise_if_cancelled()
+
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['result']
+
+def _run_in_process(token, command, kwargs):
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    child = multiprocessing.Process(target=_process_main,
+                                    args=(child_conn, command, kwargs,
+                                          token.remaining()))
+    child.daemon = True
+    child.start()
+    child_conn.close()
+
+    try:
+        while not parent_conn.poll(_wait_slice(token)):
+            if token.cancelled:
+                child.terminate()
+                token.cancel()
+                token.raise_if_cancelled()
+
+        try:
+            ok, value = parent_conn.recv()
+        except EOFError:
+            child.join()
+            raise CommandCancelledError("Command process exited with status "
+                                        "%s without a result." %
+                                        child.exitcode)
+    finally:
+        parent_conn.close()
+        child.join()
+
+    if not ok:
+        raise value
+    return value
+
+def _wait_slice(token):
+    """Return how long to wait before checking ``token`` again"""
+    # Explicit cancellation isn't signalled to waiters, so check regularly.
+    remaining = token.remaining()
+    return _POLL_INTERVAL if remaining is None else \
+            min(remaining, _POLL_INTERVAL)
+
+def _process_main(conn, command, kwargs, timeout):
+    token = CancellationToken(timeout)
+    try:
+        outcome = (True, run_with_token(token, command.run, **kwargs))
+    except BaseException:
+        outcome = (False, sys.exc_info()[1])
+
+    try:
+        conn.send(outcome)
+    except Exception:
+        # The result or exception couldn't be pickled.
+        e = sys.exc_info()[1]
+        conn.send((False, RuntimeError("Unable to return the command's "
+                                       "outcome from its process: %s: %s" %
+                                       (e.__class__.__name__, e))))
+    conn.close()
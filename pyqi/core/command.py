@@ -14,18 +14,47 @@ __credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
 
 import sys, traceback
 import re
-from pyqi.core.log import NullLogger
-from pyqi.core.exception import (IncompetentDeveloperError,
+import threading
+from time import time
+from weakref import WeakKeyDictionary
+from collections import OrderedDict
+from pyqi.core.log import Logger, get_default_logger, log_message
+from pyqi.core.cache import ResultCache, make_key
+from pyqi.core.cancellation import current_token, run_command
+from pyqi.core.resources import ResourceMonitor
+from pyqi.core.exception import (CommandTimeoutError,
+                                 IncompetentDeveloperError,
                                  InvalidReturnTypeError,
                                  UnknownParameterError,
                                  MissingParameterError)
 
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
+# dicts keep insertion order from Python 3.7 and are more compact.
+_OrderedDict = dict if sys.version_info >= (3, 7) else OrderedDict
+
+# The ResourceUsage of each Command is kept per thread, and per asyncio task
+# where there are context variables, so that concurrent calls don't
+# overwrite each other's. Each holds a WeakKeyDictionary of Command to usage,
+# replaced rather than modified as tasks share their parent's.
+try:
+    from contextvars import ContextVar
+except ImportError:
+    ContextVar = None
+    _usage_local = threading.local()
+else:
+    _usage_var = ContextVar('pyqi_resource_usage', default=None)
+
 class Parameter(object):
     """The ``Command`` variable type baseclass
 
     A ``Parameter`` is interface agnostic, and is used to describe an input
     or output of a ``Command``.
     """
+    __slots__ = ('Name', 'DataType', 'Description', 'ValidateValue')
 
     def __init__(self, Name, DataType, Description, ValidateValue=None):
         """
@@ -53,7 +82,7 @@ class Parameter(object):
         self.ValidateValue = ValidateValue
 
     def _is_valid_name(self, name):
-        return name == self._pythonize(name)
+        return _VALID_NAME.match(name) is not None
 
     def _pythonize(self, name):
         """Taken from http://stackoverflow.com/a/3303361"""
@@ -65,8 +94,13 @@ class Parameter(object):
 
         return name
 
+# The names left unchanged by Parameter._pythonize.
+_VALID_NAME = re.compile(r'(?:[a-zA-Z_][0-9a-zA-Z_]*)?\Z')
+
 class CommandIn(Parameter):
     """A ``Command`` input variable type"""
+    __slots__ = ('Required', 'Default', 'DefaultDescription')
+
     def __init__(self, Name, DataType, Description, Required=False,
                  Default=None, DefaultDescription=None, **kwargs):
         self.Required = Required
@@ -81,33 +115,116 @@ class CommandIn(Parameter):
         super(CommandIn, self).__init__(Name, DataType, Description, **kwargs)
 
 class CommandOut(Parameter):
-    """A ``Command`` output variable type"""
-    def __init__(self, Name, DataType, Description, **kwargs):
+    """A ``Command`` output variable type
+
+    If ``Streaming`` is True, the output may be any iterable, including a
+    generator that produces its items while output handlers consume them, so
+    that large outputs never have to be held in memory. Results with
+    streaming outputs are never cached.
+    """
+    __slots__ = ('Streaming',)
+
+    def __init__(self, Name, DataType, Description, Streaming=False,
+                 **kwargs):
+        self.Streaming = Streaming
         super(CommandOut, self).__init__(Name, DataType, Description,
                                          **kwargs)
 
-class ParameterCollection(dict):
-    """A collection of parameters with dict like lookup"""
-    def __init__(self, Parameters):
-        self.Parameters = Parameters
+class ParameterCollection(Mapping):
+    """An immutable collection of parameters with dict like lookup
 
-        for p in self.Parameters:
-            if p.Name in self:
+    Parameters are kept in the order they were given, and are also available
+    as a list through ``Parameters``.
+    """
+    __slots__ = ('_parameters',)
+
+    def __init__(self, Parameters):
+        parameters = _OrderedDict()
+        for p in Parameters:
+            if p.Name in parameters:
                 raise IncompetentDeveloperError("Found duplicate Parameter "
                                                 "name '%s'. Parameter names "
                                                 "must be unique." % p.Name)
-            else:
-                super(ParameterCollection, self).__setitem__(p.Name, p)
+            parameters[p.Name] = p
+
+        object.__setattr__(self, '_parameters', parameters)
+
+    @property
+    def Parameters(self):
+        return list(self._parameters.values())
 
     def __getitem__(self, key):
         try:
-            return super(ParameterCollection, self).__getitem__(key)
+            return self._parameters[key]
         except KeyError:
             raise UnknownParameterError("Parameter not found: %s" % key)
 
+    def __contains__(self, key):
+        return key in self._parameters
+
+    def get(self, key, default=None):
+        return self._parameters.get(key, default)
+
+    def __iter__(self):
+        return iter(self._parameters)
+
+    def __len__(self):
+        return len(self._parameters)
+
+    def keys(self):
+        return self._parameters.keys()
+
+    def values(self):
+        return self._parameters.values()
+
+    def items(self):
+        return self._parameters.items()
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.Parameters)
+
     def __setitem__(self, key, val):
         raise TypeError("ParameterCollections are immutable")
-    __delattr__ = __setitem__
+
+    def __delitem__(self, key):
+        raise TypeError("ParameterCollections are immutable")
+
+    def __setattr__(self, name, val):
+        raise TypeError("ParameterCollections are immutable")
+
+class ValidationPlan(object):
+    """What ``Command.__call__`` checks, precomputed for a ``Command`` class
+
+    Walking ``CommandIns`` and ``CommandOuts`` on every call is measurable
+    when a ``Command`` is called many times in-process, so the names,
+    required flags, value validators and defaults are collected once per
+    class (see ``Command._get_validation_plan``).
+    """
+
+    def __init__(self, command_class):
+        self.CommandIns = command_class.CommandIns
+        self.CommandOuts = command_class.CommandOuts
+        self.ClassStr = str(command_class)
+
+        ins = list(self.CommandIns.values())
+        self.InputNames = frozenset(p.Name for p in ins)
+        self.RequiredNames = tuple(p.Name for p in ins if p.Required)
+        # (name, required, validator) for every CommandIn needing a check
+        self.InputChecks = tuple((p.Name, p.Required, p.ValidateValue)
+                                 for p in ins
+                                 if p.Required or p.ValidateValue)
+        self.Defaults = tuple((p.Name, p.Default) for p in ins
+                              if not p.Required)
+
+        self.OutputOrder = tuple(self.CommandOuts)
+        self.OutputNames = frozenset(self.OutputOrder)
+        self.StreamingOutputs = tuple(p.Name for p in self.CommandOuts.values()
+                                      if p.Streaming)
+
+    def describes(self, command_class):
+        """Return True if this plan is current for ``command_class``"""
+        return (command_class.CommandIns is self.CommandIns and
+                command_class.CommandOuts is self.CommandOuts)
 
 class Command(object):
     """Base class for ``Command``
@@ -121,88 +238,381 @@ class Command(object):
     CommandIns = ParameterCollection([])
     CommandOuts = ParameterCollection([])
 
+    # A pure Command's result depends only on its CommandIns and running it
+    # has no side effects, so results can be cached and shared by all of its
+    # instances (see enable_result_cache to cache for a single instance).
+    Pure = False
+    ResultCacheEntries = 128
+    ResultCacheBytes = None
+    # If False, cached results are returned without a copy, so callers must
+    # not modify them.
+    ResultCacheCopies = True
+
+    # Seconds a call may run for (unless the call passes timeout=), and how
+    # that is enforced; see pyqi.core.cancellation. With 'thread'
+    # enforcement, a run that doesn't poll check_cancelled is abandoned, not
+    # stopped: it keeps running, side effects included, after the call has
+    # raised CommandTimeoutError. CancellationToken, if set, cancels calls
+    # when it is cancelled.
+    Timeout = None
+    TimeoutEnforcement = 'thread'
+    CancellationToken = None
+
+    # If True, each call stores the resources it used in ResourceUsage (see
+    # pyqi.core.resources) rather than in its result.
+    RecordResourceUsage = False
+
+    _result_cache = None
+
     def __init__(self, **kwargs):
         """ """
-        self._logger = NullLogger()
+        self._logger = get_default_logger()
 
     def __call__(self, **kwargs):
-        """Safely execute a ``Command``"""
-        self_str = str(self.__class__)
-        self._logger.info('Starting command: %s' % self_str)
+        """Safely execute a ``Command``
 
-        self._validate_kwargs(kwargs)
-        self._set_defaults(kwargs)
+        ``timeout`` (seconds), unless it names one of the ``CommandIns``,
+        bounds this call instead of ``Timeout``.
+        """
+        timeout = self._pop_timeout(kwargs)
+        cached, cache_key = self._start_call(kwargs)
+        if cached is not None:
+            return cached
 
+        monitor = self._start_usage()
+        failed = True
         try:
-            result = self.run(**kwargs)
+            result = self._run_and_finish(kwargs, cache_key, timeout)
+            failed = False
+        finally:
+            self._store_usage(monitor, failed)
+
+        return result
+
+    def _start_usage(self):
+        """Return a started ``ResourceMonitor`` if usage is recorded"""
+        if not self.RecordResourceUsage:
+            return None
+        return ResourceMonitor().start()
+
+    def _store_usage(self, monitor, failed):
+        """Store the resources used since ``_start_usage`` in ResourceUsage"""
+        if monitor is None:
+            return
+        usage = monitor.stop()
+        usage['command'] = self._get_validation_plan().ClassStr
+        usage['failed'] = failed
+        self.ResourceUsage = usage
+
+    @property
+    def ResourceUsage(self):
+        """The resources used by the last call in this thread or task
+
+        Calls made concurrently from other threads, or from other asyncio
+        tasks, don't change it, so after ``await command.acall()`` it is read
+        from the same coroutine. ``None`` if no call recorded its usage.
+        """
+        if ContextVar is None:
+            usages = getattr(_usage_local, 'usages', None)
+        else:
+            usages = _usage_var.get()
+        return None if usages is None else usages.get(self)
+
+    @ResourceUsage.setter
+    def ResourceUsage(self, usage):
+        if ContextVar is None:
+            usages = getattr(_usage_local, 'usages', None)
+            if usages is None:
+                usages = _usage_local.usages = WeakKeyDictionary()
+        else:
+            usages = WeakKeyDictionary(_usage_var.get() or ())
+            _usage_var.set(usages)
+        usages[self] = usage
+
+    def _pop_timeout(self, kwargs):
+        """Remove a per-call ``timeout`` from ``kwargs`` and return it
+
+        Returns ``Timeout`` if the call doesn't set one.
+        """
+        if 'timeout' in kwargs and \
+                'timeout' not in self._get_validation_plan().InputNames:
+            return kwargs.pop('timeout')
+        return self.Timeout
+
+    def _run_and_finish(self, kwargs, cache_key, timeout):
+        """Run the ``Command`` and validate its result"""
+        self_str = self._get_validation_plan().ClassStr
+        start = time()
+        try:
+            result = run_command(self, kwargs, timeout)
+        except CommandTimeoutError:
+            log_message(self._logger, Logger.FATAL,
+                        'Timed out after %ss executing command: %s',
+                        timeout, self_str, command=self_str,
+                        phase='run', duration=time() - start)
+            raise
         except Exception:
-            self._logger.fatal('Error executing command: %s' % self_str)
+            log_message(self._logger, Logger.FATAL,
+                        'Error executing command: %s', self_str,
+                        command=self_str, phase='run',
+                        duration=time() - start)
             raise
-        else:
-            self._logger.info('Completed command: %s' % self_str)
+
+        return self._finish_call(result, cache_key, start)
+
+    def check_cancelled(self):
+        """Raise if the current call has been cancelled or has timed out
+
+        Long-running ``run`` methods should call this regularly so that they
+        stop promptly. Raises ``CommandTimeoutError`` or
+        ``CommandCancelledError``.
+        """
+        token = current_token()
+        if token is not None:
+            token.raise_if_cancelled()
+
+    def acall(self, **kwargs):
+        """Return a coroutine that safely executes a ``Command``
+
+        If ``run`` is a coroutine function it is awaited, otherwise it is run
+        in the event loop's default executor. ``timeout`` is handled as by
+        ``__call__``. Requires Python 3.5+; see ``pyqi.core.aio``.
+        """
+        from pyqi.core.aio import command_acall
+        return command_acall(self, kwargs, self._pop_timeout(kwargs))
+
+    def _start_call(self, kwargs):
+        """Validate ``kwargs`` and set defaults before running
+
+        Returns ``(cached_result, cache_key)``. ``cached_result`` is not
+        ``None`` if the call can be answered from the result cache.
+        """
+        plan = self._get_validation_plan()
+        self_str = plan.ClassStr
+
+        # Invalid kwargs must raise whether or not a result is cached.
+        self._validate_kwargs(kwargs)
+
+        # A streamed output can only be consumed once, so it can't be cached.
+        cache = None if plan.StreamingOutputs else self.get_result_cache()
+        cache_key = None if cache is None else make_key(kwargs)
+        if cache_key is not None:
+            cached = cache.get(cache_key, self.ResultCacheCopies)
+            if cached is not None:
+                log_message(self._logger, Logger.INFO,
+                            'Using cached result for command: %s', self_str,
+                            command=self_str, phase='cache')
+                if self.RecordResourceUsage:
+                    # Nothing ran, so there is no usage to report.
+                    self.ResourceUsage = None
+                return cached, None
+
+        log_message(self._logger, Logger.INFO, 'Starting command: %s',
+                    self_str, command=self_str, phase='start')
+
+        self._set_defaults(kwargs)
+
+        return None, cache_key
+
+    def _finish_call(self, result, cache_key, start):
+        """Validate and cache the result of ``run``, returning it
+
+        ``start`` is when ``run`` was called. If streamed outputs are still
+        to be produced, the call is logged as completed once they have been
+        consumed rather than now.
+        """
+        plan = self._get_validation_plan()
+        self_str = plan.ClassStr
 
         # verify the result type
         if not isinstance(result, dict):
-            self._logger.fatal('Unsupported result return type for command: '
-                               '%s' % self_str)
+            log_message(self._logger, Logger.FATAL,
+                        'Unsupported result return type for command: %s',
+                        self_str, command=self_str, phase='validate')
             raise InvalidReturnTypeError("Unsupported result return type. "
                                          "Results must be stored in a "
                                          "dictionary.")
 
         self._validate_result(result)
 
+        # Iterators still have their items to produce; other iterables are
+        # already complete.
+        streams = [name for name in plan.StreamingOutputs
+                   if name in result and iter(result[name]) is result[name]]
+        if streams:
+            pending = [len(streams)]
+            for name in streams:
+                result[name] = self._stream_until_done(result[name], pending,
+                                                       start)
+        else:
+            log_message(self._logger, Logger.INFO, 'Completed command: %s',
+                        self_str, command=self_str, phase='run',
+                        duration=time() - start)
+
+        if cache_key is not None and not _holds_shared_memory(result):
+            self.get_result_cache().put(cache_key, result)
+
         return result
 
+    def _stream_until_done(self, stream, pending, start):
+        """Yield the items of a streamed output
+
+        ``pending`` holds the number of the call's streams not yet consumed;
+        the call is logged as completed when the last one runs out.
+        """
+        self_str = self._get_validation_plan().ClassStr
+        try:
+            for item in stream:
+                yield item
+        except Exception:
+            log_message(self._logger, Logger.FATAL,
+                        'Error executing command: %s', self_str,
+                        command=self_str, phase='run',
+                        duration=time() - start)
+            raise
+
+        pending[0] -= 1
+        if not pending[0]:
+            log_message(self._logger, Logger.INFO, 'Completed command: %s',
+                        self_str, command=self_str, phase='run',
+                        duration=time() - start)
+
+    def enable_result_cache(self, max_entries=None, max_bytes=None):
+        """Cache results of this instance's calls, keyed by their kwargs
+
+        Only use this if the results depend on nothing but the kwargs. The
+        limits default to ``ResultCacheEntries`` and ``ResultCacheBytes``.
+        Calls with kwargs that cannot be hashed (after freezing lists, sets
+        and dicts) are never cached.
+        """
+        if max_entries is None:
+            max_entries = self.ResultCacheEntries
+        if max_bytes is None:
+            max_bytes = self.ResultCacheBytes
+
+        self._result_cache = ResultCache(max_entries, max_bytes)
+        return self._result_cache
+
+    def get_result_cache(self):
+        """Return the ``ResultCache`` used by this instance, if any
+
+        That is the instance's own cache if ``enable_result_cache`` was
+        called, otherwise the cache shared by the class if it is ``Pure``.
+        """
+        if self._result_cache is not None:
+            return self._result_cache
+        if not self.Pure:
+            return None
+
+        cls = self.__class__
+        cache = cls.__dict__.get('_class_result_cache')
+        if cache is None:
+            cache = ResultCache(cls.ResultCacheEntries, cls.ResultCacheBytes)
+            cls._class_result_cache = cache
+        return cache
+
+    def map(self, kwargs_iter, executor='thread', max_workers=None,
+            ordered=True, chunksize=1):
+        """Call this ``Command`` with each kwargs dict in parallel
+
+        Yields a ``pyqi.core.parallel.MapResult`` per call, capturing the
+        result or the exception raised. See ``pyqi.core.parallel.map_command``
+        for details.
+        """
+        from pyqi.core.parallel import map_command
+        return map_command(self, kwargs_iter, executor, max_workers, ordered,
+                           chunksize)
+
+    def trusted_call(self, **kwargs):
+        """Execute a ``Command`` without validating its input or result
+
+        This is a fast path for internal callers that already guarantee valid
+        ``CommandIns`` (e.g., code that calls a ``Command`` many times with
+        inputs it constructed itself). Defaults are still filled in, but
+        nothing is logged and neither ``kwargs`` nor the result are checked.
+        """
+        self._set_defaults(kwargs)
+        return self.run(**kwargs)
+
+    @classmethod
+    def _get_validation_plan(cls):
+        """Return the ``ValidationPlan`` for this class, building it once
+
+        The plan is rebuilt if ``CommandIns`` or ``CommandOuts`` have been
+        replaced since it was built.
+        """
+        # Look in the class's own namespace so that subclasses never pick up
+        # a parent's plan.
+        plan = cls.__dict__.get('_validation_plan')
+        if plan is None or not plan.describes(cls):
+            plan = ValidationPlan(cls)
+            cls._validation_plan = plan
+        return plan
+
     def _validate_kwargs(self, kwargs):
         """Validate input kwargs prior to executing a ``Command``
 
         This method can be overridden by subclasses. The baseclass defines only
         a basic validation.
         """
-        self_str = str(self.__class__)
-
-        # check required parameters
-        for p in self.CommandIns.values():
-            if p.Required and p.Name not in kwargs:
-                err_msg = 'Missing required CommandIn %s in %s' % (p.Name,
-                                                                   self_str)
-                self._logger.fatal(err_msg)
-                raise MissingParameterError(err_msg)
-
-            if p.Name in kwargs and p.ValidateValue:
-                if not p.ValidateValue(kwargs[p.Name]):
-                    err_msg = "CommandIn %s cannot take value %s in %s" % \
-                                (p.Name, kwargs[p.Name], self_str)
+        plan = self._get_validation_plan()
+
+        # check required parameters and values, in CommandIns order
+        for name, required, validate_value in plan.InputChecks:
+            if name not in kwargs:
+                if required:
+                    err_msg = 'Missing required CommandIn %s in %s' % (
+                            name, plan.ClassStr)
                     self._logger.fatal(err_msg)
-                    raise ValueError(err_msg)
+                    raise MissingParameterError(err_msg)
+            elif validate_value is not None and \
+                    not validate_value(kwargs[name]):
+                err_msg = "CommandIn %s cannot take value %s in %s" % \
+                            (name, kwargs[name], plan.ClassStr)
+                self._logger.fatal(err_msg)
+                raise ValueError(err_msg)
 
         # make sure we only have things we expect
-        for opt in kwargs:
-            if opt not in self.CommandIns:
-                err_msg = 'Unknown CommandIn %s in %s' % (opt, self_str)
-                self._logger.fatal(err_msg)
-                raise UnknownParameterError(err_msg)
+        if not plan.InputNames.issuperset(kwargs):
+            for opt in kwargs:
+                if opt not in plan.InputNames:
+                    err_msg = 'Unknown CommandIn %s in %s' % (opt,
+                                                              plan.ClassStr)
+                    self._logger.fatal(err_msg)
+                    raise UnknownParameterError(err_msg)
 
     def _validate_result(self, result):
         """Validate the result from a ``Command.run``"""
-        self_str = str(self.__class__)
+        plan = self._get_validation_plan()
 
-        for p in self.CommandOuts.values():
-            if p.Name not in result:
-                err_msg = "CommandOut %s not in %s" % (p.Name, self_str)
+        # Streamed outputs are checked without consuming them.
+        for name in plan.StreamingOutputs:
+            if name in result and not hasattr(result[name], '__iter__'):
+                err_msg = "Streaming CommandOut %s is not iterable in %s" % (
+                        name, plan.ClassStr)
+                self._logger.fatal(err_msg)
+                raise InvalidReturnTypeError(err_msg)
+
+        if plan.OutputNames.issuperset(result) and \
+                len(result) == len(plan.OutputNames):
+            return
+
+        for name in plan.OutputOrder:
+            if name not in result:
+                err_msg = "CommandOut %s not in %s" % (name, plan.ClassStr)
                 self._logger.fatal(err_msg)
                 raise UnknownParameterError(err_msg)
         for k in result:
-            if k not in self.CommandOuts:
-                err_msg = "Unknown CommandOut %s in %s" % (k, self_str)
+            if k not in plan.OutputNames:
+                err_msg = "Unknown CommandOut %s in %s" % (k, plan.ClassStr)
                 self._logger.fatal(err_msg)
                 raise UnknownParameterError(err_msg)
 
     def _set_defaults(self, kwargs):
         """Set defaults for optional parameters"""
-        for p in self.CommandIns.values():
-            if not p.Required and p.Name not in kwargs:
-                kwargs[p.Name] = p.Default
+        for name, default in self._get_validation_plan().Defaults:
+            if name not in kwargs:
+                kwargs[name] = default
 
     def run(self, **kwargs):
         """Exexcute a ``Command``
@@ -212,6 +622,18 @@ class Command(object):
         """
         raise NotImplementedError("All subclasses must implement run.")
 
+def _holds_shared_memory(result):
+    """Return True if ``result`` holds values mapped by ``run_in_process``
+
+    Interfaces release those once the output handlers have run, so they
+    must not be cached.
+    """
+    # Only results of run_in_process can hold them, and it imports the
+    # module; avoid importing multiprocessing for every other Command.
+    sharedmem = sys.modules.get('pyqi.core.sharedmem')
+    return sharedmem is not None and \
+            any(sharedmem.is_shared(value) for value in result.values())
+
 # I do not like this
 def make_command_in_collection_lookup_f(obj):
     """Return a function for convenient ``CommandIns`` lookup.
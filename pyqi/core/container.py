@@ -11,6 +11,17 @@
 __credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
                "Jai Ram Rideout"]
 
+import os
+import mmap
+import atexit
+import weakref
+from contextlib import contextmanager
+from threading import Lock, RLock
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from pyqi.core.cache import estimate_value_size
+from pyqi.util import is_py2
+
 class ContainerError(Exception):
     pass
  
@@ -63,8 +74,15 @@ class Passthrough(object):
 class PassthroughIO(Passthrough):
     _reserved = set(['_reserved', 'TypeName', '_reader', '_writer',
                      '_object', 'InPath', 'OutPath','read', 'write',
-                     '_load_if_needed', 'Info'])
+                     '_load_if_needed', 'Info', '_pool', '_load',
+                     '_unload', '_pins', 'unwrap', 'unwrapped',
+                     '_cached', '_recent'])
     TypeName = "PassthroughIO"
+    _pool = None
+    _pins = 0
+    _cached = ()
+    # A one item list set when a pooled container is used, see ContainerPool
+    _recent = None
      
     def __init__(self, *args, **kwargs):
         super(PassthroughIO, self).__init__(*args, **kwargs)
@@ -88,16 +106,100 @@ class PassthroughIO(Passthrough):
         """Load if the object has not already been loaded"""
         if self._object is None:
             if self.InPath is not None:
-                self._object = self._reader(self, self.InPath)
+                self._load()
             else:
                 raise CannotReadError("No object and InPath is None.")
-    
+        elif self._pool is not None:
+            self._pool._accessed(self)
+
+    def __getattr__(self, attr):
+        """Pass through to contained class if the attribute is not recognized
+
+        Once the object is loaded, methods bound to it are stored on the
+        container, so later calls don't go through ``__getattr__``. They are
+        dropped when any attribute is set through the container, which
+        includes a pool dropping the object. Pooled containers store them
+        wrapped so that calls still count as uses.
+        """
+        if attr in self._reserved:
+            return object.__getattribute__(self, attr)
+
+        obj = self._object
+        if obj is None:
+            self._load_if_needed()
+            return getattr(self._object, attr)
+
+        pool = self._pool
+        if pool is not None:
+            pool._accessed(self)
+
+        value = getattr(obj, attr)
+        if getattr(value, '__self__', None) is obj:
+            if pool is None:
+                self.__dict__[attr] = value
+            else:
+                self.__dict__[attr] = _pooled_method(value, self._recent,
+                                                     pool)
+            self.__dict__['_cached'] = self._cached + (attr,)
+        return value
+
+    def __setattr__(self, attr, val):
+        """Pass through to contained class if the attribute is not recognized"""
+        if self._cached:
+            for name in self._cached:
+                self.__dict__.pop(name, None)
+            self.__dict__['_cached'] = ()
+
+        super(PassthroughIO, self).__setattr__(attr, val)
+
+    def unwrap(self):
+        """Return the contained object, loading it if needed
+
+        Using the object directly avoids the cost of passing each attribute
+        access through the container, which adds up in tight loops.
+        """
+        self._load_if_needed()
+        return self._object
+
+    @contextmanager
+    def unwrapped(self):
+        """Hand out the contained object for the duration of a with block
+
+        Like ``unwrap``, but a ``ContainerPool`` won't drop the object while
+        the block runs::
+
+            with container.unwrapped() as table:
+                for row in table:
+                    ...
+        """
+        pool = self._pool
+        if pool is None:
+            yield self.unwrap()
+            return
+
+        with pool._lock:
+            self._pins += 1
+        try:
+            yield self.unwrap()
+        finally:
+            with pool._lock:
+                self._pins -= 1
+
     def read(self):
         """Attempt to read"""
         if self._object is None:
             if self.InPath is None:
                 raise CannotReadError("InPath is None.")
-            self._object = self._reader(self, self.InPath)
+            self._load()
+
+    def _load(self):
+        self._object = self._reader(self, self.InPath)
+        if self._pool is not None:
+            self._pool._loaded(self)
+
+    def _unload(self):
+        """Drop the object; it is read from ``InPath`` again when needed"""
+        self._object = None
 
     def write(self):
         """Attempt to write"""
@@ -109,6 +211,14 @@ class PassthroughIO(Passthrough):
             self._writer(self, self.OutPath)
             self._object = None
 
+def _pooled_method(method, recent, pool):
+    """Wrap a method of a pooled object so that calls mark it as used"""
+    def call(*args, **kwargs):
+        recent[0] = True
+        pool.Hits += 1
+        return method(*args, **kwargs)
+    return call
+
 class PassthroughRead(PassthroughIO):
     def __init__(self, *args, **kwargs):
         if 'reader' in kwargs:
@@ -151,28 +261,304 @@ class ImmediateWrite(PassthroughWrite):
         super(ImmediateWrite, self).__init__(*args, **kwargs)
         self.write()    
 
+class MappedRead(PassthroughRead):
+    """Map ``InPath`` when an object attribute is requested
+
+    ``reader`` defaults to ``read_mmap``; ``read_buffer`` can be given
+    instead. Unlike the other containers, these forward indexing, slicing
+    and ``len`` to the map.
+    """
+    TypeName = "MappedRead"
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('reader', read_mmap)
+        super(MappedRead, self).__init__(*args, **kwargs)
+
+    def __getitem__(self, key):
+        """Index or slice the contained object"""
+        self._load_if_needed()
+
+        return self._object[key]
+
+    def __len__(self):
+        """Return the length of the contained object"""
+        self._load_if_needed()
+
+        return len(self._object)
+
+    def __bool__(self):
+        """The container is always true, even if their object has no length
+
+        Without this, ``__len__`` would make ``if container:`` read the
+        object, and fail if there is nothing to read.
+        """
+        return True
+
+    __nonzero__ = __bool__
+
+class PrefetchRead(PassthroughRead):
+    """Start reading in the background on construction
+
+    The read runs on a shared pool of ``PREFETCH_THREADS`` I/O threads (see
+    ``get_prefetch_pool``), or on ``executor`` (anything with a
+    ``ThreadPool``-like ``apply_async``) if one is given. The first access
+    to the object waits for the read to finish, raising any exception the
+    reader raised. Creating a container per input up front lets the reads
+    of later inputs overlap with work on earlier ones.
+    """
+    _reserved = PassthroughRead._reserved | set(['_pending'])
+    TypeName = "PrefetchRead"
+    _pending = None
+
+    def __init__(self, *args, **kwargs):
+        super(PrefetchRead, self).__init__(*args, **kwargs)
+
+        if self._object is None and self.InPath is not None:
+            executor = kwargs.get('executor')
+            if executor is None:
+                executor = get_prefetch_pool()
+            self._pending = executor.apply_async(self._reader,
+                                                 (self, self.InPath))
+
+    def _load(self):
+        pending = self._pending
+        if pending is None:
+            # Not prefetched, or reloading after being dropped by a pool.
+            return super(PrefetchRead, self)._load()
+
+        self._pending = None
+        self._object = pending.get()
+        if self._pool is not None:
+            self._pool._loaded(self)
+
+# Threads reading PrefetchRead containers.
+PREFETCH_THREADS = 4
+
+_prefetch_pool = None
+_prefetch_pool_pid = None
+_prefetch_pool_lock = Lock()
+
+def get_prefetch_pool():
+    """Return the thread pool that ``PrefetchRead`` containers read on"""
+    global _prefetch_pool, _prefetch_pool_pid
+    with _prefetch_pool_lock:
+        # Threads don't survive a fork, so forked children need their own.
+        if _prefetch_pool is None or _prefetch_pool_pid != os.getpid():
+            _prefetch_pool = ThreadPool(PREFETCH_THREADS)
+            _prefetch_pool_pid = os.getpid()
+            atexit.register(_close_prefetch_pool, _prefetch_pool,
+                            _prefetch_pool_pid)
+        return _prefetch_pool
+
+def _close_prefetch_pool(pool, pid):
+    """Let outstanding reads finish and stop the threads at exit"""
+    # A pool inherited across a fork has no threads in the child.
+    if os.getpid() == pid:
+        pool.close()
+        pool.join()
+
+class ContainerPool(object):
+    """Keep the objects loaded by read containers within a memory budget
+
+    Containers added to the pool (see ``add``) are tracked once their object
+    is loaded. When the estimated size of the loaded objects exceeds
+    ``max_bytes``, the objects of containers that haven't been used recently
+    are dropped; they are read from ``InPath`` again the next time they are
+    needed. Recency is approximated with the "second chance" (clock)
+    algorithm, so that using a loaded object only sets a flag on its
+    container rather than taking a lock and reordering the pool. Sizes are
+    estimated with ``size_of``, which defaults to
+    ``pyqi.core.cache.estimate_value_size``, so they are approximate. An
+    object larger than the whole budget stays loaded until another one is
+    loaded.
+
+    ``Hits`` counts accesses to loaded objects, ``Misses`` loads and
+    ``Evictions`` objects dropped to stay within the budget. ``Hits`` is
+    updated without locking, so it may undercount accesses made from
+    several threads at once.
+
+    The pool is thread-safe, but a container whose object is dropped while
+    another thread is using it raises ``AttributeError``, so containers
+    should not be shared between threads that load other pooled containers
+    unless the object is used through ``PassthroughIO.unwrapped``, which
+    keeps it loaded until the with block exits.
+    """
+
+    def __init__(self, max_bytes, size_of=None):
+        self.MaxBytes = max_bytes
+        self.Hits = 0
+        self.Misses = 0
+        self.Evictions = 0
+        self.Bytes = 0
+        self._size_of = estimate_value_size if size_of is None else size_of
+        # id(container) -> (weak reference to the container, object size),
+        # in the order the clock hand visits them
+        self._entries = OrderedDict()
+        # Reentrant, as dropping a container can run _forget.
+        self._lock = RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, container):
+        """Manage ``container``'s object with this pool, returning it"""
+        if not isinstance(container, PassthroughRead):
+            raise ContainerError("Only read containers can be pooled.")
+        if container.InPath is None:
+            raise ContainerError("Pooled containers need an InPath to "
+                                 "reload from.")
+        if container._pool is not None:
+            raise ContainerError("The container is already pooled.")
+
+        container._pool = self
+        container._recent = [False]
+        if container._object is not None:
+            with self._lock:
+                self._loaded_locked(container)
+        return container
+
+    def clear(self):
+        """Drop the objects of all pooled containers, keeping the counters"""
+        with self._lock:
+            while self._entries:
+                self._evict(force=True)
+
+    def stats(self):
+        """Return the pool counters as a dict"""
+        with self._lock:
+            return {'loaded': len(self._entries), 'bytes': self.Bytes,
+                    'hits': self.Hits, 'misses': self.Misses,
+                    'evictions': self.Evictions}
+
+    def _accessed(self, container):
+        if id(container) not in self._entries:
+            with self._lock:
+                # The object was set without going through the pool.
+                if container._object is not None:
+                    self._loaded_locked(container)
+            return
+
+        container._recent[0] = True
+        self.Hits += 1
+
+    def _loaded(self, container):
+        with self._lock:
+            self.Misses += 1
+            self._loaded_locked(container)
+
+    def _loaded_locked(self, container):
+        key = id(container)
+        if key in self._entries:
+            self.Bytes -= self._entries.pop(key)[1]
+
+        # Make room before adding the entry, so that containers given a
+        # second chance while doing so stay ahead of it.
+        size = self._size_of(container._object)
+        self.Bytes += size
+        while self.Bytes > self.MaxBytes and self._entries:
+            if not self._evict():
+                break
+
+        self._entries[key] = (weakref.ref(container,
+                                         lambda ref: self._forget(key, ref)),
+                             size)
+        container._recent[0] = False
+
+    def _evict(self, force=False):
+        """Drop an object not used recently, returning False if none was
+
+        Containers are visited in turn, and one used since the last visit
+        gets a second chance: its flag is cleared and it goes to the back.
+        Unless ``force`` is set, objects in use through ``unwrapped`` are
+        kept.
+        """
+        entries = self._entries
+        if force:
+            key = next(iter(entries))
+        else:
+            # Two rounds clear every flag, so if nothing was dropped by then
+            # everything is pinned.
+            for _ in range(2 * len(entries)):
+                key = next(iter(entries))
+                container = entries[key][0]()
+                if container is None:
+                    break
+                if not container._pins:
+                    if not container._recent[0]:
+                        break
+                    container._recent[0] = False
+                entries[key] = entries.pop(key)
+            else:
+                return False
+
+        ref, size = entries.pop(key)
+        self.Bytes -= size
+        self.Evictions += 1
+        container = ref()
+        if container is not None:
+            container._unload()
+        return True
+
+    def _forget(self, key, ref):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is ref:
+                del self._entries[key]
+                self.Bytes -= entry[1]
+
 def default_write_str(obj, path):
-    f = open(path,'w')
-    f.write(str(obj._object))
-    f.close()
+    with open(path, 'w') as f:
+        f.write(str(obj._object))
 
 def default_read_str(obj, path):
-    f = open(path)
-    return f.read()
+    with open(path) as f:
+        return f.read()
 
 def default_write_object(obj, path):
-    f = open(path, 'w')
-    f.write(repr(obj._object))
-    f.close()
+    with open(path, 'w') as f:
+        f.write(repr(obj._object))
 
 def default_read_object(obj, path):
-    f = open(path)
-    return f.read() # eval isn't safe...
+    with open(path) as f:
+        return f.read() # eval isn't safe...
+
+def read_mmap(obj, path):
+    """Map the file read-only, returning an ``mmap.mmap``
+
+    The file's contents are paged in from the page cache as they are used
+    rather than copied onto the heap. The map can be sliced (copying only
+    the slice), searched with ``find`` and ``rfind`` or regular expressions,
+    and read line by line with ``readline``. Empty files, which can't be
+    mapped, are read as ``b''``.
+    """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        # The map stays valid after the file is closed.
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def read_buffer(obj, path):
+    """Map the file read-only, returning a read-only ``memoryview``
+
+    Slicing the view doesn't copy; see ``read_mmap``. Requires Python 3, as
+    Python 2's ``mmap.mmap`` can't back a ``memoryview``.
+    """
+    if is_py2():
+        raise CannotReadError("read_buffer requires Python 3; use read_mmap "
+                              "instead.")
+    return memoryview(read_mmap(obj, path))
+
+def write_buffer(obj, path):
+    """Write a bytes-like object to a file unchanged"""
+    with open(path, 'wb') as f:
+        f.write(obj._object)
 
 IOType = {'ImmediateRead':ImmediateRead,
             'ImmediateWrite':ImmediateWrite,
             'DelayRead':DelayRead,
-            'DelayWrite':DelayWrite}
+            'DelayWrite':DelayWrite,
+            'MappedRead':MappedRead,
+            'PrefetchRead':PrefetchRead}
 
 IOLookup = {str:(default_read_str, default_write_str)}
 
@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+
+"""Pre-warmed driver daemon
+
+Every invocation of a pyqi driver pays for interpreter startup and for
+importing the command config package before a command does any work. A
+driver daemon pays those costs once: it preloads a command config package
+and then listens on a Unix domain socket. Each request carries the client's
+argv, working directory and environment, plus its stdin, stdout and stderr
+file descriptors. The daemon forks a child, which inherits the warm imports,
+attaches the client's stdio, runs the driver script (including its exit
+handlers) and reports its exit status back to the client. SIGINT and SIGTERM
+received by the client are forwarded to the child.
+
+The client side (``forward_to_daemon``) only needs the standard library, so
+a driver can try it before importing anything else and fall back to running
+in-process when no daemon is listening. Passing file descriptors requires
+``socket.sendmsg`` (Python 3.3+) on a POSIX system.
+"""
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import os
+import sys
+import json
+import atexit
+import errno
+import signal
+import socket
+import struct
+from array import array
+
+# Environment variable naming the socket of a running daemon. Drivers forward
+# to the daemon only when it is set.
+DAEMON_SOCKET_ENV = 'PYQI_DAEMON_SOCKET'
+
+_HEADER = struct.Struct('!I')
+_STDIO_FDS = (0, 1, 2)
+_FORWARDED_SIGNALS = (signal.SIGINT, signal.SIGTERM)
+
+class DaemonError(Exception):
+    pass
+
+def daemon_supported():
+    """Return True if file descriptors can be passed over Unix sockets"""
+    return hasattr(socket, 'AF_UNIX') and hasattr(socket.socket, 'sendmsg')
+
+def forward_to_daemon(socket_path, argv):
+    """Run ``argv`` in the daemon listening on ``socket_path``
+
+    Returns the exit status of the command, or ``None`` if no daemon could
+    be reached (in which case the caller should run the command itself).
+    Once the request has been sent the command may have run, so failures
+    after that point are reported on stderr and return a non-zero status
+    rather than ``None``. SIGINT and SIGTERM received while waiting are
+    forwarded to the process running the command.
+    """
+    if not daemon_supported():
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(socket_path)
+        except socket.error:
+            return None
+
+        # Make sure nothing buffered in this process is written after the
+        # daemon's output.
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        request = json.dumps({'argv': list(argv),
+                              'cwd': os.getcwd(),
+                              'env': dict(os.environ)}).encode('utf-8')
+        fds = array('i', _STDIO_FDS)
+        try:
+            sock.sendmsg([_HEADER.pack(len(request)), request],
+                         [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                           fds.tobytes())])
+        except socket.error:
+            # Nothing reached the daemon, so the command hasn't run.
+            return None
+
+        return _wait_for_reply(sock)
+    finally:
+        sock.close()
+
+def _wait_for_reply(sock):
+    """Wait for the exit status of a forwarded command"""
+    received = []
+    previous = {}
+    try:
+        try:
+            pid = _recv_message(sock)['pid']
+        except (socket.error, DaemonError, KeyError, ValueError) as e:
+            sys.stderr.write("The pyqi daemon did not start the command: "
+                             "%s\n" % e)
+            return 1
+
+        def forward(signum, frame):
+            received.append(signum)
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+
+        for signum in _FORWARDED_SIGNALS:
+            previous[signum] = signal.signal(signum, forward)
+
+        try:
+            return _recv_message(sock)['status']
+        except (socket.error, DaemonError, KeyError, ValueError) as e:
+            if received:
+                # The command was killed by a signal we forwarded.
+                return 128 + received[-1]
+            sys.stderr.write("The command run by the pyqi daemon did not "
+                             "report an exit status: %s\n" % e)
+            return 1
+    finally:
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+
+def serve(socket_path, command_config_module, driver_script=None):
+    """Preload a command config package and serve driver requests forever
+
+    ``driver_script`` is the driver executed for each request; it defaults
+    to the script running in ``__main__`` (i.e., the driver that started the
+    daemon).
+    """
+    if not daemon_supported():
+        raise DaemonError("The pyqi daemon requires Python 3.3+ on a POSIX "
+                          "system.")
+
+    if driver_script is None:
+        driver_script = sys.modules['__main__'].__file__
+    driver_code = _preload(command_config_module, driver_script)
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # Only the daemon's user may connect; creating the socket with these
+    # permissions leaves no window in which others can.
+    old_umask = os.umask(0o077)
+    try:
+        listener.bind(socket_path)
+    finally:
+        os.umask(old_umask)
+    listener.listen(128)
+
+    # Children are reaped automatically; they report their exit status over
+    # the client connection rather than to us. SIGTERM unwinds normally so
+    # that the socket is removed.
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, _terminate)
+
+    try:
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except socket.error as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+
+            sys.stdout.flush()
+            sys.stderr.flush()
+            pid = os.fork()
+
+            if pid == 0:
+                listener.close()
+                signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                try:
+                    _handle_request(conn, driver_code, driver_script)
+                finally:
+                    # Skip the daemon's cleanup (e.g., removing the socket);
+                    # the request's exit handlers have already run.
+                    os._exit(0)
+            else:
+                conn.close()
+    finally:
+        listener.close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+    return 'Daemon stopped'
+
+def _terminate(signum, frame):
+    raise SystemExit(0)
+
+def _preload(command_config_module, driver_script):
+    """Import everything a request might need, return the compiled driver"""
+    from pyqi.core.interface import get_command_names, get_command_config
+
+    for cmd in get_command_names(command_config_module):
+        get_command_config(command_config_module, cmd, exit_on_failure=False)
+
+    with open(driver_script) as f:
+        driver_code = compile(f.read(), driver_script, 'exec')
+
+    # Run the driver's module-level imports now, without running its main
+    # block, so that every request starts with them loaded.
+    exec(driver_code, {'__name__': '__pyqi_driver__',
+                       '__file__': driver_script})
+
+    return driver_code
+
+def _handle_request(conn, driver_code, driver_script):
+    """Run a single request in a forked child"""
+    fds = []
+    try:
+        request, fds = _recv_request(conn)
+    except (socket.error, DaemonError, ValueError):
+        for fd in fds:
+            os.close(fd)
+        return
+
+    for target, fd in zip(_STDIO_FDS, fds):
+        os.dup2(fd, target)
+        os.close(fd)
+
+    os.chdir(request['cwd'])
+    os.environ.clear()
+    os.environ.update(request['env'])
+    # The driver must run the command here rather than forwarding it again.
+    os.environ.pop(DAEMON_SOCKET_ENV, None)
+    sys.argv[:] = request['argv']
+
+    # Let the client forward signals to this process.
+    try:
+        _send_message(conn, {'pid': os.getpid()})
+    except socket.error:
+        return
+
+    status = 0
+    try:
+        exec(driver_code, {'__name__': '__main__', '__file__': driver_script})
+    except SystemExit as e:
+        status = _exit_status(e.code)
+    except BaseException:
+        import traceback
+        traceback.print_exc()
+        status = 1
+
+    # Run what the interpreter would run at exit (e.g., writing
+    # --pyqi-report files and flushing buffered loggers) before the client
+    # is told that the command finished.
+    atexit._run_exitfuncs()
+
+    try:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    except (IOError, OSError):
+        pass
+
+    try:
+        _send_message(conn, {'status': status})
+    except socket.error:
+        pass
+    conn.close()
+
+def _exit_status(code):
+    """Translate a ``SystemExit`` code the way the interpreter does"""
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    sys.stderr.write('%s\n' % code)
+    return 1
+
+def _recv_request(conn):
+    """Receive a request and the stdio file descriptors sent with it"""
+    fds = array('i')
+    msg, ancdata, _, _ = conn.recvmsg(
+            _HEADER.size, socket.CMSG_LEN(len(_STDIO_FDS) * fds.itemsize))
+
+    for level, type_, data in ancdata:
+        if level == socket.SOL_SOCKET and type_ == socket.SCM_RIGHTS:
+            usable = len(data) - (len(data) % fds.itemsize)
+            fds.frombytes(data[:usable])
+    fds = list(fds)
+
+    if len(msg) != _HEADER.size or len(fds) != len(_STDIO_FDS):
+        raise DaemonError("Malformed request.")
+
+    length, = _HEADER.unpack(msg)
+    return json.loads(_recv_exactly(conn, length).decode('utf-8')), fds
+
+def _send_message(sock, message):
+    """Send a length-prefixed JSON message"""
+    data = json.dumps(message).encode('utf-8')
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+def _recv_message(sock):
+    """Receive a length-prefixed JSON message"""
+    length, = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return json.loads(_recv_exactly(sock, length).decode('utf-8'))
+
+def _recv_exactly(sock, size):
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = sock.recv(remaining)
+        if not chunk:
+            raise DaemonError("Connection closed unexpectedly.")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
@@ -20,6 +20,12 @@ class IncompetentDeveloperError(CommandError):
 class MissingParameterError(CommandError):
     pass
 
+class CommandCancelledError(CommandError):
+    pass
+
+class CommandTimeoutError(CommandCancelledError):
+    pass
+
 class InvalidReturnTypeError(IncompetentDeveloperError):
     pass
 
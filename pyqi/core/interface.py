@@ -11,15 +11,34 @@
 __credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
                "Jai Ram Rideout", "Evan Bolyen"]
 
+import sys
 import importlib
 from sys import exit, stderr
 from glob import glob
 from os.path import basename, dirname, expanduser, join
 from pyqi.core.exception import IncompetentDeveloperError
 
+def _release_shared(cmd_result, output):
+    """Unmap shared memory in ``cmd_result`` that isn't part of ``output``
+
+    Only values returned by ``pyqi.core.sharedmem.run_in_process`` hold
+    shared memory, and it imports that module, so interfaces don't need to
+    import it (and ``multiprocessing``) otherwise.
+    """
+    sharedmem = sys.modules.get('pyqi.core.sharedmem')
+    if sharedmem is not None:
+        sharedmem.release_shared(cmd_result, keep=output)
+
 class Interface(object):
     CommandConstructor = None
 
+    # Callables wrapping every phase of an interface call; see _run_phase.
+    PhaseHooks = ()
+
+    # If set, overrides the Command's Timeout (in seconds) for calls made
+    # through this interface; see pyqi.core.cancellation.
+    Timeout = None
+
     def __init__(self, **kwargs):
         """ """
         self.CmdInstance = None
@@ -29,16 +48,85 @@ class Interface(object):
                                             "without a CommandConstructor.")
 
         self.CmdInstance = self.CommandConstructor(**kwargs)
+        if self.Timeout is not None:
+            self.CmdInstance.Timeout = self.Timeout
 
         self._validate_usage_examples(self._get_usage_examples())
         self._validate_inputs_outputs(self._get_inputs(), self._get_outputs())
     
     def __call__(self, in_, *args, **kwargs):
-        self._the_in_validator(in_)
-        cmd_input = self._input_handler(in_, *args, **kwargs)
-        cmd_result = self.CmdInstance(**cmd_input)
-        self._the_out_validator(cmd_result)
-        return self._output_handler(cmd_result)
+        self._run_phase('in_validator', self._the_in_validator, in_)
+        cmd_input = self._run_phase('input_handler', self._input_handler, in_,
+                                    *args, **kwargs)
+        cmd_result = self._run_phase('command', self.CmdInstance, **cmd_input)
+        self._run_phase('out_validator', self._the_out_validator, cmd_result)
+        output = self._run_phase('output_handler', self._output_handler,
+                                 cmd_result)
+        # The output handlers are done with any shared memory in the result.
+        _release_shared(cmd_result, output)
+        return output
+
+    def acall(self, in_, *args, **kwargs):
+        """Return a coroutine that runs this interface like ``__call__``
+
+        If the interface implements ``_prepare_input_handlers`` and
+        ``_prepare_output_handlers``, the input ``Handler``s run concurrently,
+        as do the output ``Handler``s, so that handlers doing I/O overlap.
+        Otherwise the input and output handling run in an executor as a
+        whole. Requires Python 3.5+; see ``pyqi.core.aio``.
+        """
+        from pyqi.core.aio import interface_acall
+        return interface_acall(self, in_, args, kwargs)
+
+    def _prepare_input_handlers(self, in_, *args, **kwargs):
+        """Split input handling into values and deferred ``Handler`` calls
+
+        Returns ``(cmd_input, handler_calls)``, where ``handler_calls`` is a
+        list of ``(CommandIn name, phase, handler, handler_args)``; the
+        ``Command`` input is ``cmd_input`` updated with the result of each
+        call. Interfaces that can't split their input handling this way
+        return ``None``.
+        """
+        return None
+
+    def _prepare_output_handlers(self, results):
+        """Return output ``Handler`` calls, or ``None``
+
+        Returns a list of ``(result key, phase, handler, handler_args)``;
+        the interface's output maps each key to the result of its call.
+        Interfaces that can't split their output handling this way return
+        ``None``.
+        """
+        return None
+
+    def add_phase_hook(self, hook):
+        """Wrap every phase of this interface's calls with ``hook``
+
+        ``hook`` is called as ``hook(interface, phase, f, *args, **kwargs)``
+        and must call ``f(*args, **kwargs)`` and return its result. Hooks can
+        also be installed for all instances of an interface class by setting
+        the ``PhaseHooks`` class attribute.
+        """
+        self.PhaseHooks = tuple(self.PhaseHooks) + (hook,)
+
+    def _run_phase(self, phase, f, *args, **kwargs):
+        """Run one phase of an interface call, returning ``f``'s result
+
+        ``phase`` names the step being run, e.g. ``'input_handler'`` or
+        ``'command'``. Phases may nest (e.g., an interface's ``'parse'`` phase
+        runs inside its ``'input_handler'`` phase), and each ``Handler``
+        applied to an input or output runs as a phase named
+        ``'input_handler:<option name>'`` or ``'output_handler:<result
+        name>'``. The ``PhaseHooks`` are applied in order, the first being
+        outermost.
+        """
+        if not self.PhaseHooks:
+            return f(*args, **kwargs)
+
+        for hook in reversed(self.PhaseHooks):
+            f = _bind_hook(hook, self, phase, f)
+
+        return f(*args, **kwargs)
 
     def _validate_usage_examples(self, usage_examples):
         """Perform validation on a list of ``InterfaceUsageExample`` objects.
@@ -133,6 +221,12 @@ class Interface(object):
         """
         raise NotImplementedError("Must define _get_version")
 
+def _bind_hook(hook, interface, phase, f):
+    """Return a function calling ``f`` through a phase hook"""
+    def hooked(*args, **kwargs):
+        return hook(interface, phase, f, *args, **kwargs)
+    return hooked
+
 class InterfaceOption(object):
     """Describes an option and what to do with it
     
@@ -28,6 +28,7 @@ from glob import glob
 from os.path import abspath, exists, isdir, isfile, split
 from pyqi.core.interface import (Interface, InterfaceOutputOption, InterfaceInputOption,
                                  InterfaceUsageExample, get_command_names, get_command_config)
+from pyqi.core.interface import _release_shared
 from pyqi.core.factory import general_factory
 from pyqi.core.exception import IncompetentDeveloperError
 from pyqi.core.command import Parameter
@@ -197,17 +198,34 @@ class HTMLInterface(Interface):
 
     #Override
     def __call__(self, in_, *args, **kwargs):
-        self._the_in_validator(in_)
-        cmd_input, errors = self._input_handler(in_, *args, **kwargs)
+        self._run_phase('in_validator', self._the_in_validator, in_)
+        cmd_input, errors = self._run_phase('input_handler',
+                                            self._input_handler, in_, *args,
+                                            **kwargs)
         if errors:
             return {
                     'type': 'error',
                     'errors': errors
                 }
         else:
-            cmd_result = self.CmdInstance(**cmd_input)
-            self._the_out_validator(cmd_result)
-            return self._output_handler(cmd_result)
+            cmd_result = self._run_phase('command', self.CmdInstance,
+                                         **cmd_input)
+            self._run_phase('out_validator', self._the_out_validator,
+                            cmd_result)
+            output = self._run_phase('output_handler', self._output_handler,
+                                     cmd_result)
+            _release_shared(cmd_result, output)
+            return output
+
+    #Override
+    def acall(self, in_, *args, **kwargs):
+        """Return a coroutine that runs ``__call__`` in an executor
+
+        Form errors short-circuit the call, so the form is handled as a
+        whole rather than with concurrent handlers.
+        """
+        from pyqi.core.aio import run_in_executor
+        return run_in_executor(self, in_, *args, **kwargs)
 
     def _validate_inputs_outputs(self, inputs, outputs):
         super(HTMLInterface, self)._validate_inputs_outputs(inputs, outputs)
@@ -271,7 +289,9 @@ class HTMLInterface(Interface):
                 if option.Handler is None:
                     value = formatted_input[option.Name]
                 else:
-                    value = option.Handler(formatted_input[option.Name])
+                    value = self._run_phase('input_handler:%s' % option.Name,
+                                            option.Handler,
+                                            formatted_input[option.Name])
 
                 cmd_input_kwargs[param_name] = value
 
@@ -320,12 +340,14 @@ class HTMLInterface(Interface):
         output = self._get_outputs()[0]
 
         rk = output.Name
+        phase = 'output_handler:%s' % rk
         if output.Handler is not None:
             if output.InputName is None:
-                handled_results = output.Handler(rk, results[rk])
+                handled_results = self._run_phase(phase, output.Handler, rk,
+                                                  results[rk])
             else:
-                handled_results = output.Handler(rk, results[rk],
-                    self._html_interface_input[output.InputName])
+                handled_results = self._run_phase(phase, output.Handler, rk,
+                    results[rk], self._html_interface_input[output.InputName])
         else:
             handled_results = results[rk]
 
@@ -122,36 +122,53 @@ class OptparseInterface(Interface):
 
     def _input_handler(self, in_, *args, **kwargs):
         """Parses command-line input."""
-        required_opts = [opt for opt in self._get_inputs() if opt.Required]
-        optional_opts = [opt for opt in self._get_inputs() if not opt.Required]
+        cmd_input_kwargs, handler_calls = self._prepare_input_handlers(in_)
 
-        # Build the usage and version strings
-        usage = self._build_usage_lines(required_opts)
-        version = 'Version: %prog ' + self._get_version()
+        for param_name, phase, handler, handler_args in handler_calls:
+            cmd_input_kwargs[param_name] = self._run_phase(phase, handler,
+                                                           *handler_args)
 
-        # Instantiate the command line parser object
-        parser = OptionParser(usage=usage, version=version)
+        return cmd_input_kwargs
+
+    def _prepare_input_handlers(self, in_, *args, **kwargs):
+        """Parse command-line input, deferring the option ``Handler``s"""
+        self._optparse_input = self._run_phase('parse', self.parse_input, in_)
+
+        # Build up command input dictionary. This will be passed to
+        # Command.__call__ as kwargs.
+        cmd_input_kwargs = {}
+        handler_calls = []
+        for option in self._get_inputs():
+            if option.Parameter is not None:
+                param_name = option.getParameterName()
+                optparse_clean_name = \
+                        self._get_optparse_clean_name(option.Name)
+                value = self._optparse_input[optparse_clean_name]
+
+                if option.Handler is None:
+                    cmd_input_kwargs[param_name] = value
+                else:
+                    handler_calls.append((param_name,
+                                          'input_handler:%s' % option.Name,
+                                          option.Handler, (value,)))
+
+        return cmd_input_kwargs, handler_calls
+
+    def parse_input(self, in_):
+        """Parse a list of command-line arguments without handling them
+
+        Returns a dict mapping optparse destination names (option names with
+        dashes converted to underscores) to the parsed option values. Input
+        ``Handler``s are not applied.
+        """
+        parser, required = self._build_parser()
 
         # If the command has required options and no input arguments were
         # provided, print the help string.
-        if len(required_opts) > 0 and self.HelpOnNoArguments and len(in_) == 0:
+        if required is not None and self.HelpOnNoArguments and len(in_) == 0:
             parser.print_usage()
             return parser.exit(-1)
 
-        if required_opts:
-            # Define an option group so all required options are grouped
-            # together and under a common header.
-            required = OptionGroup(parser, "REQUIRED options",
-                                   "The following options must be provided "
-                                   "under all circumstances.")
-            for ro in required_opts:
-                required.add_option(ro.getOptparseOption())
-            parser.add_option_group(required)
-
-        # Add the optional options.
-        for oo in optional_opts:
-            parser.add_option(oo.getOptparseOption())
-
         #####
         # THIS IS THE NATURAL BREAKING POINT FOR THIS FUNCTIONALITY
         #####
@@ -167,7 +184,7 @@ class OptparseInterface(Interface):
              " (e.g.: include the '-i' in '-i INPUT_DIR')")
 
         # Test that all required options were provided.
-        if required_opts:
+        if required is not None:
             # dest may be different from the original option name because
             # optparse converts names from dashed to underscored.
             required_option_ids = [(o.dest, o.get_opt_string())
@@ -176,26 +193,46 @@ class OptparseInterface(Interface):
                 if getattr(opts, required_dest) is None:
                     parser.error('Required option %s omitted.' % required_name)
 
-        # Build up command input dictionary. This will be passed to
-        # Command.__call__ as kwargs.
-        self._optparse_input = opts.__dict__
+        return opts.__dict__
 
-        cmd_input_kwargs = {}
-        for option in self._get_inputs():
-            if option.Parameter is not None:
-                param_name = option.getParameterName()
-                optparse_clean_name = \
-                        self._get_optparse_clean_name(option.Name)
+    def _build_parser(self, prog=None):
+        """Build the ``OptionParser`` for this interface's inputs.
 
-                if option.Handler is None:
-                    value = self._optparse_input[optparse_clean_name]
-                else:
-                    value = option.Handler(
-                            self._optparse_input[optparse_clean_name])
+        Returns the parser and the ``OptionGroup`` holding the required
+        options (``None`` if there are no required options). ``prog``
+        overrides the program name substituted for ``%prog``.
+        """
+        required_opts = [opt for opt in self._get_inputs() if opt.Required]
+        optional_opts = [opt for opt in self._get_inputs() if not opt.Required]
 
-                cmd_input_kwargs[param_name] = value
+        # Build the usage and version strings
+        usage = self._build_usage_lines(required_opts)
+        version = 'Version: %prog ' + self._get_version()
 
-        return cmd_input_kwargs
+        # Instantiate the command line parser object
+        parser = OptionParser(usage=usage, version=version, prog=prog)
+
+        required = None
+        if required_opts:
+            # Define an option group so all required options are grouped
+            # together and under a common header.
+            required = OptionGroup(parser, "REQUIRED options",
+                                   "The following options must be provided "
+                                   "under all circumstances.")
+            for ro in required_opts:
+                required.add_option(ro.getOptparseOption())
+            parser.add_option_group(required)
+
+        # Add the optional options.
+        for oo in optional_opts:
+            parser.add_option(oo.getOptparseOption())
+
+        return parser, required
+
+    def format_help(self, prog=None):
+        """Return the full help text that ``-h`` would print"""
+        parser, _ = self._build_parser(prog=prog)
+        return parser.format_help()
 
     def _build_usage_lines(self, required_options):
         """ Build the usage string from components """
@@ -237,19 +274,32 @@ class OptparseInterface(Interface):
         """Deal with things in output if we know how"""
         handled_results = {}
 
+        for rk, phase, handler, handler_args in \
+                self._prepare_output_handlers(results):
+            handled_results[rk] = self._run_phase(phase, handler,
+                                                  *handler_args)
+
+        return handled_results
+
+    def _prepare_output_handlers(self, results):
+        """Return the output ``Handler`` calls to make for ``results``"""
+        handler_calls = []
+
         for output in self._get_outputs():
             rk = output.Name
+            phase = 'output_handler:%s' % rk
         
             if output.InputName is None:
-                handled_results[rk] = output.Handler(rk, results[rk])
+                handler_args = (rk, results[rk])
             else:
                 optparse_clean_name = \
                         self._get_optparse_clean_name(output.InputName)
                 opt_value = self._optparse_input[optparse_clean_name]
-                handled_results[rk] = output.Handler(rk, results[rk],
-                                                           opt_value)
+                handler_args = (rk, results[rk], opt_value)
 
-        return handled_results
+            handler_calls.append((rk, phase, output.Handler, handler_args))
+
+        return handler_calls
 
     def _get_optparse_clean_name(self, name):
         # optparse converts dashes to underscores in long option names.
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+"""Skipping command line invocations whose inputs haven't changed
+
+An invocation's fingerprint covers the ``Command`` (its class and the source
+of its module), the parsed command line options and the contents of every
+file given to an ``existing_filepath`` or ``existing_filepaths`` option.
+After a command runs, the fingerprint is stored in a sidecar file next to
+each ``new_filepath`` output (``<output>.pyqi_fingerprint``). The next
+identical invocation is skipped if every output and its sidecar are still in
+place, much like ``make`` skips targets that are up to date.
+
+Input files are hashed in full unless their size and modification time
+match what the sidecar recorded, in which case the recorded digest is
+reused.
+"""
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import os
+import sys
+import json
+import hashlib
+from os.path import abspath, dirname, exists
+from tempfile import mkstemp
+from pyqi.core.interfaces.optparse import optparse_main
+
+SIDECAR_SUFFIX = '.pyqi_fingerprint'
+
+INPUT_FILE_TYPES = ('existing_filepath', 'existing_filepaths')
+OUTPUT_FILE_TYPES = ('new_filepath',)
+
+class InvocationFingerprint(object):
+    """The fingerprint of a command line invocation
+
+    ``interface`` is an ``OptparseInterface`` instance and ``args`` the
+    command line arguments (without the program name). Input files are not
+    read until ``hash_inputs`` is called.
+    """
+    FormatVersion = 1
+
+    def __init__(self, interface, args):
+        opts = interface.parse_input(args)
+        cmd_class = interface.CmdInstance.__class__
+
+        self.Command = '%s.%s' % (cmd_class.__module__, cmd_class.__name__)
+        self.CommandSource = _digest_module(cmd_class.__module__)
+        self.Options = json.loads(json.dumps(opts, sort_keys=True,
+                                             default=repr))
+        self.Inputs = {}
+        self.InputPaths = []
+        self.Outputs = []
+
+        for option in interface._get_inputs():
+            value = opts.get(interface._get_optparse_clean_name(option.Name))
+            if value is None:
+                continue
+
+            if option.Type in INPUT_FILE_TYPES:
+                paths = value if isinstance(value, list) else [value]
+                self.InputPaths.extend(abspath(path) for path in paths)
+            elif option.Type in OUTPUT_FILE_TYPES:
+                self.Outputs.append(abspath(value))
+
+    def hash_inputs(self, previous=None):
+        """Record ``[size, mtime, digest]`` for each input file
+
+        Digests recorded in the stored fingerprint ``previous`` are reused
+        for files whose size and modification time haven't changed.
+        """
+        known_inputs = {}
+        if previous is not None:
+            known_inputs = previous.get('Inputs') or {}
+
+        for path in self.InputPaths:
+            self.Inputs[path] = _file_record(path, known_inputs.get(path))
+
+    def to_dict(self):
+        return {'FormatVersion': self.FormatVersion,
+                'Command': self.Command,
+                'CommandSource': self.CommandSource,
+                'Options': self.Options,
+                'Inputs': self.Inputs}
+
+    def changes(self, previous):
+        """Describe how this fingerprint differs from a stored one"""
+        if previous is None:
+            return ['no fingerprint was recorded']
+        if previous.get('FormatVersion') != self.FormatVersion:
+            return ['the recorded fingerprint has an old format']
+
+        changes = []
+        if previous.get('Command') != self.Command:
+            changes.append('the command changed')
+        elif previous.get('CommandSource') != self.CommandSource:
+            changes.append('the source of %s changed' % self.Command)
+
+        if previous.get('Options') != self.Options:
+            old_options = previous.get('Options') or {}
+            for name in sorted(set(old_options) | set(self.Options)):
+                if old_options.get(name) != self.Options.get(name):
+                    changes.append('option %s changed' % name)
+
+        old_inputs = previous.get('Inputs') or {}
+        for path in sorted(set(old_inputs) | set(self.Inputs)):
+            if path not in old_inputs or path not in self.Inputs:
+                continue  # already reported as an option change
+            if old_inputs[path][2] != self.Inputs[path][2]:
+                changes.append('input %s changed' % path)
+
+        return changes
+
+def run_unless_unchanged(interface_class, argv, force=False, explain=False,
+                         stream=None):
+    """Run ``optparse_main(interface_class, argv)`` unless it is up to date
+
+    Returns True if the command ran. With ``force``, the command always runs.
+    With ``explain``, the reason the command is run or skipped is written to
+    ``stream`` (stderr by default). Invocations without ``new_filepath``
+    outputs always run, as there is nowhere to record their fingerprint.
+
+    When a command reruns, outputs that have a sidecar (i.e., that were
+    written by an earlier fingerprinted run) are moved aside first, so that
+    commands refusing to overwrite existing files can run again. They are
+    removed once the command succeeds, and put back if it fails.
+    """
+    if stream is None:
+        stream = sys.stderr
+
+    name = argv[0]
+    fingerprint = InvocationFingerprint(interface_class(), argv[1:])
+    outputs = fingerprint.Outputs
+    fingerprint.hash_inputs(_read_sidecar(outputs[0]) if outputs else None)
+
+    if not outputs:
+        reasons = ['it has no new_filepath outputs to record a fingerprint '
+                   'beside']
+    elif force:
+        reasons = ['--force was given']
+    else:
+        reasons = []
+        for output in outputs:
+            if not exists(output):
+                reasons.append('output %s is missing' % output)
+            else:
+                for change in fingerprint.changes(_read_sidecar(output)):
+                    reason = '%s (for output %s)' % (change, output)
+                    if reason not in reasons:
+                        reasons.append(reason)
+
+    if not reasons:
+        if explain:
+            stream.write('%s: skipping, nothing changed since the last '
+                         'run\n' % name)
+        return False
+
+    if explain:
+        stream.write('%s: running because %s\n' % (name,
+                                                   '; '.join(reasons)))
+
+    moved = []
+    try:
+        for output in outputs:
+            sidecar = output + SIDECAR_SUFFIX
+            if exists(output) and exists(sidecar):
+                moved.append((output, _move_aside(output)))
+            if exists(sidecar):
+                moved.append((sidecar, _move_aside(sidecar)))
+
+        optparse_main(interface_class, argv)
+    except BaseException:
+        # Includes the SystemExit raised for bad options.
+        for path, aside in moved:
+            os.rename(aside, path)
+        raise
+
+    for path, aside in moved:
+        _remove(aside)
+
+    record = fingerprint.to_dict()
+    for output in outputs:
+        if exists(output):
+            _write_sidecar(output, record)
+
+    return True
+
+def _file_record(path, known=None):
+    """Return ``[size, mtime, digest]`` for a file, reusing ``known``"""
+    st = os.stat(path)
+    if known is not None and known[:2] == [st.st_size, st.st_mtime]:
+        return list(known)
+    return [st.st_size, st.st_mtime, _digest_file(path)]
+
+def _digest_file(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _digest_module(module_name):
+    path = getattr(sys.modules.get(module_name), '__file__', None)
+    if path is None:
+        return None
+    if path.endswith(('.pyc', '.pyo')):
+        path = path[:-1]
+    try:
+        return _digest_file(path)
+    except (IOError, OSError):
+        return None
+
+def _read_sidecar(output):
+    try:
+        with open(output + SIDECAR_SUFFIX) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+def _write_sidecar(output, record):
+    fd, tmp_path = mkstemp(prefix='.pyqi_fingerprint', dir=dirname(output))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(record, f, sort_keys=True)
+        os.rename(tmp_path, output + SIDECAR_SUFFIX)
+    except (IOError, OSError):
+        _remove(tmp_path)
+        raise
+
+def _move_aside(path):
+    """Rename ``path`` to a new name in its directory and return that name"""
+    fd, aside = mkstemp(prefix='.pyqi_previous', dir=dirname(path))
+    os.close(fd)
+    os.rename(path, aside)
+    return aside
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
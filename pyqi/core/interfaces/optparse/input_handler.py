@@ -17,6 +17,8 @@ function(option_value)
 __credits__ = ["Daniel McDonald", "Greg Caporaso", "Doug Wendel",
                "Jai Ram Rideout"]
 
+import sys
+
 def command_handler(option_value):
     """Dynamically load a Python object from a module and return an instance"""
     module, klass = option_value.rsplit('.',1)
@@ -37,6 +39,24 @@ def file_reading_handler(option_value=None):
         result = open(option_value, 'U')
     return result
 
+def file_or_stdin_lines_handler(option_value=None):
+    """Iterate over the lines of a file, or of stdin if the filepath is '-'.
+
+    The file is opened straight away, so that a bad filepath is reported
+    here, and closed once its lines have been read.
+    """
+    result = None
+    if option_value == '-':
+        result = sys.stdin
+    elif option_value is not None:
+        result = _lines_then_close(open(option_value))
+    return result
+
+def _lines_then_close(f):
+    with f:
+        for line in f:
+            yield line
+
 def load_file_lines(option_value):
     """Return a list of strings, one per line in the file.
 
@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+"""On-disk manifest of the commands in a command configuration package
+
+Importing every config module (and, transitively, every ``Command`` module)
+just to list brief descriptions or print help is slow for drivers with many
+commands. A ``CommandManifest`` caches the information a driver needs without
+running a command -- brief descriptions and option names -- in a JSON file
+stored in the config package directory, and the rendered help text in a second
+file that is only read when help is displayed. Each entry records the
+modification time and size of the config module and of the module defining its
+``Command``, and is rebuilt only when one of them changes. Both files are
+discarded when the package version changes, and the help text also when the
+terminal width given by ``$COLUMNS`` changes.
+"""
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import os
+import sys
+import json
+import importlib
+from os.path import basename, dirname, join, splitext
+from tempfile import mkstemp
+from pyqi.core.interface import get_command_names, get_command_config
+from pyqi.core.interfaces.optparse import optparse_factory
+from pyqi.util import get_version_string
+
+# Placeholder stored in cached help text in place of the program name, which
+# is only known when the help is displayed.
+PROG_PLACEHOLDER = '%prog'
+
+class CommandManifest(object):
+    """Cached command metadata for a command configuration package
+
+    ``command_config_module`` is the python module path of the package
+    containing the command config modules, e.g.
+    ``'pyqi.interfaces.optparse.config'``.
+
+    Entries are loaded lazily: asking for a single command's entry only
+    checks (and, if stale, imports) that command's modules, and the help text
+    is only read from disk by ``get_help``. Call ``save`` to write any
+    refreshed entries back to disk; failures to write (e.g. a read-only
+    install) are ignored and the manifest simply stays in memory.
+    """
+    FormatVersion = 2
+    FileName = '.pyqi_manifest.json'
+    HelpFileName = '.pyqi_manifest_help.json'
+
+    def __init__(self, command_config_module):
+        self.CommandConfigModule = command_config_module
+        self.CommandNames = get_command_names(command_config_module)
+
+        config_base_module = importlib.import_module(command_config_module)
+        config_dir = dirname(config_base_module.__file__)
+        self.Path = join(config_dir, self.FileName)
+        self.HelpPath = join(config_dir, self.HelpFileName)
+        self.Version = get_version_string(command_config_module)
+
+        self._entries = self._read(self.Path, {})
+        self._dirty = False
+        self._help = None
+        self._help_dirty = False
+
+        # Forget about commands whose config modules have gone away.
+        for cmd in list(self._entries):
+            if cmd not in self.CommandNames:
+                del self._entries[cmd]
+                self._dirty = True
+
+    def get_entry(self, cmd):
+        """Return ``(entry, error_msg)`` for a command
+
+        ``entry`` is a dict with the keys ``BriefDescription``, ``Options``
+        and ``Sources``, or ``None`` if the command's config could not be
+        imported, in which case ``error_msg`` describes the failure.
+        """
+        entry = self._entries.get(cmd)
+
+        if entry is not None and _sources_unchanged(entry['Sources']):
+            return entry, None
+
+        cmd_cfg, error_msg = get_command_config(self.CommandConfigModule, cmd,
+                                                exit_on_failure=False)
+        if cmd_cfg is None:
+            # Don't cache failures; the user is probably fixing them.
+            self._entries.pop(cmd, None)
+            return None, error_msg
+
+        entry = build_manifest_entry(self.CommandConfigModule, cmd_cfg)
+        self._entries[cmd] = entry
+        self._dirty = True
+
+        return entry, None
+
+    def get_help(self, cmd, prog):
+        """Return the help text for a command with ``prog`` as program name"""
+        entry, _ = self.get_entry(cmd)
+        if entry is None:
+            return None
+
+        if self._help is None:
+            self._help = self._read(self.HelpPath, {'Columns': _columns()})
+
+        cached = self._help.get(cmd)
+        if cached is not None and cached['Sources'] == entry['Sources']:
+            help_text = cached['Help']
+        else:
+            # get_entry has just imported the config if the entry was stale.
+            cmd_cfg, _ = get_command_config(self.CommandConfigModule, cmd,
+                                            exit_on_failure=False)
+            if cmd_cfg is None:
+                return None
+            help_text = build_help(self.CommandConfigModule, cmd_cfg)
+            self._help[cmd] = {'Help': help_text, 'Sources': entry['Sources']}
+            self._help_dirty = True
+
+        return help_text.replace(PROG_PLACEHOLDER, prog)
+
+    def save(self):
+        """Write the manifest to disk if any entries changed"""
+        if self._dirty and self._write(self.Path, self._entries, {}):
+            self._dirty = False
+
+        if self._help_dirty and \
+                self._write(self.HelpPath, self._help, {'Columns': _columns()}):
+            self._help_dirty = False
+
+    def _read(self, path, key):
+        """Read commands from disk, discarding unusable or stale files
+
+        ``key`` holds values, besides the format and package versions, that
+        the file must have been written with.
+        """
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+        if not isinstance(manifest, dict) or \
+                manifest.get('FormatVersion') != self.FormatVersion or \
+                manifest.get('Version') != self.Version:
+            return {}
+
+        for name, value in key.items():
+            if manifest.get(name) != value:
+                return {}
+
+        return manifest.get('Commands', {})
+
+    def _write(self, path, commands, key):
+        """Atomically write commands to disk, returning whether it worked"""
+        manifest = {'FormatVersion': self.FormatVersion,
+                    'Version': self.Version,
+                    'Commands': commands}
+        manifest.update(key)
+
+        try:
+            fd, tmp_path = mkstemp(prefix=basename(path), dir=dirname(path))
+        except (IOError, OSError):
+            return False
+
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(manifest, f, sort_keys=True)
+            os.chmod(tmp_path, 0o644)
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return False
+
+        return True
+
+def build_manifest_entry(command_config_module, cmd_cfg):
+    """Build a manifest entry from an imported command config module"""
+    cmd_constructor = cmd_cfg.CommandConstructor
+    source_modules = [cmd_cfg, sys.modules.get(cmd_constructor.__module__)]
+    sources = []
+    for module in source_modules:
+        source = _get_source_path(module)
+        if source is not None and source not in [s[0] for s in sources]:
+            sources.append([source] + _stat_source(source))
+
+    return {'BriefDescription': cmd_constructor.BriefDescription,
+            'Options': sorted(['--%s' % opt.Name for opt in cmd_cfg.inputs]),
+            'Sources': sources}
+
+def build_help(command_config_module, cmd_cfg):
+    """Render a command's help text with a placeholder program name"""
+    version_str = get_version_string(command_config_module)
+    interface = optparse_factory(cmd_cfg.CommandConstructor,
+                                 cmd_cfg.usage_examples, cmd_cfg.inputs,
+                                 cmd_cfg.outputs, version_str)()
+    return interface.format_help(prog=PROG_PLACEHOLDER)
+
+def _columns():
+    """Return ``$COLUMNS``, which sets the width optparse wraps help to"""
+    return os.environ.get('COLUMNS')
+
+def _get_source_path(module):
+    """Return the path to a module's .py file, or None if there isn't one"""
+    path = getattr(module, '__file__', None)
+    if path is None:
+        return None
+
+    base, ext = splitext(path)
+    if ext in ('.pyc', '.pyo'):
+        path = base + '.py'
+
+    return path
+
+def _stat_source(path):
+    """Return ``[mtime, size]`` for a file, or ``[None, None]`` if missing"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return [None, None]
+    return [st.st_mtime, st.st_size]
+
+def _sources_unchanged(sources):
+    """Check whether recorded ``[path, mtime, size]`` sources are current"""
+    for path, mtime, size in sources:
+        if _stat_source(path) != [mtime, size]:
+            return False
+    return True
@@ -24,7 +24,23 @@ __credits__ = ["Daniel McDonald", "Greg Caporaso", "Doug Wendel",
                "Jai Ram Rideout", "Evan Bolyen", "Adam Robbins-Pianka"]
 
 from pyqi.core.exception import IncompetentDeveloperError
+import io
 import os
+import sys
+import stat
+
+_text_type = type(u'')
+
+# The most buffers a single os.writev call accepts.
+try:
+    _IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = 16
+if _IOV_MAX <= 0:
+    _IOV_MAX = 16
+
+# Bytes read at a time when a file can't be copied with os.sendfile.
+_COPY_BUFFER_SIZE = 1 << 20
 
 def write_string(result_key, data, option_value=None):
     """Write a string to a file.
@@ -45,7 +61,8 @@ def write_string(result_key, data, option_value=None):
 def write_list_of_strings(result_key, data, option_value=None):
     """Write a list of strings to a file, one per line.
     
-    A newline will be added to the end of the file.
+    A newline will be added to the end of the file. ``data`` can be any
+    iterable of strings, e.g. a generator; it is written as it is consumed.
     """
     if option_value is None:
         raise IncompetentDeveloperError("Cannot write output without a "
@@ -55,17 +72,15 @@ def write_list_of_strings(result_key, data, option_value=None):
         raise IOError("Output path '%s' already exists." % option_value)
 
     with open(option_value, 'w') as f:
-        for line in data:
-            f.write(line)
-            f.write('\n')
+        f.writelines(_newline_terminated(data))
 
 def print_list_of_strings(result_key, data, option_value=None):
     """Print a list of strings to stdout, one per line.
 
-    ``result_key`` and ``option_value`` are ignored.
+    ``result_key`` and ``option_value`` are ignored. ``data`` can be any
+    iterable of strings, e.g. a generator; it is printed as it is consumed.
     """
-    for line in data:
-        print(line)
+    sys.stdout.writelines(_newline_terminated(data))
 
 def print_string(result_key, data, option_value=None):
     """Print the string
@@ -96,3 +111,196 @@ def write_or_print_list_of_strings(result_key, data, option_value=None):
     else:
         write_list_of_strings(result_key, data, option_value)
 
+def write_binary(result_key, data, option_value=None):
+    """Write binary data to a file, unchanged.
+
+    ``data`` can be a bytes-like object (``bytes``, ``bytearray``,
+    ``memoryview`` or anything else supporting the buffer protocol), an
+    iterable of bytes-like chunks (e.g. a generator), a binary file object
+    (copied from its current position, e.g. an open file or an
+    ``io.BytesIO``) or a path object such as a ``pathlib.Path`` (e.g. a
+    temporary file written by the ``Command``). Buffers are passed to the
+    operating system without being copied (with ``os.writev`` where
+    available), and regular files are copied in the kernel with
+    ``os.sendfile`` where possible. No newline is added.
+
+    Paths must be path objects (anything with ``__fspath__``): a plain
+    ``str`` is text, not a path, and raises ``TypeError`` like any other
+    text.
+    """
+    if option_value is None:
+        raise IncompetentDeveloperError("Cannot write output without a "
+                                        "filepath.")
+
+    if os.path.exists(option_value):
+        raise IOError("Output path '%s' already exists." % option_value)
+
+    fd = os.open(option_value, os.O_WRONLY | os.O_CREAT | os.O_EXCL |
+                 getattr(os, 'O_BINARY', 0), 0o666)
+    try:
+        _write_binary_to_fd(fd, data)
+    finally:
+        os.close(fd)
+
+def print_binary(result_key, data, option_value=None):
+    """Write binary data to stdout, unchanged.
+
+    ``result_key`` and ``option_value`` are ignored. ``data`` can be
+    anything ``write_binary`` accepts.
+    """
+    sys.stdout.flush()
+    fd = _fileno(sys.stdout)
+    if fd is None:
+        # stdout has been replaced, e.g. by a StringIO.
+        _write_binary_to_stream(getattr(sys.stdout, 'buffer', sys.stdout),
+                                data)
+    else:
+        _write_binary_to_fd(fd, data)
+
+def write_or_print_binary(result_key, data, option_value=None):
+    """Write binary data to a file, unchanged.
+
+    If no file is supplied, then the output will be written to stdout
+    instead.
+    """
+    if option_value is None:
+        print_binary(result_key, data, option_value)
+    else:
+        write_binary(result_key, data, option_value)
+
+def _write_binary_to_fd(fd, data):
+    path = _path(data)
+    if path is not None:
+        in_fd = os.open(path, os.O_RDONLY | getattr(os, 'O_BINARY', 0))
+        try:
+            _copy_fd(fd, in_fd, 0)
+        finally:
+            os.close(in_fd)
+        return
+
+    in_fd = _fileno(data)
+    if in_fd is not None and _is_regular_file(in_fd):
+        if hasattr(data, 'flush'):
+            data.flush()
+        _copy_fd(fd, in_fd, data.tell())
+        data.seek(0, os.SEEK_END)
+        return
+
+    for chunks in _batches(_binary_chunks(data), _IOV_MAX):
+        _writev_all(fd, chunks)
+
+def _write_binary_to_stream(stream, data):
+    path = _path(data)
+    if path is not None:
+        with open(path, 'rb') as src:
+            _write_binary_to_stream(stream, src)
+        return
+
+    for chunk in _binary_chunks(data):
+        stream.write(chunk)
+
+def _path(data):
+    """Return the path of a path object, or None"""
+    if hasattr(data, '__fspath__'):
+        return data.__fspath__()
+    return None
+
+def _fileno(f):
+    """Return the file descriptor behind ``f``, or None if it has none"""
+    try:
+        return f.fileno()
+    except (AttributeError, ValueError, io.UnsupportedOperation):
+        # Not a file, a closed one, or a file object (e.g. io.BytesIO)
+        # that isn't backed by a descriptor.
+        return None
+
+def _is_regular_file(fd):
+    # Pipes and sockets have no size to copy up to, so they're read instead.
+    return stat.S_ISREG(os.fstat(fd).st_mode)
+
+def _binary_chunks(data):
+    """Yield ``data`` as byte-addressed memoryviews"""
+    if isinstance(data, _text_type):
+        raise TypeError("Binary output handlers can't write text; encode it "
+                        "first, or pass a path as a path object (e.g. "
+                        "pathlib.Path).")
+
+    if hasattr(data, 'read'):
+        chunks = _file_chunks(data)
+    else:
+        try:
+            chunks = [memoryview(data)]
+        except TypeError:
+            chunks = data
+
+    for chunk in chunks:
+        view = chunk if isinstance(chunk, memoryview) else memoryview(chunk)
+        if view.ndim != 1 or view.itemsize != 1:
+            # Raises for non-contiguous buffers, which would be copied.
+            view = view.cast('B')
+        # A 1-D byte view's length is its size in bytes (memoryview.nbytes
+        # is Python 3 only).
+        if len(view):
+            yield view
+
+def _file_chunks(f):
+    """Yield the rest of a file object"""
+    while True:
+        chunk = f.read(_COPY_BUFFER_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _writev_all(fd, chunks):
+    """Write all of ``chunks`` (1-D byte views), retrying after partial
+    writes"""
+    while chunks:
+        if hasattr(os, 'writev'):
+            written = os.writev(fd, chunks)
+        else:
+            written = os.write(fd, chunks[0])
+
+        while chunks and written >= len(chunks[0]):
+            written -= len(chunks[0])
+            chunks = chunks[1:]
+        if written:
+            chunks[0] = chunks[0][written:]
+
+def _copy_fd(out_fd, in_fd, offset):
+    size = os.fstat(in_fd).st_size
+    if hasattr(os, 'sendfile'):
+        try:
+            while offset < size:
+                sent = os.sendfile(out_fd, in_fd, offset, size - offset)
+                if sent == 0:
+                    break
+                offset += sent
+            return
+        except OSError:
+            # e.g. out_fd doesn't support sendfile on this platform; copy
+            # what's left through a buffer.
+            pass
+
+    buf = bytearray(_COPY_BUFFER_SIZE)
+    view = memoryview(buf)
+    with io.open(in_fd, 'rb', buffering=0, closefd=False) as f:
+        f.seek(offset)
+        while True:
+            read = f.readinto(buf)
+            if not read:
+                break
+            _writev_all(out_fd, [view[:read]])
+
+def _newline_terminated(lines):
+    for line in lines:
+        yield '%s\n' % (line,)
@@ -9,8 +9,22 @@
 #-----------------------------------------------------------------------------
 from __future__ import division
 
+import os
+import json
+import atexit
+import weakref
+import threading
+import multiprocessing
+import multiprocessing.util
 from sys import stderr
+from time import time
 from datetime import datetime
+from collections import deque
+
+try:
+    from queue import Queue, Empty, Full
+except ImportError:
+    from Queue import Queue, Empty, Full
 
 __credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
                "Jai Ram Rideout"]
@@ -18,32 +32,69 @@ __credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
 class InvalidLoggerError(Exception):
     pass
 
+_LEVEL_RANKS = {'DEBUG': 0, 'INFO': 1, 'WARN': 2, 'FATAL': 3}
+
 class Logger(object):
-    """Abstract logging interface"""
+    """Abstract logging interface
+
+    Messages below ``Level`` are discarded. A message can be given as a
+    format string and its arguments (``logger.info('Ran %s', name)``), in
+    which case it is only formatted if it is logged. Keyword arguments are
+    structured fields (e.g. ``command``, ``phase`` and ``duration``), which
+    are kept by structured loggers such as ``JSONLinesLogger`` and ignored by
+    the others.
+
+    pyqi logs through ``log_message``, which formats messages itself and
+    calls ``debug``, ``info``, ``warn`` and ``fatal`` with the message alone,
+    so subclasses overriding them with a ``(msg)`` signature keep working.
+    Subclasses that accept fields set ``StructuredFields`` to True.
+    """
     DEBUG = 'DEBUG'
     INFO = 'INFO'
     WARN = 'WARN'
     FATAL = 'FATAL'
+    Levels = (DEBUG, INFO, WARN, FATAL)
+    Level = DEBUG
+    StructuredFields = False
+
+    def __init__(self, level=None):
+        if level is not None:
+            self.set_level(level)
+
+    def set_level(self, level):
+        """Discard messages below ``level``"""
+        if level not in _LEVEL_RANKS:
+            raise InvalidLoggerError("Unknown level '%s'. Must be one of: %s"
+                                     % (level, ', '.join(self.Levels)))
+        self.Level = level
+
+    def is_enabled_for(self, level):
+        """Return True if messages at ``level`` are logged"""
+        return _LEVEL_RANKS[level] >= _LEVEL_RANKS[self.Level]
 
-    def debug(self, msg):
+    def debug(self, msg, *args, **fields):
         """Log at the DEBUG level"""
-        self._debug(msg)
-        self.flush()
+        if self.is_enabled_for(self.DEBUG):
+            self._debug(self._format_message(msg, args))
+            self.flush()
 
-    def info(self, msg):
+    def info(self, msg, *args, **fields):
         """Log at the INFO level"""
-        self._info(msg)
-        self.flush()
+        if self.is_enabled_for(self.INFO):
+            self._info(self._format_message(msg, args))
+            self.flush()
 
-    def warn(self, msg):
+    def warn(self, msg, *args, **fields):
         """Log at the WARN level"""
-        self._warn(msg)
-        self.flush()
+        if self.is_enabled_for(self.WARN):
+            self._warn(self._format_message(msg, args))
+            self.flush()
 
-    def fatal(self, msg):
+    def fatal(self, msg, *args, **fields):
         """Log at the FATAL level"""
-        self._fatal(msg)
-        self.flush()
+        if self.is_enabled_for(self.FATAL):
+            self._fatal(self._format_message(msg, args))
+            self.flush()
 
     def _debug(self, msg):
         raise NotImplementedError("All subclasses must implement debug.")
@@ -69,8 +120,59 @@ class Logger(object):
         """Construct a logging line"""
         return '%s %s %s' % (self._get_timestamp(), level, msg)
 
+    def _format_message(self, msg, args):
+        """Apply the arguments of a message, if any"""
+        return format_message(msg, args)
+
+def format_message(msg, args):
+    """Apply the arguments of a message, if any
+
+    Arguments that don't fit the message are shown after it rather than
+    raising, so a bad logging call never stops a command (or a writer
+    thread).
+    """
+    if not args:
+        return msg
+    try:
+        return msg % args
+    except (TypeError, ValueError, KeyError):
+        return '%r %% %r' % (msg, args)
+
+def log_message(logger, level, msg, *args, **fields):
+    """Log ``msg % args`` at ``level`` through any ``Logger``
+
+    The message is only formatted if ``logger`` logs ``level``, and is then
+    passed to the logger's method for ``level`` on its own, with ``fields``
+    only if the logger has ``StructuredFields``.
+    """
+    is_enabled_for = getattr(logger, 'is_enabled_for', None)
+    if is_enabled_for is not None and not is_enabled_for(level):
+        return
+
+    method = getattr(logger, level.lower())
+    msg = format_message(msg, args)
+    if getattr(logger, 'StructuredFields', False):
+        method(msg, **fields)
+    else:
+        method(msg)
+
 class NullLogger(Logger):
     """Ignore log messages"""
+    def is_enabled_for(self, level):
+        return False
+
+    def debug(self, msg, *args, **fields):
+        pass
+
+    def info(self, msg, *args, **fields):
+        pass
+
+    def warn(self, msg, *args, **fields):
+        pass
+
+    def fatal(self, msg, *args, **fields):
+        pass
+
     def _debug(self, msg):
         pass
     def _info(self, msg):
@@ -93,3 +195,441 @@ class StdErrLogger(Logger):
 
     def _fatal(self, msg):
         stderr.write(self._format_line(self.FATAL, msg) + '\n')
+
+class BufferedLogger(Logger):
+    """Log messages to a stream from a background thread
+
+    Messages are formatted and queued with their time, and a writer thread
+    writes them in batches of up to ``batch_size`` lines, so the thread
+    logging doesn't wait for the stream. The queue holds up to ``max_queued``
+    messages; when it is full, ``policy`` ``'block'`` waits for room and
+    ``'drop'`` discards the message, counting it in ``Dropped``.
+
+    ``flush`` waits until every queued message is written, as do FATAL
+    messages. Queued messages are written before the interpreter (or a
+    ``multiprocessing`` child) exits, and ``close`` writes them and stops the
+    writer thread; messages logged afterwards are written directly.
+    """
+    Policies = ('block', 'drop')
+
+    def __init__(self, stream=None, max_queued=10000, policy='block',
+                 batch_size=256, level=None):
+        super(BufferedLogger, self).__init__(level)
+        if policy not in self.Policies:
+            raise InvalidLoggerError("Unknown policy '%s'. Must be one of: %s"
+                                     % (policy, ', '.join(self.Policies)))
+        self.Stream = stream
+        self.MaxQueued = max_queued
+        self.Policy = policy
+        self.BatchSize = batch_size
+        self.Dropped = 0
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._writer = None
+        self._closed = False
+        self._exit_registered = False
+        self._finalizer = None
+
+    def _debug(self, msg):
+        self._put(self.DEBUG, msg, (), {})
+
+    def _info(self, msg):
+        self._put(self.INFO, msg, (), {})
+
+    def _warn(self, msg):
+        self._put(self.WARN, msg, (), {})
+
+    def _fatal(self, msg):
+        self._put(self.FATAL, msg, (), {})
+
+    def debug(self, msg, *args, **fields):
+        """Log at the DEBUG level"""
+        if self.is_enabled_for(self.DEBUG):
+            self._put(self.DEBUG, msg, args, fields)
+
+    def info(self, msg, *args, **fields):
+        """Log at the INFO level"""
+        if self.is_enabled_for(self.INFO):
+            self._put(self.INFO, msg, args, fields)
+
+    def warn(self, msg, *args, **fields):
+        """Log at the WARN level"""
+        if self.is_enabled_for(self.WARN):
+            self._put(self.WARN, msg, args, fields)
+
+    def fatal(self, msg, *args, **fields):
+        """Log at the FATAL level, waiting until it is written"""
+        if self.is_enabled_for(self.FATAL):
+            self._put(self.FATAL, msg, args, fields)
+            self.flush()
+
+    def flush(self):
+        """Wait until all queued messages are written"""
+        if self._running():
+            self._queue.join()
+
+    def close(self):
+        """Write all queued messages and stop the writer thread"""
+        with self._lock:
+            if not self._running():
+                self._closed = True
+                return
+            self._closed = True
+            self._queue.put(None)
+            writer = self._writer
+        writer.join()
+
+    def _running(self):
+        # A writer that died (e.g. on an exception from the stream) is
+        # restarted by the next message rather than queued to forever.
+        return self._writer is not None and self._pid == os.getpid() and \
+                not self._closed and self._writer.is_alive()
+
+    def _put(self, level, msg, args, fields):
+        record = self._make_record(level, msg, args, fields)
+        if not self._running():
+            if self._closed:
+                self._write([record])
+                return
+            self._start()
+        self._enqueue(record)
+
+    def _make_record(self, level, msg, args, fields):
+        # Formatting here records mutable arguments as they are now.
+        return (time(), level, self._format_message(msg, args))
+
+    def _enqueue(self, record):
+        if self.Policy == 'block':
+            self._queue.put(record)
+            return
+
+        try:
+            self._queue.put_nowait(record)
+        except Full:
+            with self._lock:
+                self.Dropped += 1
+
+    def _start(self):
+        with self._lock:
+            if self._running() or self._closed:
+                return
+            # Threads don't survive a fork, so a forked child starts its own
+            # writer.
+            self._pid = os.getpid()
+            self._queue = self._make_queue()
+            self._writer = threading.Thread(target=self._write_queued,
+                                            name='pyqi-logger')
+            self._writer.daemon = True
+            self._writer.start()
+
+            # The hooks only hold weak references, so that closed loggers
+            # can be collected.
+            ref = weakref.ref(self)
+            if not self._exit_registered:
+                # Forked children inherit this registration.
+                atexit.register(_close_logger, ref)
+                self._exit_registered = True
+            # multiprocessing children exit without running atexit handlers,
+            # and start without the parent's finalizers.
+            if self._finalizer is None or not self._finalizer.still_active():
+                self._finalizer = multiprocessing.util.Finalize(
+                        self, _close_logger, (ref,), exitpriority=0)
+
+    def _make_queue(self):
+        return Queue(self.MaxQueued)
+
+    def _write_queued(self):
+        queue = self._queue
+        stopping = False
+        while not stopping:
+            batch = [queue.get()]
+            while len(batch) < self.BatchSize and batch[-1] is not None:
+                try:
+                    batch.append(queue.get_nowait())
+                except Empty:
+                    break
+
+            if batch[-1] is None:
+                stopping = True
+                batch.pop()
+
+            try:
+                self._write(batch)
+            finally:
+                for _ in range(len(batch) + stopping):
+                    queue.task_done()
+
+    def _write(self, records):
+        lines = ['%s %s %s\n' % (datetime.fromtimestamp(t).isoformat(), level,
+                                 msg)
+                 for t, level, msg in records]
+        stream = stderr if self.Stream is None else self.Stream
+        try:
+            stream.write(''.join(lines))
+            stream.flush()
+        except (IOError, OSError, ValueError):
+            # The stream was closed or broken; there is nowhere to report it.
+            pass
+
+    def __reduce__(self):
+        # Queues, locks and threads can't be pickled; an unpickled copy
+        # starts its own writer.
+        return (self.__class__, (self.Stream, self.MaxQueued, self.Policy,
+                                 self.BatchSize, self.Level))
+
+def _close_logger(ref):
+    """Close a ``BufferedLogger`` at exit if it is still alive"""
+    logger = ref()
+    if logger is not None:
+        logger.close()
+
+class JSONLinesLogger(Logger):
+    """Log one JSON object per message
+
+    Each record has the fields ``timestamp`` (seconds since the epoch),
+    ``level``, ``message``, ``command``, ``phase`` and ``duration`` (seconds),
+    the last three being ``null`` unless they are passed to the logging call,
+    plus any other fields passed.
+
+    With ``ring_size``, the last ``ring_size`` records are also kept in
+    ``Records`` and can be written out with ``dump``. With ``write=False``,
+    records are only kept there, and a FATAL message dumps them (ending with
+    the FATAL record) and clears them, so a failure can be examined without
+    writing every record of the runs that succeed.
+    """
+    Fields = ('command', 'phase', 'duration')
+    StructuredFields = True
+
+    def __init__(self, stream=None, ring_size=None, write=True, level=None):
+        super(JSONLinesLogger, self).__init__(level)
+        if not write and not ring_size:
+            raise InvalidLoggerError("A JSONLinesLogger that doesn't write "
+                                     "records needs a ring_size to keep "
+                                     "them.")
+        self.Stream = stream
+        self.Write = write
+        self.Records = None if ring_size is None else deque(maxlen=ring_size)
+        self._lock = threading.Lock()
+
+    def debug(self, msg, *args, **fields):
+        """Log at the DEBUG level"""
+        if self.is_enabled_for(self.DEBUG):
+            self._log(self.DEBUG, msg, args, fields)
+
+    def info(self, msg, *args, **fields):
+        """Log at the INFO level"""
+        if self.is_enabled_for(self.INFO):
+            self._log(self.INFO, msg, args, fields)
+
+    def warn(self, msg, *args, **fields):
+        """Log at the WARN level"""
+        if self.is_enabled_for(self.WARN):
+            self._log(self.WARN, msg, args, fields)
+
+    def fatal(self, msg, *args, **fields):
+        """Log at the FATAL level"""
+        if self.is_enabled_for(self.FATAL):
+            self._log(self.FATAL, msg, args, fields)
+
+    def _debug(self, msg):
+        self._log(self.DEBUG, msg, (), {})
+
+    def _info(self, msg):
+        self._log(self.INFO, msg, (), {})
+
+    def _warn(self, msg):
+        self._log(self.WARN, msg, (), {})
+
+    def _fatal(self, msg):
+        self._log(self.FATAL, msg, (), {})
+
+    def dump(self, stream=None):
+        """Write the records in ``Records`` to ``stream``, oldest first"""
+        with self._lock:
+            records = list(self.Records or ())
+        self._write(records, stream)
+
+    def flush(self):
+        stream = self._stream()
+        with self._lock:
+            stream.flush()
+
+    def _log(self, level, msg, args, fields):
+        record = {'timestamp': time(), 'level': level,
+                  'message': self._format_message(msg, args)}
+        for name in self.Fields:
+            record[name] = None
+        record.update(fields)
+
+        if self.Records is not None:
+            with self._lock:
+                self.Records.append(record)
+
+        if self.Write:
+            self._write([record])
+        elif level == self.FATAL:
+            with self._lock:
+                records = list(self.Records)
+                self.Records.clear()
+            self._write(records)
+
+    def _write(self, records, stream=None):
+        if stream is None:
+            stream = self._stream()
+        lines = ''.join(json.dumps(record, sort_keys=True, default=repr) +
+                        '\n' for record in records)
+        with self._lock:
+            stream.write(lines)
+            stream.flush()
+
+    def _stream(self):
+        return stderr if self.Stream is None else self.Stream
+
+class MultiprocessLogger(BufferedLogger):
+    """Log messages from this process and its children through one writer
+
+    A ``BufferedLogger`` whose queue is a ``multiprocessing`` queue. Child
+    processes that inherit the logger (e.g. the workers of a
+    ``multiprocessing.Pool`` started after it was created, or a ``Command``
+    run with ``'process'`` timeout enforcement) put their messages on the
+    queue, and a listener thread in the process that created the logger
+    writes them in batches, so lines from different processes never
+    interleave and no process takes a lock to log.
+
+    Messages are written to ``stream`` with the id of the process that
+    logged them, or, if ``sink`` is a ``Logger``, passed to it with ``pid``
+    and ``timestamp`` fields. ``ProcessStats`` maps each process id to counts of the
+    ``records`` and message ``bytes`` written for it, the messages it
+    ``dropped`` and the ``first`` and ``last`` times it logged; see
+    ``throughput``.
+
+    Messages are formatted in the process that logs them. Child processes
+    don't wait for FATAL messages to be written, and must stop logging
+    before the logger is closed. A copy of the logger unpickled in a process
+    that didn't inherit it (e.g. one started with the ``'spawn'`` method) is
+    a ``StdErrLogger``.
+    """
+
+    # Fields are passed on to the sink.
+    StructuredFields = True
+
+    def __init__(self, stream=None, max_queued=10000, policy='block',
+                 batch_size=256, level=None, sink=None):
+        super(MultiprocessLogger, self).__init__(stream, max_queued, policy,
+                                                 batch_size, level)
+        self.Sink = sink
+        self.ProcessStats = {}
+        self._key = '%d-%d' % (os.getpid(), id(self))
+        self._shared_queue = multiprocessing.JoinableQueue(max_queued)
+
+        _multiprocess_loggers[self._key] = self
+        # Children may log before this process does.
+        self._start()
+
+    def throughput(self):
+        """Return the records written per second for each process id"""
+        rates = {}
+        for pid, stats in list(self.ProcessStats.items()):
+            elapsed = stats['last'] - stats['first']
+            rates[pid] = stats['records'] / elapsed if elapsed > 0 else None
+        return rates
+
+    def close(self):
+        super(MultiprocessLogger, self).close()
+        _multiprocess_loggers.pop(self._key, None)
+
+    def _put(self, level, msg, args, fields):
+        if os.getpid() == self._pid:
+            super(MultiprocessLogger, self)._put(level, msg, args, fields)
+        else:
+            self._enqueue(self._make_record(level, msg, args, fields))
+
+    def _make_record(self, level, msg, args, fields):
+        # Arguments may not be picklable, so messages are sent formatted.
+        return (time(), level, self._format_message(msg, args), fields,
+                os.getpid(), self.Dropped)
+
+    def _make_queue(self):
+        return self._shared_queue
+
+    def _write(self, records):
+        for t, level, msg, fields, pid, dropped in records:
+            stats = self.ProcessStats.get(pid)
+            if stats is None:
+                stats = self.ProcessStats[pid] = {'records': 0, 'bytes': 0,
+                                                  'dropped': 0, 'first': t,
+                                                  'last': t}
+            stats['records'] += 1
+            stats['bytes'] += len(msg)
+            stats['dropped'] = max(stats['dropped'], dropped)
+            stats['last'] = t
+
+        if self.Sink is None:
+            lines = ['%s %s [%d] %s\n' % (datetime.fromtimestamp(t).isoformat(),
+                                          level, pid, msg)
+                     for t, level, msg, _, pid, _ in records]
+            stream = stderr if self.Stream is None else self.Stream
+            try:
+                stream.write(''.join(lines))
+                stream.flush()
+            except (IOError, OSError, ValueError):
+                pass
+            return
+
+        for t, level, msg, fields, pid, _ in records:
+            fields = dict(fields, pid=pid, timestamp=t)
+            log_message(self.Sink, level, msg, **fields)
+        self.Sink.flush()
+
+    def __reduce__(self):
+        return (_inherited_multiprocess_logger, (self._key, self.Level))
+
+# The MultiprocessLoggers created in this process (or inherited from the
+# process that forked it), by key.
+_multiprocess_loggers = {}
+
+def _inherited_multiprocess_logger(key, level):
+    """Unpickle a ``MultiprocessLogger``"""
+    logger = _multiprocess_loggers.get(key)
+    if logger is None:
+        return StdErrLogger(level=level)
+    return logger
+
+# Loggers that PYQI_LOGGER can name.
+LOGGERS = {'null': NullLogger,
+           'stderr': StdErrLogger,
+           'buffered': BufferedLogger,
+           'jsonl': JSONLinesLogger,
+           'multiprocess': MultiprocessLogger}
+
+_default_logger = None
+
+def get_default_logger():
+    """Return the ``Logger`` that ``Command`` instances use
+
+    Unless one has been set with ``set_default_logger``, this is a shared
+    instance of the logger named by the ``PYQI_LOGGER`` environment variable
+    (one of ``LOGGERS``), or a ``NullLogger``, logging messages at or above
+    ``PYQI_LOG_LEVEL`` (e.g. ``INFO``).
+    """
+    global _default_logger
+    if _default_logger is None:
+        name = os.environ.get('PYQI_LOGGER', 'null')
+        try:
+            logger_class = LOGGERS[name]
+        except KeyError:
+            raise InvalidLoggerError("Unknown PYQI_LOGGER '%s'. Must be one "
+                                     "of: %s" %
+                                     (name, ', '.join(sorted(LOGGERS))))
+        _default_logger = logger_class(level=os.environ.get('PYQI_LOG_LEVEL'))
+    return _default_logger
+
+def set_default_logger(logger):
+    """Make ``Command`` instances created from now on use ``logger``
+
+    Passing ``None`` reverts to the logger chosen by ``PYQI_LOGGER``.
+    """
+    global _default_logger
+    _default_logger = logger
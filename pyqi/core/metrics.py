@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+
+"""Per-phase timing of interface calls
+
+A ``PhaseTimer`` is a phase hook (see ``Interface.add_phase_hook``) that
+measures the wall and CPU time of every phase of an interface call,
+including each input and output ``Handler``, and passes a record of each
+measurement to a sink. Timings are inclusive: a phase's time includes the
+time of any phases nested inside it.
+
+Records are dicts with the keys ``command`` (the ``Command`` class name),
+``phase``, ``wall``, ``cpu`` (both in seconds) and ``failed`` (whether the
+phase raised). A sink is any object with a ``record(record)`` method; three
+are provided:
+
+``LoggerSink``
+    writes a line per record to a pyqi ``Logger``
+``JSONLinesSink``
+    appends one JSON object per record to a file
+``AggregatingSink``
+    keeps per-phase totals in memory
+"""
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import json
+import time
+from threading import Lock
+from pyqi.core.log import Logger, log_message
+
+try:
+    cpu_time = time.process_time
+except AttributeError:
+    # Python 2: time.clock is CPU time on POSIX.
+    cpu_time = time.clock
+
+class PhaseTimer(object):
+    """Time interface phases and send a record per phase to ``sink``"""
+
+    def __init__(self, sink):
+        self.Sink = sink
+
+    def __call__(self, interface, phase, f, *args, **kwargs):
+        failed = True
+        wall_start = time.time()
+        cpu_start = cpu_time()
+        try:
+            result = f(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            cpu = cpu_time() - cpu_start
+            wall = time.time() - wall_start
+
+            command = interface.CommandConstructor.__name__
+            self.Sink.record({'command': command,
+                              'phase': phase,
+                              'wall': wall,
+                              'cpu': cpu,
+                              'failed': failed})
+
+class LoggerSink(object):
+    """Write phase timings to a pyqi ``Logger`` at the INFO level
+
+    Loggers with ``StructuredFields`` also get the timings as fields.
+    """
+
+    def __init__(self, logger):
+        self.Logger = logger
+
+    def record(self, record):
+        log_message(self.Logger, Logger.INFO,
+                    '%s phase %s took %.6fs (%.6fs CPU)%s',
+                    record['command'], record['phase'], record['wall'],
+                    record['cpu'], ' and failed' if record['failed'] else '',
+                    command=record['command'], phase=record['phase'],
+                    duration=record['wall'], cpu=record['cpu'],
+                    failed=record['failed'])
+
+class JSONLinesSink(object):
+    """Append phase timings as JSON lines to a file
+
+    ``output`` is either a filepath (opened for appending) or an open file.
+    """
+
+    def __init__(self, output):
+        if hasattr(output, 'write'):
+            self._f = output
+            self._owns_file = False
+        else:
+            self._f = open(output, 'a')
+            self._owns_file = True
+        self._lock = Lock()
+
+    def record(self, record):
+        line = json.dumps(record, sort_keys=True) + '\n'
+        with self._lock:
+            self._f.write(line)
+            self._f.flush()
+
+    def close(self):
+        if self._owns_file:
+            self._f.close()
+
+class AggregatingSink(object):
+    """Accumulate phase timings in memory
+
+    ``Stats`` maps ``(command, phase)`` to a dict with the keys ``count``,
+    ``failures``, ``wall``, ``cpu`` (totals), ``wall_min`` and ``wall_max``.
+    """
+
+    def __init__(self):
+        self.Stats = {}
+        self._lock = Lock()
+
+    def record(self, record):
+        key = (record['command'], record['phase'])
+        wall = record['wall']
+
+        with self._lock:
+            stats = self.Stats.get(key)
+            if stats is None:
+                stats = {'count': 0, 'failures': 0, 'wall': 0.0, 'cpu': 0.0,
+                         'wall_min': wall, 'wall_max': wall}
+                self.Stats[key] = stats
+
+            stats['count'] += 1
+            stats['failures'] += int(record['failed'])
+            stats['wall'] += wall
+            stats['cpu'] += record['cpu']
+            stats['wall_min'] = min(stats['wall_min'], wall)
+            stats['wall_max'] = max(stats['wall_max'], wall)
+
+    def summary(self):
+        """Return the stats as a list of records, slowest total wall first"""
+        with self._lock:
+            rows = []
+            for (command, phase), stats in self.Stats.items():
+                row = dict(stats)
+                row['command'] = command
+                row['phase'] = phase
+                rows.append(row)
+
+        return sorted(rows, key=lambda row: row['wall'], reverse=True)
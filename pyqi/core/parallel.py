@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import pickle
+import traceback
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from pyqi.core.exception import IncompetentDeveloperError
+
+EXECUTORS = ('thread', 'process')
+
+class MapResult(object):
+    """The outcome of one call made by ``map_command``
+
+    ``Index`` is the position of the call's kwargs in the input. On success
+    ``Result`` holds the ``Command`` result; on failure ``Error`` holds the
+    exception raised and ``Traceback`` its formatted traceback.
+    """
+
+    def __init__(self, Index, Kwargs, Result=None, Error=None,
+                 Traceback=None):
+        self.Index = Index
+        self.Kwargs = Kwargs
+        self.Result = Result
+        self.Error = Error
+        self.Traceback = Traceback
+
+    @property
+    def Succeeded(self):
+        return self.Error is None
+
+def map_command(command, kwargs_iter, executor='thread', max_workers=None,
+                ordered=True, chunksize=1):
+    """Call ``command`` with each kwargs dict in ``kwargs_iter`` in parallel
+
+    Yields a ``MapResult`` per call. With ``ordered=True`` results are
+    yielded in input order, otherwise as soon as each call completes.
+    Exceptions raised by a call are captured in its ``MapResult`` rather
+    than stopping the other calls.
+
+    With ``executor='thread'``, ``command`` is shared by all threads. With
+    ``executor='process'``, each worker process creates its own instance of
+    ``command``'s class, so state set on ``command`` itself (e.g., an
+    instance result cache) is not used, and kwargs and results must be
+    picklable (so results can't contain streaming outputs, which are
+    usually generators). ``max_workers`` defaults to the number of CPUs.
+
+    The arguments are checked when ``map_command`` is called; the pool is
+    only started once results are asked for.
+    """
+    if executor not in EXECUTORS:
+        raise IncompetentDeveloperError("Unknown executor '%s'. Must be one "
+                                        "of: %s" % (executor,
+                                                    ', '.join(EXECUTORS)))
+    if max_workers is not None and max_workers < 1:
+        raise IncompetentDeveloperError("max_workers must be at least 1, "
+                                        "not %r." % (max_workers,))
+    if chunksize < 1:
+        raise IncompetentDeveloperError("chunksize must be at least 1, not "
+                                        "%r." % (chunksize,))
+
+    return _map_command(command, kwargs_iter, executor, max_workers, ordered,
+                        chunksize)
+
+def _map_command(command, kwargs_iter, executor, max_workers, ordered,
+                 chunksize):
+    """Yield the ``MapResult``s of ``map_command``"""
+    items = enumerate(kwargs_iter)
+
+    if executor == 'thread':
+        pool = ThreadPool(max_workers)
+        run_item = _ItemRunner(command)
+    else:
+        pool = Pool(max_workers, _init_worker, (command.__class__,))
+        run_item = _run_in_worker
+
+    if ordered:
+        results = pool.imap(run_item, items, chunksize)
+    else:
+        results = pool.imap_unordered(run_item, items, chunksize)
+
+    try:
+        for result in results:
+            yield result
+    finally:
+        # Every result has been consumed, or the caller stopped iterating
+        # early, so nothing left in the pool is needed.
+        pool.terminate()
+        pool.join()
+
+class _ItemRunner(object):
+    """Call a ``Command`` for one ``(index, kwargs)`` item"""
+
+    def __init__(self, command, picklable_errors=False):
+        self.Command = command
+        self.PicklableErrors = picklable_errors
+
+    def __call__(self, item):
+        index, kwargs = item
+        try:
+            result = self.Command(**kwargs)
+        except Exception as e:
+            if self.PicklableErrors:
+                e = _picklable(e)
+            return MapResult(index, kwargs, Error=e,
+                             Traceback=traceback.format_exc())
+        return MapResult(index, kwargs, Result=result)
+
+def _picklable(e):
+    try:
+        pickle.loads(pickle.dumps(e))
+    except Exception:
+        return RuntimeError('%s: %s' % (e.__class__.__name__, e))
+    return e
+
+_worker_runner = None
+
+def _init_worker(command_class):
+    global _worker_runner
+    _worker_runner = _ItemRunner(command_class(), picklable_errors=True)
+
+def _run_in_worker(item):
+    return _worker_runner(item)
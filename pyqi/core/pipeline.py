@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+
+"""Composing ``Command``s into pipelines
+
+A ``Pipeline`` is a directed acyclic graph of ``Command`` calls. Each step's
+``CommandIns`` are given constant values, values supplied when the pipeline
+runs (``Pipeline.input``) or ``CommandOuts`` of earlier steps
+(``Step.out``)::
+
+    pipeline = Pipeline()
+    table = pipeline.add_step('load', LoadTable(),
+                              {'fp': pipeline.input('table_fp')})
+    summary = pipeline.add_step('summarize', Summarize(),
+                                {'table': table.out('table')})
+    filtered = pipeline.add_step('filter', Filter(),
+                                 {'table': table.out('table'),
+                                  'min_count': 10})
+    results = pipeline.run({'table_fp': 'table.biom'})
+
+Wiring is checked against the ``CommandIns`` and ``CommandOuts`` as steps are
+added. Results are passed between steps in memory, and steps that don't
+depend on each other (``summarize`` and ``filter`` above) run concurrently.
+"""
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import sys
+import pickle
+from collections import OrderedDict
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from pyqi.core.exception import (IncompetentDeveloperError,
+                                 MissingParameterError,
+                                 UnknownParameterError)
+from pyqi.core.parallel import EXECUTORS, _picklable
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+class PipelineInput(object):
+    """A value supplied when a ``Pipeline`` runs"""
+
+    def __init__(self, Name):
+        self.Name = Name
+
+class StepOutput(object):
+    """A ``CommandOut`` of a ``Pipeline`` step"""
+
+    def __init__(self, Step, Name):
+        self.Step = Step
+        self.Name = Name
+
+class Step(object):
+    """A ``Command`` call in a ``Pipeline``"""
+
+    def __init__(self, Name, Command, Inputs):
+        self.Name = Name
+        self.Command = Command
+        self.Inputs = Inputs
+
+    def out(self, name):
+        """Return a reference to this step's ``CommandOut`` ``name``"""
+        # Raises UnknownParameterError for unknown names.
+        self.Command.CommandOuts[name]
+        return StepOutput(self, name)
+
+    def dependencies(self):
+        """Return the names of the steps this step takes inputs from"""
+        return set(v.Step.Name for v in self.Inputs.values()
+                   if isinstance(v, StepOutput))
+
+class Pipeline(object):
+    """A DAG of ``Command`` calls wired together by name
+
+    As for ``Command.map``, ``executor`` is ``'thread'`` or ``'process'``,
+    and steps are run on a pool of up to ``max_workers`` threads or
+    processes (defaulting to the number of CPUs) started for each run. With
+    ``'thread'`` and ``max_workers=1`` they run one at a time in the calling
+    thread. With ``'process'``, step ``Command``s, their inputs and their
+    results must be picklable, so steps can't stream their outputs.
+
+    ``executor`` can also be a ``multiprocessing`` pool (e.g. one shared
+    with other work), which is used as is and left running; unless it is a
+    ``multiprocessing.pool.ThreadPool``, it is taken to run steps in other
+    processes.
+    """
+
+    def __init__(self, max_workers=None, executor='thread'):
+        if not hasattr(executor, 'apply_async') and \
+                executor not in EXECUTORS:
+            raise IncompetentDeveloperError("Unknown executor '%s'. Must be "
+                                            "one of %s, or a multiprocessing "
+                                            "pool." % (executor,
+                                                       ', '.join(EXECUTORS)))
+        self.MaxWorkers = max_workers
+        self.Executor = executor
+        self.Steps = OrderedDict()
+        self.Inputs = {}
+
+    def input(self, name):
+        """Return a reference to a value supplied when the pipeline runs"""
+        if name not in self.Inputs:
+            self.Inputs[name] = PipelineInput(name)
+        return self.Inputs[name]
+
+    def add_step(self, name, command, inputs=None):
+        """Add a call of ``command`` and return its ``Step``
+
+        ``inputs`` maps ``CommandIn`` names to constants, ``PipelineInput``s
+        or ``StepOutput``s. ``CommandIns`` that aren't in ``inputs`` take
+        their defaults. Steps can only take outputs from steps added before
+        them, so the pipeline is always acyclic.
+        """
+        if name in self.Steps:
+            raise IncompetentDeveloperError("Found duplicate step name '%s'. "
+                                            "Step names must be unique." %
+                                            name)
+        if inputs is None:
+            inputs = {}
+
+        for in_name, value in inputs.items():
+            if in_name not in command.CommandIns:
+                raise UnknownParameterError("Unknown CommandIn %s in step "
+                                            "'%s'" % (in_name, name))
+            if isinstance(value, StepOutput):
+                self._check_wiring(name, command.CommandIns[in_name], value)
+
+        for p in command.CommandIns.values():
+            if p.Required and p.Name not in inputs:
+                raise MissingParameterError("Missing required CommandIn %s "
+                                            "in step '%s'" % (p.Name, name))
+
+        step = Step(name, command, dict(inputs))
+        self.Steps[name] = step
+        return step
+
+    def run(self, inputs=None, outputs=None):
+        """Run the pipeline, returning a dict of step results
+
+        ``inputs`` supplies the values of ``PipelineInput``s. Results are
+        returned for the steps named in ``outputs``, which defaults to the
+        steps no other step takes inputs from. Other results are released as
+        soon as the steps using them have run. If a step fails, no more steps
+        are started and its exception is raised.
+        """
+        if inputs is None:
+            inputs = {}
+
+        for name in self.Inputs:
+            if name not in inputs:
+                raise MissingParameterError("Missing pipeline input %s" %
+                                            name)
+        for name in inputs:
+            if name not in self.Inputs:
+                raise UnknownParameterError("Unknown pipeline input %s" %
+                                            name)
+
+        dependents = dict((name, set()) for name in self.Steps)
+        for step in self.Steps.values():
+            for dep in step.dependencies():
+                dependents[dep].add(step.Name)
+
+        if outputs is None:
+            outputs = [name for name in self.Steps if not dependents[name]]
+        for name in outputs:
+            if name not in self.Steps:
+                raise UnknownParameterError("Unknown step %s" % name)
+
+        run = _PipelineRun(self, inputs, dependents, outputs)
+        if self.Executor == 'thread' and self.MaxWorkers == 1:
+            # Insertion order is a topological order.
+            for name in self.Steps:
+                run.finish(name, run.run_step(name))
+        elif hasattr(self.Executor, 'apply_async'):
+            run.run_parallel(self.Executor,
+                             not isinstance(self.Executor, ThreadPool))
+        else:
+            if self.Executor == 'thread':
+                pool = ThreadPool(self.MaxWorkers)
+            else:
+                pool = Pool(self.MaxWorkers)
+            try:
+                run.run_parallel(pool, self.Executor == 'process')
+            finally:
+                # If a step failed, steps already running are left to finish
+                # but their results are discarded.
+                pool.terminate()
+                pool.join()
+
+        return dict((name, run.Results[name]) for name in outputs)
+
+    def _check_wiring(self, name, command_in, source):
+        if self.Steps.get(source.Step.Name) is not source.Step:
+            raise IncompetentDeveloperError("Step '%s' takes an input from "
+                                            "step '%s', which is not part of "
+                                            "this pipeline." %
+                                            (name, source.Step.Name))
+
+        command_out = source.Step.Command.CommandOuts[source.Name]
+        out_type = command_out.DataType
+        in_type = command_in.DataType
+        if isinstance(out_type, type) and isinstance(in_type, type) and \
+                not issubclass(out_type, in_type):
+            raise IncompetentDeveloperError("CommandOut %s of step '%s' "
+                                            "(%s) can't be passed to "
+                                            "CommandIn %s of step '%s' (%s)."
+                                            % (source.Name, source.Step.Name,
+                                               out_type.__name__,
+                                               command_in.Name, name,
+                                               in_type.__name__))
+
+        if command_out.Streaming:
+            # A stream can only be consumed once.
+            for step in self.Steps.values():
+                for value in step.Inputs.values():
+                    if isinstance(value, StepOutput) and \
+                            value.Step is source.Step and \
+                            value.Name == source.Name:
+                        raise IncompetentDeveloperError(
+                                "Streaming CommandOut %s of step '%s' is "
+                                "already used by step '%s'." %
+                                (source.Name, source.Step.Name, step.Name))
+
+class _PipelineRun(object):
+    """The state of a single ``Pipeline.run``"""
+
+    def __init__(self, pipeline, inputs, dependents, outputs):
+        self.Pipeline = pipeline
+        self.Inputs = inputs
+        self.Results = {}
+        self._dependents = dependents
+        self._outputs = set(outputs)
+        self._waiting_on = dict((name, step.dependencies())
+                                for name, step in pipeline.Steps.items())
+        self._unfinished_dependents = dict((name, set(deps))
+                                           for name, deps in
+                                           dependents.items())
+
+    def run_step(self, name):
+        return self.Pipeline.Steps[name].Command(**self.step_kwargs(name))
+
+    def step_kwargs(self, name):
+        kwargs = {}
+        for in_name, value in self.Pipeline.Steps[name].Inputs.items():
+            if isinstance(value, StepOutput):
+                value = self.Results[value.Step.Name][value.Name]
+            elif isinstance(value, PipelineInput):
+                value = self.Inputs[value.Name]
+            kwargs[in_name] = value
+        return kwargs
+
+    def finish(self, name, result):
+        """Record a step's result, returning the steps now ready to run"""
+        self.Results[name] = result
+
+        for dep in self.Pipeline.Steps[name].dependencies():
+            unfinished = self._unfinished_dependents[dep]
+            unfinished.discard(name)
+            if not unfinished and dep not in self._outputs:
+                del self.Results[dep]
+
+        ready = []
+        for dependent in self._dependents[name]:
+            waiting_on = self._waiting_on[dependent]
+            waiting_on.discard(name)
+            if not waiting_on:
+                ready.append(dependent)
+        return ready
+
+    def run_parallel(self, pool, in_processes):
+        """Run the steps on ``pool`` as their inputs become available
+
+        With ``in_processes``, steps and their outcomes are sent to and from
+        the pool pickled, so that pickling errors are raised here rather
+        than lost in the pool.
+        """
+        done = Queue()
+
+        def submit(name):
+            command = self.Pipeline.Steps[name].Command
+            call = (name, command, self.step_kwargs(name))
+            if in_processes:
+                call = pickle.dumps(call, pickle.HIGHEST_PROTOCOL)
+                pool.apply_async(_run_pickled_step, (call,),
+                                 callback=done.put)
+            else:
+                pool.apply_async(_run_step, call, callback=done.put)
+
+        running = 0
+        for name, waiting_on in self._waiting_on.items():
+            if not waiting_on:
+                submit(name)
+                running += 1
+
+        while running:
+            outcome = done.get()
+            if in_processes:
+                outcome = pickle.loads(outcome)
+            name, result, error = outcome
+            running -= 1
+            if error is not None:
+                raise error
+
+            for ready in self.finish(name, result):
+                submit(ready)
+                running += 1
+
+def _run_step(name, command, kwargs):
+    """Call a step's ``Command``, returning ``(name, result, error)``"""
+    try:
+        return (name, command(**kwargs), None)
+    except BaseException:
+        return (name, None, sys.exc_info()[1])
+
+def _run_pickled_step(call):
+    """``_run_step`` for pickled arguments, returning a pickled outcome"""
+    name, result, error = _run_step(*pickle.loads(call))
+    try:
+        return pickle.dumps((name, result, error), pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        # The result or exception can't be pickled.
+        e = sys.exc_info()[1]
+        error = _picklable(error) if error is not None else \
+                RuntimeError("Unable to return the result of step '%s' from "
+                             "its process: %s: %s" %
+                             (name, e.__class__.__name__, e))
+        return pickle.dumps((name, None, error), pickle.HIGHEST_PROTOCOL)
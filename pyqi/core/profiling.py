@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+"""Per-phase profiling of interface calls
+
+An ``Interface`` call runs in phases (validating and parsing input, running
+input handlers, running the ``Command``, handling output; see
+``Interface._run_phase``). A ``PhaseProfiler`` is a phase hook that keeps a
+separate profile for each phase so that framework overhead can be told apart
+from the work done by the ``Command``. Time is charged to the innermost
+active phase only, e.g. the time spent parsing the command line is reported
+under ``parse`` and not also under ``input_handler``.
+
+Two kinds of output are supported: ``cProfile`` statistics per phase, or
+collapsed stacks (one ``frame;frame;frame microseconds`` line per distinct
+stack) rooted at the phase names, suitable for flame graph tools. The
+collapsed stacks come from a pure-Python profile hook, so they are slower to
+collect than ``cProfile`` statistics.
+"""
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import re
+import sys
+import pstats
+import cProfile
+from time import time
+from os.path import join
+
+SORT_KEYS = ('calls', 'cumulative', 'cumtime', 'file', 'line', 'module',
+             'name', 'ncalls', 'nfl', 'pcalls', 'stdname', 'time', 'tottime')
+
+class PhaseProfiler(object):
+    """Profile each phase of interface calls separately
+
+    If ``collapsed`` is True, collapsed stacks are collected instead of
+    ``cProfile`` statistics.
+    """
+
+    def __init__(self, collapsed=False):
+        self.Collapsed = collapsed
+        self.Phases = []
+        self.PhaseTimes = {}
+        self._profiles = {}
+        self._active = []
+        self._started = None
+        self._stacks = _StackCollector() if collapsed else None
+
+    def run_phase(self, phase, f, *args, **kwargs):
+        """Run ``f(*args, **kwargs)``, charging its time to ``phase``"""
+        if phase not in self.PhaseTimes:
+            self.Phases.append(phase)
+            self.PhaseTimes[phase] = 0.0
+            if not self.Collapsed:
+                self._profiles[phase] = cProfile.Profile()
+
+        parent = self._active[-1] if self._active else None
+        if parent is not None:
+            self._suspend(parent)
+
+        self._active.append(phase)
+        self._enter(phase, sys._getframe())
+        try:
+            return f(*args, **kwargs)
+        finally:
+            self._exit(phase)
+            self._active.pop()
+            if parent is not None:
+                self._resume(parent)
+
+    def __call__(self, interface, phase, f, *args, **kwargs):
+        """Phase hook entry point; see ``Interface.add_phase_hook``"""
+        return self.run_phase(phase, f, *args, **kwargs)
+
+    def wrap_interface(self, interface_class):
+        """Return a subclass of ``interface_class`` whose phases are profiled"""
+        class ProfiledInterface(interface_class):
+            PhaseHooks = tuple(interface_class.PhaseHooks) + (self,)
+
+        ProfiledInterface.__name__ = interface_class.__name__
+        return ProfiledInterface
+
+    def report(self, stream=None, sort_key='cumulative', limit=25):
+        """Write a per-phase summary, and the top ``limit`` functions per
+        phase sorted by ``sort_key`` unless collecting collapsed stacks"""
+        if stream is None:
+            stream = sys.stderr
+
+        total = sum(self.PhaseTimes.values())
+        width = max([16] + [len(phase) for phase in self.Phases])
+        stream.write('Time by phase (excluding nested phases):\n')
+        for phase in self.Phases:
+            phase_time = self.PhaseTimes[phase]
+            percent = 100 * phase_time / total if total else 0.0
+            stream.write('  %-*s %10.6fs %6.1f%%\n' % (width, phase,
+                                                       phase_time, percent))
+        stream.write('\n')
+
+        if self.Collapsed:
+            return
+
+        for phase in self.Phases:
+            stats = self._get_stats(phase, stream)
+            if stats is None:
+                continue
+            stream.write('=== Phase: %s ===\n' % phase)
+            stats.strip_dirs().sort_stats(sort_key).print_stats(limit)
+
+    def dump(self, output_dir, prefix):
+        """Write profile data to ``output_dir``, returning the filepaths
+
+        For ``cProfile`` statistics, ``<prefix>.<phase>.stats`` is written for
+        each phase along with ``<prefix>.stats`` covering all phases. For
+        collapsed stacks, ``<prefix>.collapsed`` is written. Characters other
+        than letters, digits, ``.``, ``_`` and ``-`` in ``prefix`` and phase
+        names (e.g. the ``:`` in ``input_handler:name``) are replaced with
+        ``_``.
+        """
+        prefix = _safe_filename(prefix)
+        if self.Collapsed:
+            fp = join(output_dir, '%s.collapsed' % prefix)
+            with open(fp, 'w') as f:
+                self._stacks.write(f)
+            return [fp]
+
+        written = []
+        all_stats = None
+        for phase in self.Phases:
+            stats = self._get_stats(phase)
+            if stats is None:
+                continue
+
+            fp = join(output_dir, '%s.%s.stats' % (prefix,
+                                                   _safe_filename(phase)))
+            stats.dump_stats(fp)
+            written.append(fp)
+
+            if all_stats is None:
+                all_stats = pstats.Stats(self._profiles[phase])
+            else:
+                all_stats.add(self._profiles[phase])
+
+        if all_stats is not None:
+            fp = join(output_dir, '%s.stats' % prefix)
+            all_stats.dump_stats(fp)
+            written.append(fp)
+
+        return written
+
+    def _get_stats(self, phase, stream=None):
+        stats = pstats.Stats(self._profiles[phase], stream=stream)
+        if not stats.stats:
+            # Nothing was recorded for this phase.
+            return None
+        return stats
+
+    def _enter(self, phase, boundary_frame):
+        self._started = time()
+        if self.Collapsed:
+            self._stacks.enter_phase(phase, boundary_frame)
+        else:
+            self._profiles[phase].enable()
+
+    def _exit(self, phase):
+        if self.Collapsed:
+            self._stacks.exit_phase()
+        else:
+            self._profiles[phase].disable()
+        self.PhaseTimes[phase] += time() - self._started
+
+    def _suspend(self, phase):
+        if not self.Collapsed:
+            self._profiles[phase].disable()
+        self.PhaseTimes[phase] += time() - self._started
+
+    def _resume(self, phase):
+        self._started = time()
+        if not self.Collapsed:
+            self._profiles[phase].enable()
+
+def _safe_filename(name):
+    """Replace characters that aren't safe in filenames everywhere"""
+    return re.sub(r'[^\w.-]', '_', name)
+
+class _StackCollector(object):
+    """Collect collapsed stacks with a profile hook
+
+    The hook is installed while any phase is active. At every profile event,
+    the time since the previous event is charged to the stack that was
+    current then. Stacks are read from the frames themselves, from the
+    current frame up to the frame that started the outermost phase, with
+    each phase name inserted as a pseudo-frame where that phase started.
+    """
+
+    def __init__(self):
+        self.Counts = {}
+        self._phases = []
+        self._boundaries = {}
+        self._key = None
+        self._last = None
+
+    def enter_phase(self, phase, boundary_frame):
+        # Keep the collector's own bookkeeping out of the stacks.
+        sys.setprofile(None)
+        self._charge()
+
+        self._phases.append(boundary_frame)
+        self._boundaries[id(boundary_frame)] = '[%s]' % phase
+        self._key = self._stack_key(boundary_frame)
+
+        self._last = time()
+        sys.setprofile(self._hook)
+
+    def exit_phase(self):
+        sys.setprofile(None)
+        self._charge()
+
+        boundary_frame = self._phases.pop()
+        del self._boundaries[id(boundary_frame)]
+
+        if self._phases:
+            self._key = self._stack_key(boundary_frame.f_back)
+            self._last = time()
+            sys.setprofile(self._hook)
+        else:
+            self._key = None
+            self._last = None
+
+    def write(self, f):
+        for stack in sorted(self.Counts):
+            f.write('%s %d\n' % (';'.join(stack), self.Counts[stack]))
+
+    def _charge(self):
+        now = time()
+        if self._last is not None and self._key is not None:
+            elapsed = int(round((now - self._last) * 1e6))
+            self.Counts[self._key] = self.Counts.get(self._key, 0) + elapsed
+        self._last = now
+
+    def _hook(self, frame, event, arg):
+        self._charge()
+
+        if event == 'return':
+            frame = frame.f_back
+        key = self._stack_key(frame)
+
+        if event == 'c_call':
+            key += ('%s:%s' % (getattr(arg, '__module__', None),
+                               getattr(arg, '__name__', arg)),)
+        self._key = key
+
+    def _stack_key(self, frame):
+        outermost = id(self._phases[0])
+        labels = []
+        while frame is not None:
+            frame_id = id(frame)
+            if frame_id in self._boundaries:
+                labels.append(self._boundaries[frame_id])
+                if frame_id == outermost:
+                    break
+            else:
+                labels.append('%s:%s' % (frame.f_globals.get('__name__'),
+                                         frame.f_code.co_name))
+            frame = frame.f_back
+
+        if frame is None:
+            # Not below the outermost phase (e.g., the profiler itself).
+            return None
+
+        labels.reverse()
+        return tuple(labels)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+"""Resource usage accounting for ``Command`` calls
+
+A ``ResourceMonitor`` measures what the process used between ``start`` and
+``stop``: wall time, user and system CPU time, peak resident set size and
+I/O. Usage is measured for the whole process, so calls running concurrently
+in other threads are included, as is the CPU time of child processes that
+have been waited for (e.g., a ``Command`` run with ``'process'`` timeout
+enforcement).
+
+Peak RSS and I/O come from ``/proc`` and are only available on Linux. On
+Linux the peak RSS high-water mark is reset when a monitor starts (by
+writing to ``/proc/self/clear_refs``), so the peak covers just the measured
+call; elsewhere it falls back to ``getrusage``, whose peak covers the whole
+life of the process. Unavailable values are reported as ``None``.
+"""
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import os
+import sys
+import json
+from time import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows.
+    resource = None
+
+# Counters read from /proc/self/io, reported as <name> in usage records.
+IO_FIELDS = ('rchar', 'wchar', 'read_bytes', 'write_bytes')
+
+# The highest peak RSS discarded by resetting the high-water mark, so that
+# monitors that don't reset it still report the peak of the whole process.
+_discarded_peak_rss = 0
+
+class ResourceMonitor(object):
+    """Measure the resources used between ``start`` and ``stop``"""
+
+    def __init__(self, reset_peak=True):
+        self.ResetPeak = reset_peak
+        self._start = None
+
+    def start(self):
+        peak_reset = self.ResetPeak and _reset_peak_rss()
+        user_cpu, system_cpu = _cpu_times()
+        self._start = {'wall': time(), 'user_cpu': user_cpu,
+                       'system_cpu': system_cpu, 'io': _read_proc_io(),
+                       'peak_rss_reset': peak_reset}
+        return self
+
+    def stop(self):
+        """Return a dict of the resources used since ``start``
+
+        The keys are ``wall``, ``user_cpu`` and ``system_cpu`` (seconds),
+        ``peak_rss`` (bytes), ``peak_rss_reset`` (whether ``peak_rss``
+        covers only the measured interval rather than the life of the
+        process) and the ``IO_FIELDS`` (bytes).
+        """
+        user_cpu, system_cpu = _cpu_times()
+        start = self._start
+
+        peak_rss = _peak_rss()
+        if peak_rss is not None and not start['peak_rss_reset']:
+            peak_rss = max(peak_rss, _discarded_peak_rss)
+
+        usage = {'wall': time() - start['wall'],
+                 'user_cpu': user_cpu - start['user_cpu'],
+                 'system_cpu': system_cpu - start['system_cpu'],
+                 'peak_rss': peak_rss,
+                 'peak_rss_reset': start['peak_rss_reset']}
+
+        io = _read_proc_io()
+        for field in IO_FIELDS:
+            if field in io and field in start['io']:
+                usage[field] = io[field] - start['io'][field]
+            else:
+                usage[field] = None
+
+        return usage
+
+class ResourceReport(object):
+    """Collect the resource usage of ``Command`` calls made by interfaces
+
+    A ``ResourceReport`` is a phase hook (see ``Interface.add_phase_hook``)
+    that turns on ``RecordResourceUsage`` for the ``Command`` of each
+    interface call and keeps its ``ResourceUsage``. ``start`` and ``write``
+    additionally measure the whole invocation, including input and output
+    handling.
+    """
+
+    def __init__(self):
+        self.Commands = []
+        self._monitor = ResourceMonitor(reset_peak=False)
+
+    def __call__(self, interface, phase, f, *args, **kwargs):
+        if phase != 'command':
+            return f(*args, **kwargs)
+
+        command = interface.CmdInstance
+        command.RecordResourceUsage = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            if command.ResourceUsage is not None:
+                self.Commands.append(command.ResourceUsage)
+
+    def start(self):
+        self._monitor.start()
+        return self
+
+    def write(self, path, **fields):
+        """Write the report as JSON to ``path``, including ``fields``"""
+        report = dict(fields)
+        report['commands'] = self.Commands
+        report['invocation'] = self._monitor.stop()
+
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+            f.write('\n')
+
+def _cpu_times():
+    """Return user and system CPU time, including waited-for children"""
+    times = os.times()
+    return times[0] + times[2], times[1] + times[3]
+
+def _reset_peak_rss():
+    """Reset the kernel's peak RSS counter, returning True on success"""
+    global _discarded_peak_rss
+    _discarded_peak_rss = max(_discarded_peak_rss, _peak_rss() or 0)
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except (IOError, OSError):
+        return False
+    return True
+
+def _peak_rss():
+    """Return the peak RSS in bytes, or None if it can't be determined"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError, ValueError):
+        pass
+
+    if resource is None:
+        return None
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OS X and in kilobytes elsewhere.
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+def _read_proc_io():
+    """Return the counters in /proc/self/io, or {} if unavailable"""
+    counters = {}
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                counters[name.strip()] = int(value)
+    except (IOError, OSError, ValueError):
+        return {}
+    return counters
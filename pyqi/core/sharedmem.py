@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+"""Returning large buffers from child processes through shared memory
+
+``run_in_process`` calls a function in a child process, like a single-use
+``multiprocessing.Pool``. Buffers in its result (the result itself, or the
+values of a returned dict, list or tuple) that support the buffer protocol,
+such as ``bytes``, ``bytearray``, ``array.array`` and NumPy arrays, are not
+pickled. Instead, the child copies each one into a
+``multiprocessing.shared_memory`` segment, and the parent maps the segment
+without copying it. Values come back as ``memoryview``s, except NumPy arrays,
+which come back as arrays. Smaller values and everything else are pickled as
+usual.
+
+Segments are unlinked as soon as the parent maps them, so they can't outlive
+the parent. A segment is unmapped when its value is garbage collected, or
+when ``release_shared`` is called on the value or on a dict, list or tuple
+holding it (or later, if other views of it, such as slices, are still
+alive). ``Interface``s call ``release_shared`` on each ``Command`` result
+once the output handlers have run, so a ``Command`` can return these values
+directly::
+
+    def run(self, **kwargs):
+        return run_in_process(build_table, (kwargs['input_fp'],))
+
+Requires Python 3.8+.
+"""
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import sys
+import weakref
+import multiprocessing
+from pyqi.core.cancellation import current_token
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    shared_memory = None
+
+# Buffers smaller than this are cheaper to pickle.
+MIN_SHARED_BYTES = 1 << 16
+
+# Seconds between checks for cancellation while waiting on the child.
+_POLL_INTERVAL = 0.1
+
+# id of each value mapped from a segment -> (weakref to it, SharedMemory)
+_attached = {}
+
+# Segments that couldn't be unmapped yet because views of them (e.g., slices
+# of a released value) are still alive. They are kept referenced, so that
+# SharedMemory.__del__ doesn't fail on them at garbage collection, and
+# retried whenever a value is released or collected.
+_unclosed = []
+
+class SharedBuffer(object):
+    """Describes a buffer that a child process placed in shared memory"""
+
+    def __init__(self, Name, Size, Format, Shape, DType=None):
+        self.Name = Name
+        self.Size = Size
+        self.Format = Format
+        self.Shape = Shape
+        self.DType = DType
+
+def run_in_process(f, args=(), kwargs=None, min_bytes=MIN_SHARED_BYTES):
+    """Return ``f(*args, **kwargs)``, calling ``f`` in a child process
+
+    Buffers of at least ``min_bytes`` in the result are returned through
+    shared memory. Exceptions raised by ``f`` are raised here. When called
+    from a ``Command`` with a timeout or cancellation token, the child is
+    killed if the call is cancelled.
+    """
+    if shared_memory is None:
+        raise RuntimeError("Returning values through shared memory requires "
+                           "Python 3.8+.")
+    if kwargs is None:
+        kwargs = {}
+
+    # Children share the parent's resource tracker, which removes segments
+    # that a crashed child left unclaimed when the parent exits.
+    resource_tracker.ensure_running()
+
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    child = multiprocessing.Process(target=_child_main,
+                                    args=(child_conn, f, args, kwargs,
+                                          min_bytes))
+    child.daemon = True
+    child.start()
+    child_conn.close()
+
+    token = current_token()
+    try:
+        while not parent_conn.poll(_POLL_INTERVAL):
+            if token is not None and token.cancelled:
+                child.terminate()
+                token.cancel()
+                token.raise_if_cancelled()
+
+        try:
+            ok, value = parent_conn.recv()
+        except EOFError:
+            child.join()
+            raise RuntimeError("Child process exited with status %s without "
+                               "a result." % child.exitcode)
+    finally:
+        parent_conn.close()
+        child.join()
+
+    if not ok:
+        raise value
+    return _map_values(value, _attach)
+
+def release_shared(values, keep=None):
+    """Unmap the shared memory behind ``values``
+
+    ``values`` is a value returned by ``run_in_process``, or a dict, list or
+    tuple holding such values; other values are ignored. Released
+    ``memoryview``s can no longer be used. Values in ``keep`` (a value, or a
+    dict, list or tuple of values, compared by identity) are left alone. A
+    segment still exported elsewhere (e.g., by a slice of its
+    ``memoryview``) is unmapped once that is garbage collected.
+    """
+    if _unclosed:
+        _retry_unclosed()
+    if not _attached:
+        return
+
+    keep_ids = set(id(value) for value in _container_values(keep))
+    for value in _container_values(values):
+        entry = _attached.get(id(value))
+        if entry is None or entry[0]() is not value or id(value) in keep_ids:
+            continue
+
+        _attached.pop(id(value), None)
+        if isinstance(value, memoryview):
+            try:
+                value.release()
+            except BufferError:
+                pass
+        _close(entry[1])
+
+def is_shared(value):
+    """Return True if ``value`` is mapped from a segment and not released"""
+    entry = _attached.get(id(value))
+    return entry is not None and entry[0]() is value
+
+def _child_main(conn, f, args, kwargs, min_bytes):
+    try:
+        outcome = (True, _map_values(f(*args, **kwargs),
+                                     lambda v: _share(v, min_bytes)))
+    except BaseException:
+        outcome = (False, sys.exc_info()[1])
+
+    try:
+        conn.send(outcome)
+    except Exception:
+        # The result or exception couldn't be pickled.
+        e = sys.exc_info()[1]
+        conn.send((False, RuntimeError("Unable to return the result from "
+                                       "the child process: %s: %s" %
+                                       (e.__class__.__name__, e))))
+    conn.close()
+
+def _share(value, min_bytes):
+    """Copy a large buffer into a new segment, returning its description"""
+    try:
+        view = memoryview(value)
+    except TypeError:
+        return value
+    if view.nbytes < min_bytes or not view.c_contiguous:
+        return value
+
+    shm = shared_memory.SharedMemory(create=True, size=view.nbytes)
+    try:
+        shm.buf[:view.nbytes] = view.cast('B')
+        dtype = getattr(value, 'dtype', None) \
+                if type(value).__module__ == 'numpy' else None
+        return SharedBuffer(shm.name, view.nbytes, view.format, view.shape,
+                            dtype)
+    finally:
+        view.release()
+        shm.close()
+
+def _attach(value):
+    """Map a ``SharedBuffer``, returning a view of it"""
+    if not isinstance(value, SharedBuffer):
+        return value
+
+    shm = shared_memory.SharedMemory(name=value.Name)
+    # The mapping stays valid after the name is removed.
+    shm.unlink()
+
+    buf = shm.buf[:value.Size]
+    if value.DType is not None:
+        import numpy
+        view = numpy.ndarray(value.Shape, value.DType, buffer=buf)
+    else:
+        try:
+            view = buf.cast(value.Format, value.Shape)
+        except (TypeError, ValueError):
+            view = buf
+
+    key = id(view)
+    _attached[key] = (weakref.ref(view, lambda ref: _forget(key, ref)), shm)
+    return view
+
+def _forget(key, ref):
+    entry = _attached.get(key)
+    if entry is not None and entry[0] is ref:
+        _attached.pop(key, None)
+        _close(entry[1])
+    if _unclosed:
+        _retry_unclosed()
+
+def _close(shm):
+    """Unmap a segment, or keep it for later if it is still in use"""
+    try:
+        shm.close()
+    except BufferError:
+        _unclosed.append(shm)
+
+def _retry_unclosed():
+    pending = list(_unclosed)
+    del _unclosed[:]
+    for shm in pending:
+        _close(shm)
+
+def _map_values(value, f):
+    """Apply ``f`` to ``value``, or to the values of a dict, list or tuple"""
+    if isinstance(value, dict):
+        return dict((k, f(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return type(value)(f(v) for v in value)
+    return f(value)
+
+def _container_values(value):
+    if isinstance(value, dict):
+        return list(value.values())
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+from pyqi.core.interfaces.optparse import (OptparseOption,
+                                           OptparseResult,
+                                           OptparseUsageExample)
+from pyqi.core.interfaces.optparse.input_handler import \
+        file_or_stdin_lines_handler
+from pyqi.core.interfaces.optparse.output_handler import \
+        write_or_print_list_of_strings
+from pyqi.core.command import (make_command_in_collection_lookup_f,
+                               make_command_out_collection_lookup_f)
+from pyqi.commands.batch import CommandConstructor
+
+cmd_in_lookup = make_command_in_collection_lookup_f(CommandConstructor)
+cmd_out_lookup = make_command_out_collection_lookup_f(CommandConstructor)
+
+usage_examples = [
+    OptparseUsageExample(ShortDesc="Run a batch of commands",
+                         LongDesc="Run the jobs listed in jobs.txt using four "
+                                  "worker processes, writing a JSON record "
+                                  "per job to report.jsonl",
+                         Ex="%prog --command-config-module "
+                            "pyqi.interfaces.optparse.config -i jobs.txt "
+                            "-p 4 -o report.jsonl"),
+    OptparseUsageExample(ShortDesc="Read jobs from stdin",
+                         LongDesc="Run jobs piped in on stdin and print the "
+                                  "per-job records",
+                         Ex="cat jobs.txt | %prog --command-config-module "
+                            "pyqi.interfaces.optparse.config -i -")
+]
+
+inputs = [
+    OptparseOption(Parameter=cmd_in_lookup('command_config_module')),
+    OptparseOption(Parameter=cmd_in_lookup('jobs'),
+                   Name='input-fp',
+                   ShortName='i',
+                   Handler=file_or_stdin_lines_handler,
+                   Help='file of jobs, one per line, or - to read them from '
+                        'stdin'),
+    OptparseOption(Parameter=cmd_in_lookup('driver_name')),
+    OptparseOption(Parameter=cmd_in_lookup('num_processes'),
+                   Type=int,
+                   ShortName='p'),
+    OptparseOption(Parameter=None,
+                   Type='new_filepath',
+                   ShortName='o',
+                   Name='output-fp',
+                   Required=False,
+                   Help='output filepath for the per-job JSON records '
+                        '[default: print to stdout]')
+]
+
+outputs = [
+    OptparseResult(Parameter=cmd_out_lookup('result'),
+                   Handler=write_or_print_list_of_strings,
+                   InputName='output-fp')
+]
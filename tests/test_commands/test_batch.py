@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import sys
+import json
+from os.path import exists, join
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+from pyqi.commands.batch import Batch
+from pyqi.util import is_py2
+
+if is_py2():
+    from StringIO import StringIO
+else:
+    from io import StringIO
+
+class BatchTests(TestCase):
+    def setUp(self):
+        self.cmd = Batch()
+        self.tmp_dir = mkdtemp()
+        self.output_fp = join(self.tmp_dir, 'foo.py')
+        self.jobs = ['make-command -n Foo -o %s' % self.output_fp,
+                     '',
+                     '# a comment',
+                     '{"command": "make-command", "kwargs": {"name": "Bar"}}',
+                     '{"command": "make-command", "kwargs": {"name": "B", "x": 1}}',
+                     'not-a-command']
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def check_records(self, result):
+        records = [json.loads(r) for r in result]
+
+        self.assertEqual([r['job'] for r in records], [0, 1, 2, 3])
+        self.assertEqual([r['status'] for r in records], [0, 0, 1, 1])
+        self.assertEqual([r['command'] for r in records],
+                         ['make-command'] * 3 + ['not-a-command'])
+        self.assertTrue(records[2]['error'].startswith(
+                'UnknownParameterError'))
+        self.assertTrue(all(r['elapsed'] >= 0 for r in records))
+        self.assertTrue(exists(self.output_fp))
+
+    def test_run(self):
+        obs = self.cmd(command_config_module='pyqi.interfaces.optparse.config',
+                       jobs=self.jobs)
+        self.check_records(obs['result'])
+
+    def test_run_in_pool(self):
+        obs = self.cmd(command_config_module='pyqi.interfaces.optparse.config',
+                       jobs=self.jobs, num_processes=2)
+        self.check_records(obs['result'])
+
+    def test_bad_command_line(self):
+        """optparse errors are reported as the job's exit status"""
+        obs = self.cmd(command_config_module='pyqi.interfaces.optparse.config',
+                       jobs=['make-command --not-an-option'])
+        self.assertEqual(json.loads(next(obs['result']))['status'], 2)
+
+    def test_job_output(self):
+        """What jobs print goes to stderr, keeping stdout for records"""
+        jobs_fp = join(self.tmp_dir, 'jobs.txt')
+        with open(jobs_fp, 'w') as f:
+            f.write('make-command -n Foo -o %s\n' % self.output_fp)
+
+        saved = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+        try:
+            # A nested batch prints its records to stdout.
+            obs = self.cmd(
+                    command_config_module='pyqi.interfaces.optparse.config',
+                    jobs=['batch --command-config-module '
+                          'pyqi.interfaces.optparse.config -i %s' % jobs_fp])
+            records = [json.loads(r) for r in obs['result']]
+            stdout, stderr = sys.stdout.getvalue(), sys.stderr.getvalue()
+        finally:
+            sys.stdout, sys.stderr = saved
+
+        self.assertEqual([r['status'] for r in records], [0])
+        self.assertEqual(stdout, '')
+        self.assertEqual(json.loads(stderr)['command'], 'make-command')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+"""Tests for pyqi.core.aio, imported by test_aio on Python 3.7+"""
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+__all__ = ['CommandACallTests', 'InterfaceACallTests']
+
+import asyncio
+import threading
+from unittest import TestCase
+from pyqi.core.command import (Command, CommandIn, CommandOut,
+                               ParameterCollection)
+from pyqi.core.cancellation import CancellationToken
+from pyqi.core.exception import CommandCancelledError, MissingParameterError
+from pyqi.core.interfaces.optparse import (OptparseOption, OptparseResult,
+                                           OptparseUsageExample,
+                                           optparse_factory)
+from pyqi.core.metrics import PhaseTimer, AggregatingSink
+
+class CommandACallTests(TestCase):
+    def test_coroutine_run(self):
+        async def run_many():
+            return await asyncio.gather(*[AsyncEcho().acall(x=i)
+                                          for i in range(200)])
+
+        results = asyncio.run(run_many())
+        self.assertEqual(results, [{'y': i} for i in range(200)])
+
+    def test_sync_run(self):
+        result = asyncio.run(SyncEcho().acall(x=3))
+        self.assertEqual(result, {'y': 3})
+        self.assertNotEqual(SyncEcho.Thread, threading.current_thread())
+
+    def test_validation(self):
+        with self.assertRaises(MissingParameterError):
+            asyncio.run(AsyncEcho().acall())
+
+    def test_coroutine_cancellation(self):
+        token = CancellationToken()
+        token.cancel()
+        cmd = PollingEcho()
+        cmd.CancellationToken = token
+        with self.assertRaises(CommandCancelledError):
+            asyncio.run(cmd.acall(x=1))
+
+        cmd.CancellationToken = None
+        self.assertEqual(asyncio.run(cmd.acall(x=1)), {'y': 1})
+
+    def test_resource_usage(self):
+        cmd = AsyncEcho()
+        cmd.RecordResourceUsage = True
+
+        async def call(x):
+            await cmd.acall(x=x)
+            return cmd.ResourceUsage
+
+        async def run_many():
+            return await asyncio.gather(call(1), call(2))
+
+        # each task sees the usage of its own call
+        first, second = asyncio.run(run_many())
+        self.assertEqual(first['failed'], False)
+        self.assertTrue(first['wall'] > 0)
+        self.assertFalse(first is second)
+        self.assertEqual(cmd.ResourceUsage, None)
+
+class InterfaceACallTests(TestCase):
+    def test_handlers_overlap(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def wait_for_other(value):
+            # deadlocks unless both input handlers run at once
+            barrier.wait()
+            return int(value)
+
+        async def async_output(key, value):
+            return value * 10
+
+        interface = optparse_factory(
+                AsyncSum, [OptparseUsageExample('a', 'b', 'c')],
+                [OptparseOption(Type=str, Parameter=AsyncSum.CommandIns['a'],
+                                Handler=wait_for_other),
+                 OptparseOption(Type=str, Parameter=AsyncSum.CommandIns['b'],
+                                Handler=wait_for_other)],
+                [OptparseResult(Parameter=AsyncSum.CommandOuts['total'],
+                                Handler=async_output)],
+                '0.1')()
+        sink = AggregatingSink()
+        interface.add_phase_hook(PhaseTimer(sink))
+
+        result = asyncio.run(interface.acall(['--a', '1', '--b', '2']))
+        self.assertEqual(result, {'total': 30})
+        self.assertEqual(sink.Stats[('AsyncSum', 'input_handler:a')]['count'],
+                         1)
+
+class AsyncEcho(Command):
+    CommandIns = ParameterCollection([CommandIn('x', int, '', Required=True)])
+    CommandOuts = ParameterCollection([CommandOut('y', int, '')])
+
+    async def run(self, **kwargs):
+        await asyncio.sleep(0.01)
+        return {'y': kwargs['x']}
+
+class PollingEcho(AsyncEcho):
+    async def run(self, **kwargs):
+        self.check_cancelled()
+        return {'y': kwargs['x']}
+
+class SyncEcho(AsyncEcho):
+    Thread = None
+
+    def run(self, **kwargs):
+        SyncEcho.Thread = threading.current_thread()
+        return {'y': kwargs['x']}
+
+class AsyncSum(Command):
+    CommandIns = ParameterCollection([CommandIn('a', int, '', Required=True),
+                                      CommandIn('b', int, '', Required=True)])
+    CommandOuts = ParameterCollection([CommandOut('total', int, '')])
+
+    async def run(self, **kwargs):
+        return {'total': kwargs['a'] + kwargs['b']}
@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import sys
+from unittest import main
+
+# The tests use async def, a syntax error before Python 3.5, and
+# asyncio.run, so they are only imported where they can run.
+if sys.version_info >= (3, 7):
+    from _aio_cases import *
+
+if __name__ == '__main__':
+    main()
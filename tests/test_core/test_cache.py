@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+from unittest import TestCase, main
+from pyqi.core.cache import ResultCache, make_key, estimate_size
+from pyqi.core.command import (Command, CommandIn, CommandOut,
+                               ParameterCollection)
+
+class ResultCacheTests(TestCase):
+    def test_lru_eviction(self):
+        cache = ResultCache(max_entries=2)
+        cache.put('a', {'x': 1})
+        cache.put('b', {'x': 2})
+        self.assertEqual(cache.get('a'), {'x': 1})
+
+        # 'b' is now least recently used
+        cache.put('c', {'x': 3})
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('a'), {'x': 1})
+        self.assertEqual(cache.get('c'), {'x': 3})
+
+        self.assertEqual(cache.stats(), {'entries': 2,
+                                         'bytes': cache.Bytes,
+                                         'hits': 3, 'misses': 1,
+                                         'evictions': 1})
+
+    def test_byte_bound(self):
+        size = estimate_size({'x': 'a' * 100})
+        cache = ResultCache(max_entries=10, max_bytes=size * 2)
+        for i in range(3):
+            cache.put(i, {'x': 'a' * 100})
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.Bytes, size * 2)
+
+        # too big to cache at all
+        cache.put('big', {'x': 'a' * 1000})
+        self.assertEqual(cache.get('big'), None)
+        self.assertEqual(len(cache), 2)
+
+        cache.clear()
+        self.assertEqual((len(cache), cache.Bytes), (0, 0))
+
+    def test_copies(self):
+        cache = ResultCache()
+        result = {'x': [1, 2]}
+        cache.put('a', result)
+        result['x'].append(3)
+
+        cached = cache.get('a')
+        self.assertEqual(cached, {'x': [1, 2]})
+        cached['x'].append(4)
+        self.assertEqual(cache.get('a'), {'x': [1, 2]})
+        self.assertTrue(cache.get('a', copy=False) is
+                        cache.get('a', copy=False))
+
+        # results that can't be copied aren't cached
+        cache.put('b', {'x': (i for i in range(3))})
+        self.assertEqual(cache.get('b'), None)
+
+    def test_make_key(self):
+        self.assertEqual(make_key({'a': [1, {'b': set([2])}]}),
+                         make_key({'a': [1, {'b': set([2])}]}))
+        self.assertNotEqual(make_key({'a': [1]}), make_key({'a': (1,)}))
+        self.assertNotEqual(make_key({'a': 1}), make_key({'a': True}))
+        self.assertEqual(make_key({'a': Unhashable()}), None)
+
+        # objects hashed by identity, such as open files, aren't keyed
+        self.assertEqual(make_key({'a': [object()]}), None)
+        with open(__file__) as f:
+            self.assertEqual(make_key({'a': f}), None)
+        self.assertNotEqual(make_key({'a': None, 'b': 1.5, 'c': u'x',
+                                      'd': b'y', 'e': frozenset([2])}), None)
+
+class CommandCacheTests(TestCase):
+    def setUp(self):
+        Lookup.Calls = 0
+        Lookup._class_result_cache = None
+
+    def test_pure_command(self):
+        self.assertEqual(Lookup()(key='a'), {'value': 'A'})
+        result = Lookup()(key='a')
+        self.assertEqual(result, {'value': 'A'})
+        self.assertEqual(Lookup.Calls, 1)
+
+        # the cached result can't be modified through a returned copy
+        result['value'] = 'Z'
+        self.assertEqual(Lookup()(key='a'), {'value': 'A'})
+
+        # unhashable inputs are run every time
+        Lookup()(key='a', extra=[Unhashable()])
+        Lookup()(key='a', extra=[Unhashable()])
+        self.assertEqual(Lookup.Calls, 3)
+
+        self.assertEqual(Lookup().get_result_cache().stats()['hits'], 2)
+
+    def test_validated_hits(self):
+        class Checked(Lookup):
+            Valid = True
+
+            def _validate_kwargs(self, kwargs):
+                if not self.Valid:
+                    raise ValueError("invalid")
+                super(Checked, self)._validate_kwargs(kwargs)
+        Checked._class_result_cache = None
+
+        Checked()(key='a')
+        cmd = Checked()
+        cmd.Valid = False
+        self.assertRaises(ValueError, cmd, key='a')
+        self.assertEqual(cmd.get_result_cache().stats()['hits'], 0)
+
+    def test_uncopied_results(self):
+        class Shared(Lookup):
+            ResultCacheCopies = False
+        Shared._class_result_cache = None
+
+        first = Shared()(key='a')
+        self.assertTrue(Shared()(key='a') is Shared()(key='a'))
+        self.assertFalse(first is Shared()(key='a'))
+        self.assertEqual(Lookup.Calls, 1)
+
+    def test_instance_cache(self):
+        class Impure(Lookup):
+            Pure = False
+
+        self.assertEqual(Impure().get_result_cache(), None)
+
+        cmd = Impure()
+        cmd.enable_result_cache(max_entries=1)
+        cmd(key='a')
+        cmd(key='a')
+        cmd(key='b')
+        cmd(key='a')
+        self.assertEqual(Lookup.Calls, 3)
+        self.assertEqual(cmd.get_result_cache().Evictions, 2)
+
+class Lookup(Command):
+    Pure = True
+    Calls = 0
+    CommandIns = ParameterCollection([
+        CommandIn('key', str, 'the key', Required=True),
+        CommandIn('extra', list, 'ignored')])
+    CommandOuts = ParameterCollection([CommandOut('value', str, 'the value')])
+
+    def run(self, **kwargs):
+        Lookup.Calls += 1
+        return {'value': kwargs['key'].upper()}
+
+class Unhashable(object):
+    __hash__ = None
+
+if __name__ == '__main__':
+    main()
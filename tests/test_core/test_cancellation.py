@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+from time import sleep, time
+from unittest import TestCase, main, skipUnless
+from pyqi.core.cancellation import CancellationToken, current_token
+from pyqi.core.command import (Command, CommandIn, CommandOut,
+                               ParameterCollection)
+from pyqi.core.exception import (CommandCancelledError, CommandTimeoutError,
+                                 IncompetentDeveloperError)
+
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
+class CancellationTokenTests(TestCase):
+    def test_cancel(self):
+        parent = CancellationToken()
+        token = CancellationToken(parent=parent)
+        self.assertFalse(token.cancelled)
+        self.assertEqual(token.remaining(), None)
+        token.raise_if_cancelled()
+
+        parent.cancel()
+        self.assertTrue(token.cancelled)
+        self.assertRaises(CommandCancelledError, token.raise_if_cancelled)
+
+    def test_timeout(self):
+        token = CancellationToken(timeout=0)
+        self.assertTrue(token.expired)
+        self.assertRaises(CommandTimeoutError, token.raise_if_cancelled)
+
+class CommandTimeoutTests(TestCase):
+    def test_no_timeout(self):
+        self.assertEqual(Sleeper()(seconds=0), {'polls': 1})
+        self.assertEqual(current_token(), None)
+
+    def test_cooperative(self):
+        cmd = Sleeper()
+        cmd.Timeout = 0.2
+        cmd.TimeoutEnforcement = 'cooperative'
+        self.assertRaises(CommandTimeoutError, cmd, seconds=5)
+
+    def test_thread(self):
+        """The caller is freed even if run never polls"""
+        cmd = Sleeper()
+        cmd.Timeout = 0.2
+        start = time()
+        self.assertRaises(CommandTimeoutError, cmd, seconds=2, poll=False)
+        self.assertTrue(time() - start < 1.5)
+
+        # errors and results come back from the worker
+        self.assertEqual(cmd(seconds=0), {'polls': 1})
+        self.assertRaises(ValueError, cmd, seconds=-1)
+
+    def test_process(self):
+        cmd = Sleeper()
+        cmd.Timeout = 0.5
+        cmd.TimeoutEnforcement = 'process'
+        self.assertRaises(CommandTimeoutError, cmd, seconds=5, poll=False)
+        self.assertEqual(cmd(seconds=0), {'polls': 1})
+        self.assertRaises(ValueError, cmd, seconds=-1)
+
+    def test_per_call(self):
+        cmd = Sleeper()
+        cmd.TimeoutEnforcement = 'cooperative'
+        self.assertRaises(CommandTimeoutError, cmd, seconds=5, timeout=0.2)
+
+        # The call's timeout overrides Timeout, and isn't a CommandIn.
+        cmd.Timeout = 0.2
+        self.assertTrue(cmd(seconds=0.3, timeout=5)['polls'] > 1)
+
+        # A CommandIn named timeout is passed to run.
+        cmd = TimeoutEcho()
+        cmd.Timeout = 5
+        self.assertEqual(cmd(timeout=1), {'timeout': 1})
+
+    def test_cancellation_token(self):
+        cmd = Sleeper()
+        cmd.CancellationToken = CancellationToken()
+        cmd.CancellationToken.cancel()
+        self.assertRaises(CommandCancelledError, cmd, seconds=1)
+
+    @skipUnless(hasattr(asyncio, 'run'), "asyncio.run requires Python 3.7+")
+    def test_async(self):
+        cmd = Sleeper()
+        cmd.Timeout = 0.2
+        with self.assertRaises(CommandTimeoutError):
+            asyncio.run(cmd.acall(seconds=5))
+
+        cmd.Timeout = None
+        with self.assertRaises(CommandTimeoutError):
+            asyncio.run(cmd.acall(seconds=5, timeout=0.2))
+
+    def test_unknown_enforcement(self):
+        cmd = Sleeper()
+        cmd.TimeoutEnforcement = 'magic'
+        self.assertRaises(IncompetentDeveloperError, cmd, seconds=0)
+
+class Sleeper(Command):
+    CommandIns = ParameterCollection([
+        CommandIn('seconds', float, '', Required=True),
+        CommandIn('poll', bool, '', Default=True)])
+    CommandOuts = ParameterCollection([CommandOut('polls', int, '')])
+
+    def run(self, **kwargs):
+        if kwargs['seconds'] < 0:
+            raise ValueError("Can't sleep for negative time.")
+
+        if not kwargs['poll']:
+            sleep(kwargs['seconds'])
+            return {'polls': 0}
+
+        polls = 0
+        deadline = time() + kwargs['seconds']
+        while True:
+            self.check_cancelled()
+            polls += 1
+            if time() >= deadline:
+                return {'polls': polls}
+            sleep(0.01)
+
+class TimeoutEcho(Command):
+    CommandIns = ParameterCollection([CommandIn('timeout', int, '')])
+    CommandOuts = ParameterCollection([CommandOut('timeout', int, '')])
+
+    def run(self, **kwargs):
+        return {'timeout': kwargs['timeout']}
+
+if __name__ == '__main__':
+    main()
@@ -14,7 +14,9 @@ __credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
 
 from unittest import TestCase, main
 from pyqi.core.command import CommandIn, CommandOut, ParameterCollection, Command
+from pyqi.core.log import JSONLinesLogger
 from pyqi.core.exception import (IncompetentDeveloperError, 
+                                 InvalidReturnTypeError,
                                  UnknownParameterError, 
                                  MissingParameterError)
 
@@ -77,6 +79,85 @@ class CommandTests(TestCase):
 
         self.assertEqual(kwargs, exp)
 
+    def test_validate_result(self):
+        class outy(Command):
+            CommandOuts = ParameterCollection([CommandOut('x', int, '')])
+            def run(self, **kwargs):
+                return {}
+
+        stub = outy()
+        stub._validate_result({'x': 1})
+        self.assertRaises(UnknownParameterError, stub._validate_result, {})
+        self.assertRaises(UnknownParameterError, stub._validate_result,
+                          {'x': 1, 'y': 2})
+
+    def test_validation_plan(self):
+        """The plan is built once per class and rebuilt if it goes stale"""
+        plan = self.stubby._get_validation_plan()
+        self.assertTrue(self.stubby()._get_validation_plan() is plan)
+        self.assertEqual(plan.InputNames, frozenset(['a', 'b', 'c']))
+        self.assertEqual(plan.RequiredNames, ('a',))
+        self.assertEqual(dict(plan.Defaults), {'b': 5, 'c': 10})
+
+        # subclasses get their own plan
+        class substubby(self.stubby):
+            CommandIns = ParameterCollection([CommandIn('d', int, '')])
+        self.assertEqual(substubby._get_validation_plan().InputNames,
+                         frozenset(['d']))
+        self.assertTrue(self.stubby._get_validation_plan() is plan)
+
+        self.stubby.CommandIns = ParameterCollection([CommandIn('e', int, '')])
+        self.assertEqual(self.stubby._get_validation_plan().InputNames,
+                         frozenset(['e']))
+
+    def test_streaming_result(self):
+        produced = []
+
+        class streamy(Command):
+            Pure = True
+            CommandOuts = ParameterCollection([
+                CommandOut('lines', list, '', Streaming=True)])
+            def run(self, **kwargs):
+                def gen():
+                    for i in range(3):
+                        produced.append(i)
+                        yield str(i)
+                return {'lines': gen()}
+
+        cmd = streamy()
+        cmd._logger = JSONLinesLogger(ring_size=10, write=False)
+        result = cmd()
+        # validation doesn't consume the stream
+        self.assertEqual(produced, [])
+        # and the call completes once the stream has been consumed
+        self.assertEqual([r['phase'] for r in cmd._logger.Records],
+                         ['start'])
+        self.assertEqual(list(result['lines']), ['0', '1', '2'])
+        self.assertEqual([r['phase'] for r in cmd._logger.Records],
+                         ['start', 'run'])
+        self.assertEqual(cmd._logger.Records[1]['message'],
+                         'Completed command: %s' % cmd._get_validation_plan(
+                            ).ClassStr)
+
+        # streamed results are never cached
+        self.assertEqual(list(streamy()()['lines']), ['0', '1', '2'])
+
+        self.assertRaises(InvalidReturnTypeError, streamy()._validate_result,
+                          {'lines': 42})
+
+    def test_trusted_call(self):
+        class echo(Command):
+            CommandIns = ParameterCollection([
+                CommandIn('a', int, '', Required=True),
+                CommandIn('b', int, '', Default=5)])
+            def run(self, **kwargs):
+                return kwargs
+
+        # defaults are set, but nothing is validated
+        self.assertEqual(echo().trusted_call(a=1), {'a': 1, 'b': 5})
+        self.assertEqual(echo().trusted_call(z=1), {'z': 1, 'b': 5})
+        self.assertRaises(UnknownParameterError, echo(), a=1, z=1)
+
 class ParameterTests(TestCase):
     def test_init(self):
         """Jog the init"""
@@ -90,6 +171,21 @@ class ParameterTests(TestCase):
         self.assertRaises(IncompetentDeveloperError, CommandIn, 'a', str,
                           'help', True, 'x')
 
+    def test_invalid_name(self):
+        for name in ['1a', 'a-b', 'a b', 'a\n', '-']:
+            self.assertRaises(IncompetentDeveloperError, CommandIn, name, str,
+                              'help')
+        for name in ['a', '_a1', 'A_b_2']:
+            self.assertEqual(CommandOut(name, str, 'help').Name, name)
+
+    def test_slots(self):
+        """Parameters don't carry a per-instance __dict__"""
+        obj = CommandOut('a', str, 'help', Streaming=True)
+        self.assertFalse(hasattr(obj, '__dict__'))
+        self.assertTrue(obj.Streaming)
+        with self.assertRaises(AttributeError):
+            obj.Unknown = 1
+
 class ParameterCollectionTests(TestCase):
     def setUp(self):
         self.pc = ParameterCollection([CommandIn('foo',str, 'help')])
@@ -115,6 +211,23 @@ class ParameterCollectionTests(TestCase):
 
     def test_setitem(self):
         self.assertRaises(TypeError, self.pc.__setitem__, 'bar', 10)
+        self.assertRaises(TypeError, self.pc.__delitem__, 'foo')
+        with self.assertRaises(TypeError):
+            self.pc.Parameters = []
+        self.assertEqual(list(self.pc), ['foo'])
+
+    def test_mapping(self):
+        params = [CommandIn('b', str, 'help'), CommandIn('a', str, 'help')]
+        obj = ParameterCollection(params)
+
+        self.assertEqual(list(obj.keys()), ['b', 'a'])
+        self.assertEqual(list(obj.values()), params)
+        self.assertEqual(len(obj), 2)
+        self.assertTrue('a' in obj)
+        self.assertFalse('c' in obj)
+        self.assertEqual(obj.get('c'), None)
+        self.assertEqual(obj.get('a'), params[1])
+        self.assertEqual(dict(obj.items()), {'a': params[1], 'b': params[0]})
 
 if __name__ == '__main__':
     main()
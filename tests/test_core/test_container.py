@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import os
+import re
+import gc
+import mmap
+import warnings
+import threading
+from multiprocessing.pool import ThreadPool
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main, skipIf
+from pyqi.core.container import (CannotReadError, ContainerError,
+                                 ContainerPool, DelayRead, ImmediateRead,
+                                 MappedRead, PrefetchRead, WithIO, default_read_object,
+                                 default_read_str, read_buffer, read_mmap,
+                                 write_buffer)
+from pyqi.util import is_py2
+
+class ReaderTests(TestCase):
+    def setUp(self):
+        self.output_dir = mkdtemp()
+        self.fp = os.path.join(self.output_dir, 'input.txt')
+        with open(self.fp, 'wb') as f:
+            f.write(b'header\n' + b'x' * 100000 + b'\nneedle\n')
+
+    def tearDown(self):
+        rmtree(self.output_dir)
+
+    @skipIf(is_py2(), "ResourceWarning is Python 3 only")
+    def test_default_readers_close_files(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always', ResourceWarning)
+            self.assertEqual(len(default_read_str(None, self.fp)), 100015)
+            self.assertEqual(len(default_read_object(None, self.fp)), 100015)
+            gc.collect()
+        self.assertEqual([w for w in caught
+                          if issubclass(w.category, ResourceWarning)], [])
+
+    def test_read_mmap(self):
+        container = MappedRead(InPath=self.fp)
+        self.assertEqual(container._object, None)
+
+        self.assertEqual(container.find(b'needle'), 100008)
+        self.assertTrue(isinstance(container._object, mmap.mmap))
+        self.assertEqual(container[:6], b'header')
+        self.assertEqual(len(container), 100015)
+        self.assertEqual(container.readline(), b'header\n')
+        self.assertEqual(re.search(b'ne+dle', container._object).start(),
+                         100008)
+
+    @skipIf(is_py2(), "read_buffer requires Python 3")
+    def test_read_buffer(self):
+        container = MappedRead(InPath=self.fp, reader=read_buffer)
+        self.assertTrue(container.readonly)
+        self.assertEqual(container[100008:100014].tobytes(), b'needle')
+        self.assertEqual(container.nbytes, 100015)
+
+    def test_read_empty(self):
+        fp = os.path.join(self.output_dir, 'empty')
+        open(fp, 'wb').close()
+        self.assertEqual(read_mmap(None, fp), b'')
+        if not is_py2():
+            self.assertEqual(read_buffer(None, fp).nbytes, 0)
+
+    def test_write_buffer(self):
+        fp = os.path.join(self.output_dir, 'copy')
+        container = MappedRead(InPath=self.fp)
+        container.unwrap()
+        write_buffer(container, fp)
+
+        with open(fp, 'rb') as f:
+            self.assertEqual(f.read(), container[:])
+
+    def test_truth_value(self):
+        """Truth testing doesn't read the object"""
+        fp = os.path.join(self.output_dir, 'empty')
+        open(fp, 'wb').close()
+        container = MappedRead(InPath=fp)
+        self.assertTrue(container)
+        self.assertEqual(container._object, None)
+
+        self.assertEqual(len(container), 0)
+        self.assertTrue(container)
+        self.assertTrue(MappedRead())
+
+    def test_no_sequence_protocol(self):
+        """Other containers don't look like sequences"""
+        container = DelayRead(Object=[1, 2], reader=default_read_str)
+        self.assertRaises(TypeError, len, container)
+        self.assertRaises(TypeError, lambda: container[0])
+        self.assertRaises(TypeError, list, container)
+
+class ContainerPoolTests(TestCase):
+    def setUp(self):
+        self.output_dir = mkdtemp()
+        self.fps = []
+        for i in range(4):
+            fp = os.path.join(self.output_dir, 'input%d.txt' % i)
+            with open(fp, 'w') as f:
+                f.write(str(i) * 100)
+            self.fps.append(fp)
+
+    def tearDown(self):
+        rmtree(self.output_dir)
+
+    def test_lru_unloading(self):
+        pool = ContainerPool(250, size_of=len)
+        containers = [pool.add(DelayRead(InPath=fp, reader=default_read_str))
+                      for fp in self.fps]
+
+        self.assertEqual(containers[0].count('0'), 100)
+        self.assertEqual(containers[1].count('1'), 100)
+        self.assertEqual(containers[0].upper(), '0' * 100)
+        self.assertEqual(pool.stats(), {'loaded': 2, 'bytes': 200, 'hits': 1,
+                                        'misses': 2, 'evictions': 0})
+
+        # Loading a third evicts the least recently used, containers[1].
+        self.assertEqual(containers[2].count('2'), 100)
+        self.assertEqual(pool.Evictions, 1)
+        self.assertEqual(containers[1]._object, None)
+        self.assertEqual(containers[0]._object, '0' * 100)
+
+        # containers[1] is transparently reloaded.
+        self.assertEqual(containers[1].count('1'), 100)
+        self.assertEqual(pool.stats(), {'loaded': 2, 'bytes': 200, 'hits': 1,
+                                        'misses': 4, 'evictions': 2})
+        self.assertEqual(containers[0]._object, None)
+
+        pool.clear()
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(pool.Bytes, 0)
+        self.assertTrue(all(c._object is None for c in containers))
+
+    def test_oversized_object(self):
+        pool = ContainerPool(50, size_of=len)
+        first = pool.add(ImmediateRead(InPath=self.fps[0],
+                                       reader=default_read_str))
+        self.assertEqual(len(pool), 1)
+        self.assertEqual(first.count('0'), 100)
+
+        second = pool.add(DelayRead(InPath=self.fps[1],
+                                    reader=default_read_str))
+        second.strip()
+        self.assertEqual(len(pool), 1)
+        self.assertEqual(first._object, None)
+
+    def test_collected_containers(self):
+        pool = ContainerPool(1000, size_of=len)
+        container = pool.add(DelayRead(InPath=self.fps[0],
+                                       reader=default_read_str))
+        container.strip()
+        self.assertEqual(pool.Bytes, 100)
+
+        del container
+        gc.collect()
+        self.assertEqual(len(pool), 0)
+        self.assertEqual(pool.Bytes, 0)
+
+    def test_add(self):
+        pool = ContainerPool(1000)
+        self.assertRaises(ContainerError, pool.add,
+                          DelayRead(Object='x', reader=default_read_str))
+        container = pool.add(DelayRead(InPath=self.fps[0],
+                                       reader=default_read_str))
+        self.assertRaises(ContainerError, pool.add, container)
+        self.assertRaises(ContainerError, ContainerPool(1000).add, container)
+        self.assertRaises(ContainerError, pool.add, 'not a container')
+
+        # The default size estimate covers the loaded string.
+        container.strip()
+        self.assertTrue(pool.Bytes >= 100)
+
+    def test_unwrapped_pinned(self):
+        pool = ContainerPool(150, size_of=len)
+        containers = [pool.add(DelayRead(InPath=fp, reader=default_read_str))
+                      for fp in self.fps[:3]]
+
+        with containers[0].unwrapped() as first:
+            self.assertEqual(first, '0' * 100)
+            self.assertEqual(containers[0]._pins, 1)
+
+            # The pinned object is kept even though it's least recently used.
+            self.assertEqual(containers[1].count('1'), 100)
+            self.assertEqual(containers[2].count('2'), 100)
+            self.assertTrue(containers[0]._object is first)
+            self.assertEqual(containers[1]._object, None)
+
+        self.assertEqual(containers[0]._pins, 0)
+        self.assertEqual(containers[1].count('1'), 100)
+        self.assertEqual(containers[0]._object, None)
+
+        with containers[1].unwrapped():
+            pool.clear()
+        self.assertTrue(all(c._object is None for c in containers))
+
+class UnwrapTests(TestCase):
+    def setUp(self):
+        self.output_dir = mkdtemp()
+        self.fp = os.path.join(self.output_dir, 'input.txt')
+        with open(self.fp, 'w') as f:
+            f.write('contents')
+
+    def tearDown(self):
+        rmtree(self.output_dir)
+
+    def test_unwrap(self):
+        container = DelayRead(InPath=self.fp, reader=default_read_str)
+        self.assertEqual(container.unwrap(), 'contents')
+        self.assertTrue(container.unwrap() is container._object)
+
+        with WithIO('object', IO_type='DelayRead').unwrapped() as obj:
+            self.assertEqual(obj, 'object')
+
+        self.assertRaises(CannotReadError,
+                          DelayRead(reader=default_read_str).unwrap)
+
+    def test_loaded_attributes(self):
+        container = DelayRead(Object=[3, 1, 2], InPath=self.fp,
+                              reader=default_read_str)
+        container.sort()
+        self.assertEqual(container.index(3), 2)
+        self.assertEqual(container._cached, ('sort', 'index'))
+        self.assertEqual(container.__dict__['index'](1), 0)
+
+        # Setting any attribute drops the stored methods.
+        container._object = 'abc'
+        self.assertEqual(container._cached, ())
+        self.assertEqual(container.upper(), 'ABC')
+        self.assertFalse('index' in container.__dict__)
+        self.assertRaises(AttributeError, getattr, container, 'sort')
+        self.assertRaises(AttributeError, getattr, container, '_writer')
+
+        # Pooled containers store methods that still count as uses, and
+        # drop them with the object.
+        pool = ContainerPool(1000)
+        pool.add(container)
+        self.assertEqual(container._cached, ())
+        self.assertEqual(container.upper(), 'ABC')
+        self.assertEqual(container.upper(), 'ABC')
+        self.assertEqual(container._cached, ('upper',))
+        self.assertEqual(pool.Hits, 2)
+        self.assertEqual(container._recent, [True])
+        pool.clear()
+        self.assertEqual(container._cached, ())
+        self.assertEqual(container.upper(), 'CONTENTS')
+
+class PrefetchReadTests(TestCase):
+    def setUp(self):
+        self.output_dir = mkdtemp()
+        self.fp = os.path.join(self.output_dir, 'input.txt')
+        with open(self.fp, 'w') as f:
+            f.write('contents')
+
+    def tearDown(self):
+        rmtree(self.output_dir)
+
+    def test_reads_in_background(self):
+        release = threading.Event()
+        threads = []
+
+        def blocked_reader(obj, path):
+            threads.append(threading.current_thread())
+            release.wait()
+            return default_read_str(obj, path)
+
+        # Construction doesn't wait for the reads.
+        containers = [PrefetchRead(InPath=self.fp, reader=blocked_reader)
+                      for _ in range(3)]
+        self.assertTrue(all(c._pending is not None for c in containers))
+
+        release.set()
+        self.assertEqual([c.upper() for c in containers], ['CONTENTS'] * 3)
+        self.assertEqual(len(threads), 3)
+        self.assertFalse(threading.current_thread() in threads)
+        self.assertTrue(all(c._pending is None for c in containers))
+
+    def test_reader_error(self):
+        def failing_reader(obj, path):
+            raise IOError("can't read %s" % path)
+
+        container = PrefetchRead(InPath=self.fp, reader=failing_reader)
+        self.assertRaises(IOError, getattr, container, 'strip')
+
+    def test_executor(self):
+        executor = ThreadPool(1)
+        try:
+            container = PrefetchRead(InPath=self.fp, reader=default_read_str,
+                                     executor=executor)
+            self.assertEqual(len(container.unwrap()), 8)
+        finally:
+            executor.close()
+            executor.join()
+
+        container = WithIO('object', IO_type='PrefetchRead')
+        self.assertEqual(container._pending, None)
+        self.assertEqual(container.upper(), 'OBJECT')
+
+    def test_pooled(self):
+        pool = ContainerPool(1, size_of=len)
+        first = pool.add(PrefetchRead(InPath=self.fp,
+                                      reader=default_read_str))
+        second = pool.add(PrefetchRead(InPath=self.fp,
+                                       reader=default_read_str))
+        self.assertEqual(first.strip(), 'contents')
+        self.assertEqual(second.strip(), 'contents')
+        self.assertEqual(first._object, None)
+
+        # Dropped objects are reread synchronously.
+        self.assertEqual(first.strip(), 'contents')
+        self.assertEqual(pool.stats()['misses'], 3)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import os
+import sys
+import json
+import time
+import socket
+import stat
+import threading
+from shutil import rmtree
+from subprocess import Popen, PIPE
+from tempfile import mkdtemp
+from os.path import abspath, dirname, exists, join
+from unittest import TestCase, main, skipUnless
+from pyqi.core.daemon import (forward_to_daemon, daemon_supported,
+                              _exit_status, _recv_request, _send_message)
+
+driver_fp = join(dirname(dirname(dirname(abspath(__file__)))), 'scripts',
+                 'pyqi')
+
+class DaemonTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+        self.socket_path = join(self.tmp_dir, 'pyqi.sock')
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def test_forward_without_daemon(self):
+        """Nothing listening means the caller runs the command itself"""
+        self.assertEqual(forward_to_daemon(self.socket_path, ['pyqi']), None)
+
+    def test_exit_status(self):
+        self.assertEqual(_exit_status(None), 0)
+        self.assertEqual(_exit_status(3), 3)
+
+    @skipUnless(daemon_supported(), "fd passing is unavailable")
+    def test_lost_reply(self):
+        """A command that may have run is never rerun by the caller"""
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        listener.listen(1)
+
+        def accept_and_drop():
+            conn, _ = listener.accept()
+            _, fds = _recv_request(conn)
+            for fd in fds:
+                os.close(fd)
+            _send_message(conn, {'pid': os.getpid()})
+            conn.close()
+
+        server = threading.Thread(target=accept_and_drop)
+        server.start()
+        try:
+            self.assertEqual(forward_to_daemon(self.socket_path, ['pyqi']), 1)
+        finally:
+            server.join()
+            listener.close()
+
+    @skipUnless(daemon_supported(), "fd passing is unavailable")
+    def test_round_trip(self):
+        """Commands forwarded to a daemon write to the client's stdio"""
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(sys.path)
+        daemon = Popen([sys.executable, driver_fp, 'serve-daemon',
+                        '--command-config-module',
+                        'pyqi.interfaces.optparse.config',
+                        '-s', self.socket_path], env=env, stdout=PIPE,
+                       stderr=PIPE)
+        try:
+            for _ in range(100):
+                if exists(self.socket_path):
+                    break
+                time.sleep(0.05)
+            mode = os.stat(self.socket_path).st_mode
+            self.assertEqual(stat.S_IMODE(mode) & 0o077, 0)
+
+            env['PYQI_DAEMON_SOCKET'] = self.socket_path
+            client = Popen([sys.executable, driver_fp, 'help', 'make-command'],
+                           env=env, stdout=PIPE, stderr=PIPE,
+                           universal_newlines=True)
+            stdout, _ = client.communicate()
+
+            # Exit handlers, such as the one writing the report, run before
+            # the client returns.
+            report_fp = join(self.tmp_dir, 'report.json')
+            reporter = Popen([sys.executable, driver_fp, '--pyqi-report',
+                              report_fp, '--', 'make-bash-completion',
+                              '--command-config-module',
+                              'pyqi.interfaces.optparse.config',
+                              '--driver-name', 'pyqi', '-o',
+                              join(self.tmp_dir, 'completion')],
+                             env=env, stdout=PIPE, stderr=PIPE)
+            reporter.communicate()
+            self.assertEqual(reporter.returncode, 0)
+            with open(report_fp) as f:
+                self.assertEqual(json.load(f)['command'],
+                                 'make-bash-completion')
+        finally:
+            daemon.terminate()
+            daemon.communicate()
+
+        self.assertEqual(client.returncode, 0)
+        self.assertTrue(stdout.startswith('Usage: pyqi make-command'))
+        self.assertFalse(exists(self.socket_path))
+
+if __name__ == '__main__':
+    main()
@@ -22,8 +22,8 @@ import pyqi.interfaces.optparse.config.make_bash_completion
 class TopLevelTests(TestCase):
     def test_get_command_names(self):
         """Test that command names are returned from a config directory."""
-        exp = ['make-bash-completion', 'make-command', 'make-optparse',
-               'make-release', 'serve-html-interface']
+        exp = ['batch', 'make-bash-completion', 'make-command', 'make-optparse',
+               'make-release', 'serve-daemon', 'serve-html-interface']
         obs = get_command_names('pyqi.interfaces.optparse.config')
         self.assertEqual(obs, exp)
 
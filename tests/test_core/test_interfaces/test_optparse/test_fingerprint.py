@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import os
+from pyqi.util import is_py2
+
+if is_py2():
+    from StringIO import StringIO
+else:
+    from io import StringIO
+
+from shutil import rmtree
+from tempfile import mkdtemp
+from os.path import exists, join
+from unittest import TestCase, main
+from pyqi.core.command import (Command, CommandIn, CommandOut,
+                               ParameterCollection)
+from pyqi.core.interfaces.optparse import (OptparseOption, OptparseResult,
+                                           OptparseUsageExample,
+                                           optparse_factory)
+from pyqi.core.interfaces.optparse.output_handler import write_string
+from pyqi.core.interfaces.optparse.fingerprint import (SIDECAR_SUFFIX,
+                                                       run_unless_unchanged)
+
+class RunUnlessUnchangedTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+        self.input_fp = join(self.tmp_dir, 'in.txt')
+        self.output_fp = join(self.tmp_dir, 'out.txt')
+        with open(self.input_fp, 'w') as f:
+            f.write('hello')
+
+        self.argv = ['upper', '-i', self.input_fp, '-o', self.output_fp]
+        self.interface = optparse_factory(
+                Upper, [OptparseUsageExample('a', 'b', 'c')],
+                [OptparseOption(Parameter=Upper.CommandIns['text'],
+                                Type='existing_filepath', Name='input-fp',
+                                ShortName='i', Handler=read_file),
+                 OptparseOption(Parameter=None, Type='new_filepath',
+                                Name='output-fp', ShortName='o',
+                                Required=True, Help='output')],
+                [OptparseResult(Parameter=Upper.CommandOuts['text'],
+                                Handler=write_string, InputName='output-fp')],
+                '0.1')
+        Upper.Calls = 0
+        Upper.Fail = False
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def run_upper(self, argv=None, **kwargs):
+        stream = StringIO()
+        ran = run_unless_unchanged(self.interface, argv or self.argv,
+                                   explain=True, stream=stream, **kwargs)
+        return ran, stream.getvalue()
+
+    def read_output(self):
+        with open(self.output_fp) as f:
+            return f.read()
+
+    def test_skip_unchanged(self):
+        ran, explanation = self.run_upper()
+        self.assertTrue(ran)
+        self.assertTrue('is missing' in explanation)
+        self.assertTrue(exists(self.output_fp + SIDECAR_SUFFIX))
+        self.assertEqual(self.read_output(), 'HELLO\n')
+
+        ran, explanation = self.run_upper()
+        self.assertFalse(ran)
+        self.assertTrue('skipping' in explanation)
+        self.assertEqual(Upper.Calls, 1)
+
+        # touching the input without changing it doesn't rerun
+        os.utime(self.input_fp, (0, 0))
+        self.assertFalse(self.run_upper()[0])
+
+        with open(self.input_fp, 'w') as f:
+            f.write('bye')
+        ran, explanation = self.run_upper()
+        self.assertTrue(ran)
+        self.assertTrue('input %s changed' % self.input_fp in explanation)
+        self.assertEqual(self.read_output(), 'BYE\n')
+
+        self.assertTrue(self.run_upper(force=True)[0])
+        self.assertEqual(Upper.Calls, 3)
+
+    def test_untracked_output_is_kept(self):
+        """Outputs without a sidecar aren't removed"""
+        with open(self.output_fp, 'w') as f:
+            f.write('precious')
+
+        with self.assertRaises(IOError):
+            self.run_upper()
+        self.assertEqual(self.read_output(), 'precious')
+
+    def test_failed_rerun_restores_outputs(self):
+        """Outputs moved aside for a rerun are put back if it fails"""
+        self.run_upper()
+        with open(self.output_fp + SIDECAR_SUFFIX) as f:
+            sidecar = f.read()
+
+        with open(self.input_fp, 'w') as f:
+            f.write('bye')
+        Upper.Fail = True
+        with self.assertRaises(ValueError):
+            self.run_upper()
+
+        self.assertEqual(self.read_output(), 'HELLO\n')
+        with open(self.output_fp + SIDECAR_SUFFIX) as f:
+            self.assertEqual(f.read(), sidecar)
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)),
+                         ['in.txt', 'out.txt', 'out.txt' + SIDECAR_SUFFIX])
+
+        Upper.Fail = False
+        self.assertTrue(self.run_upper()[0])
+        self.assertEqual(self.read_output(), 'BYE\n')
+        self.assertEqual(len(os.listdir(self.tmp_dir)), 3)
+
+def read_file(fp):
+    with open(fp) as f:
+        return f.read()
+
+class Upper(Command):
+    Calls = 0
+    Fail = False
+    CommandIns = ParameterCollection([CommandIn('text', str, '',
+                                                Required=True)])
+    CommandOuts = ParameterCollection([CommandOut('text', str, '')])
+
+    def run(self, **kwargs):
+        Upper.Calls += 1
+        if Upper.Fail:
+            raise ValueError("failed")
+        return {'text': kwargs['text'].upper()}
+
+if __name__ == '__main__':
+    main()
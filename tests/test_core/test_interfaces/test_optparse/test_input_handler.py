@@ -11,8 +11,13 @@
 __credits__ = ["Daniel McDonald", "Greg Caporaso", "Doug Wendel",
                "Jai Ram Rideout"]
 
+import sys
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
 from unittest import TestCase, main
-from pyqi.core.interfaces.optparse.input_handler import command_handler
+from pyqi.core.interfaces.optparse.input_handler import (
+        command_handler, file_or_stdin_lines_handler)
 from pyqi.commands.make_optparse import MakeOptparse
 
 class OptparseInputHandlerTests(TestCase):
@@ -24,6 +29,26 @@ class OptparseInputHandlerTests(TestCase):
         obs = command_handler('pyqi.commands.make_optparse.MakeOptparse')
         self.assertEqual(type(obs), type(exp))
 
+    def test_file_or_stdin_lines_handler(self):
+        tmp_dir = mkdtemp()
+        try:
+            fp = join(tmp_dir, 'lines.txt')
+            with open(fp, 'w') as f:
+                f.write('a\nb\n')
+
+            lines = file_or_stdin_lines_handler(fp)
+            f = lines.gi_frame.f_locals['f']
+            self.assertEqual(list(lines), ['a\n', 'b\n'])
+            # the file is closed once it has been read
+            self.assertTrue(f.closed)
+
+            self.assertRaises(IOError, file_or_stdin_lines_handler,
+                              join(tmp_dir, 'missing'))
+        finally:
+            rmtree(tmp_dir)
+
+        self.assertTrue(file_or_stdin_lines_handler('-') is sys.stdin)
+        self.assertEqual(file_or_stdin_lines_handler(), None)
 
 if __name__ == '__main__':
     main()
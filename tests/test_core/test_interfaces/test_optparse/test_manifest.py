@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import os
+import sys
+import json
+from shutil import rmtree
+from tempfile import mkdtemp
+from os.path import exists, join
+from unittest import TestCase, main
+from pyqi.core.interfaces.optparse.manifest import CommandManifest
+
+class CommandManifestTests(TestCase):
+    def setUp(self):
+        self.root = mkdtemp()
+        self.pkg_name = 'pyqi_manifest_test_pkg'
+        pkg_dir = join(self.root, self.pkg_name)
+        self.config_dir = join(pkg_dir, 'config')
+        os.makedirs(self.config_dir)
+
+        with open(join(pkg_dir, '__init__.py'), 'w') as f:
+            f.write("__version__ = '0.1'\n")
+        with open(join(self.config_dir, '__init__.py'), 'w') as f:
+            f.write('')
+
+        self.good_fp = join(self.config_dir, 'say_hello.py')
+        with open(self.good_fp, 'w') as f:
+            f.write(config_template % 'Say hello')
+        with open(join(self.config_dir, 'broken.py'), 'w') as f:
+            f.write('import hopefully_not_a_real_module\n')
+
+        sys.path.insert(0, self.root)
+        self.config_module = '%s.config' % self.pkg_name
+
+    def tearDown(self):
+        sys.path.remove(self.root)
+        for name in list(sys.modules):
+            if name.startswith(self.pkg_name):
+                del sys.modules[name]
+        rmtree(self.root)
+
+    def test_get_entry(self):
+        """Entries are built from config modules and broken ones reported"""
+        manifest = CommandManifest(self.config_module)
+        self.assertEqual(manifest.CommandNames, ['broken', 'say-hello'])
+
+        entry, error_msg = manifest.get_entry('say-hello')
+        self.assertEqual(error_msg, None)
+        self.assertEqual(entry['BriefDescription'], 'Say hello')
+        self.assertEqual(entry['Options'], ['--name'])
+        self.assertFalse('Help' in entry)
+
+        entry, error_msg = manifest.get_entry('broken')
+        self.assertEqual(entry, None)
+        self.assertTrue('hopefully_not_a_real_module' in error_msg)
+
+    def test_get_help(self):
+        """The program name is substituted when help is requested"""
+        manifest = CommandManifest(self.config_module)
+        obs = manifest.get_help('say-hello', 'driver say-hello')
+        self.assertTrue(obs.startswith('Usage: driver say-hello [options]'))
+        self.assertFalse('%prog' in obs)
+
+    def test_help_saved_separately(self):
+        """Help text is only read when asked for and follows $COLUMNS"""
+        manifest = CommandManifest(self.config_module)
+        manifest.get_entry('say-hello')
+        manifest.save()
+        self.assertFalse(exists(manifest.HelpPath))
+
+        manifest.get_help('say-hello', 'driver')
+        manifest.save()
+        with open(manifest.HelpPath) as f:
+            on_disk = json.load(f)
+        on_disk['Commands']['say-hello']['Help'] = 'cached'
+        with open(manifest.HelpPath, 'w') as f:
+            json.dump(on_disk, f)
+
+        manifest = CommandManifest(self.config_module)
+        self.assertEqual(manifest.get_help('say-hello', 'driver'), 'cached')
+
+        # Help wrapped to another width is stale.
+        columns = os.environ.get('COLUMNS')
+        os.environ['COLUMNS'] = '%d' % (int(columns or 80) + 40)
+        try:
+            manifest = CommandManifest(self.config_module)
+            obs = manifest.get_help('say-hello', 'driver')
+        finally:
+            if columns is None:
+                del os.environ['COLUMNS']
+            else:
+                os.environ['COLUMNS'] = columns
+        self.assertTrue(obs.startswith('Usage: driver [options]'))
+
+    def test_save_and_reload(self):
+        """Saved entries are reused until their sources change"""
+        manifest = CommandManifest(self.config_module)
+        manifest.get_entry('say-hello')
+        manifest.save()
+        self.assertTrue(exists(manifest.Path))
+
+        with open(manifest.Path) as f:
+            on_disk = json.load(f)
+        self.assertEqual(list(on_disk['Commands']), ['say-hello'])
+
+        # Tamper with the cached description: an unchanged source means the
+        # cached entry is trusted.
+        on_disk['Commands']['say-hello']['BriefDescription'] = 'cached'
+        with open(manifest.Path, 'w') as f:
+            json.dump(on_disk, f)
+
+        manifest = CommandManifest(self.config_module)
+        entry, _ = manifest.get_entry('say-hello')
+        self.assertEqual(entry['BriefDescription'], 'cached')
+
+        # Changing the config module invalidates the entry.
+        with open(self.good_fp, 'w') as f:
+            f.write(config_template % 'Say hello again')
+        del sys.modules['%s.say_hello' % self.config_module]
+
+        manifest = CommandManifest(self.config_module)
+        entry, _ = manifest.get_entry('say-hello')
+        self.assertEqual(entry['BriefDescription'], 'Say hello again')
+
+    def test_version_change(self):
+        """A new package version discards the saved manifest"""
+        manifest = CommandManifest(self.config_module)
+        manifest.get_entry('say-hello')
+        manifest.save()
+
+        with open(manifest.Path) as f:
+            on_disk = json.load(f)
+        on_disk['Commands']['say-hello']['BriefDescription'] = 'cached'
+        on_disk['Version'] = '0.0'
+        with open(manifest.Path, 'w') as f:
+            json.dump(on_disk, f)
+
+        manifest = CommandManifest(self.config_module)
+        entry, _ = manifest.get_entry('say-hello')
+        self.assertEqual(entry['BriefDescription'], 'Say hello')
+
+config_template = """
+from pyqi.core.command import (Command, CommandIn, CommandOut,
+                               ParameterCollection)
+from pyqi.core.interfaces.optparse import (OptparseOption,
+                                           OptparseUsageExample,
+                                           OptparseResult)
+from pyqi.core.interfaces.optparse.output_handler import print_string
+
+class SayHello(Command):
+    BriefDescription = "%s"
+    LongDescription = "Say hello to someone"
+    CommandIns = ParameterCollection([
+        CommandIn(Name='name', DataType=str, Description='who to greet',
+                  Required=True)])
+    CommandOuts = ParameterCollection([
+        CommandOut(Name='greeting', DataType=str, Description='the greeting')])
+
+    def run(self, **kwargs):
+        return {'greeting': 'hello %%s' %% kwargs['name']}
+
+CommandConstructor = SayHello
+
+usage_examples = [OptparseUsageExample(ShortDesc='Greet', LongDesc='Greet',
+                                       Ex='%%prog --name bob')]
+inputs = [OptparseOption(Parameter=SayHello.CommandIns['name'], Type=str)]
+outputs = [OptparseResult(Parameter=SayHello.CommandOuts['greeting'],
+                          Handler=print_string)]
+"""
+
+if __name__ == '__main__':
+    main()
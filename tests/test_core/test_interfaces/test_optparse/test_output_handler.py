@@ -21,11 +21,14 @@ if is_py2():
 else:
     from io import StringIO
 
+from array import array
+from io import BytesIO
 from shutil import rmtree
 from tempfile import mkdtemp
 from unittest import TestCase, main
 from pyqi.core.interfaces.optparse.output_handler import (write_string,
-        write_list_of_strings, print_list_of_strings)
+        write_list_of_strings, print_list_of_strings, write_binary,
+        print_binary, write_or_print_binary)
 from pyqi.core.exception import IncompetentDeveloperError
 
 class OutputHandlerTests(TestCase):
@@ -74,9 +77,106 @@ class OutputHandlerTests(TestCase):
             exp = 'foo\nbar\nbaz\n'
             obs = out.getvalue()
             self.assertEqual(obs, exp)
+
+            # generators are printed as they're consumed
+            out = StringIO()
+            sys.stdout = out
+            print_list_of_strings('this is ignored',
+                                  (s for s in ['foo', 'bar', 'baz']))
+            self.assertEqual(out.getvalue(), exp)
+        finally:
+            sys.stdout = saved_stdout
+
+    def read_binary(self, fp=None):
+        with open(fp or self.fp, 'rb') as f:
+            return f.read()
+
+    def test_write_binary(self):
+        """Correctly writes bytes-like objects to file unchanged."""
+        self.assertRaises(IncompetentDeveloperError, write_binary, 'a',
+                          b'b')
+
+        data = bytes(bytearray(range(256))) * 10
+        write_binary('foo', data, self.fp)
+        self.assertEqual(self.read_binary(), data)
+        self.assertRaises(IOError, write_binary, 'foo', data, self.fp)
+
+        if not is_py2():
+            # array.array doesn't support memoryview on Python 2.
+            fp = os.path.join(self.output_dir, 'doubles')
+            doubles = array('d', [1.5, 2.5])
+            write_binary('foo', memoryview(doubles), fp)
+            self.assertEqual(self.read_binary(fp), doubles.tobytes())
+
+        fp = os.path.join(self.output_dir, 'bytearray')
+        write_binary('foo', bytearray(b'\x00\r\n\xff'), fp)
+        self.assertEqual(self.read_binary(fp), b'\x00\r\n\xff')
+
+    def test_write_binary_chunks(self):
+        """Writes iterables of chunks, including more than fit in a writev."""
+        chunks = (bytes(bytearray([i % 256])) * (i % 7) for i in range(5000))
+        write_binary('foo', chunks, self.fp)
+
+        exp = b''.join(bytes(bytearray([i % 256])) * (i % 7)
+                       for i in range(5000))
+        self.assertEqual(self.read_binary(), exp)
+
+    def test_write_binary_file(self):
+        """Copies files given as paths or open files."""
+        src = os.path.join(self.output_dir, 'src')
+        with open(src, 'wb') as f:
+            f.write(b'0123456789' * 1000)
+
+        write_binary('foo', FilePath(src), self.fp)
+        self.assertEqual(self.read_binary(), b'0123456789' * 1000)
+
+        fp = os.path.join(self.output_dir, 'from_open_file')
+        with open(src, 'rb') as f:
+            f.read(5)
+            write_binary('foo', f, fp)
+            self.assertEqual(f.read(), b'')
+        self.assertEqual(self.read_binary(fp), b'56789' + b'0123456789' * 999)
+
+    def test_write_binary_file_objects(self):
+        """Reads file objects that aren't backed by a regular file."""
+        f = BytesIO(b'abcdef')
+        f.read(2)
+        write_binary('foo', f, self.fp)
+        self.assertEqual(self.read_binary(), b'cdef')
+
+        read_fd, write_fd = os.pipe()
+        os.write(write_fd, b'from a pipe')
+        os.close(write_fd)
+        fp = os.path.join(self.output_dir, 'from_pipe')
+        with os.fdopen(read_fd, 'rb') as f:
+            write_binary('foo', f, fp)
+        self.assertEqual(self.read_binary(fp), b'from a pipe')
+
+    def test_write_binary_text(self):
+        """Text, including a path given as a string, isn't written."""
+        self.assertRaises(TypeError, write_binary, 'foo', u'hello world',
+                          self.fp)
+
+    def test_print_binary(self):
+        """Writes binary data to stdout."""
+        saved_stdout = sys.stdout
+        try:
+            with open(self.fp, 'w') as out:
+                sys.stdout = out
+                print_binary('this is ignored', [b'foo', b'\xff'])
+                write_or_print_binary('this is ignored', b'bar')
         finally:
             sys.stdout = saved_stdout
 
+        self.assertEqual(self.read_binary(), b'foo\xffbar')
+
+class FilePath(object):
+    """A minimal path object (pathlib is Python 3 only)"""
+    def __init__(self, path):
+        self.Path = path
+
+    def __fspath__(self):
+        return self.Path
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,459 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import gc
+import os
+import json
+import weakref
+import pickle
+import threading
+import multiprocessing
+from pyqi.util import is_py2
+
+if is_py2():
+    from StringIO import StringIO
+else:
+    from io import StringIO
+
+from unittest import TestCase, main
+from pyqi.core.command import (Command, CommandIn, CommandOut,
+                               ParameterCollection)
+from pyqi.core.log import (BufferedLogger, InvalidLoggerError,
+                           JSONLinesLogger, Logger, MultiprocessLogger,
+                           NullLogger, StdErrLogger, get_default_logger,
+                           log_message, set_default_logger)
+
+class BlockingStream(object):
+    """A stream whose writes wait until ``release`` is called"""
+    def __init__(self):
+        self.Lines = []
+        self.Released = threading.Event()
+
+    def write(self, s):
+        self.Released.wait()
+        self.Lines.extend(s.splitlines())
+
+    def flush(self):
+        pass
+
+    def release(self):
+        self.Released.set()
+
+class FailingStream(StringIO):
+    """A stream whose first write raises an unexpected exception"""
+    def __init__(self):
+        StringIO.__init__(self)
+        self.Failed = False
+
+    def write(self, data):
+        if not self.Failed:
+            self.Failed = True
+            raise RuntimeError("first write fails")
+        return StringIO.write(self, data)
+
+class ListLogger(Logger):
+    def __init__(self, level=None):
+        super(ListLogger, self).__init__(level)
+        self.Lines = []
+
+    def _debug(self, msg):
+        self.Lines.append((self.DEBUG, msg))
+
+    def _info(self, msg):
+        self.Lines.append((self.INFO, msg))
+
+    def _warn(self, msg):
+        self.Lines.append((self.WARN, msg))
+
+    def _fatal(self, msg):
+        self.Lines.append((self.FATAL, msg))
+
+class OneArgumentLogger(Logger):
+    """A subclass written before messages took arguments and fields"""
+    def __init__(self):
+        super(OneArgumentLogger, self).__init__()
+        self.Lines = []
+
+    def info(self, msg):
+        self.Lines.append(msg)
+
+    def fatal(self, msg):
+        self.Lines.append(msg)
+
+class Unformattable(object):
+    def __str__(self):
+        raise AssertionError("Discarded messages must not be formatted.")
+
+class LoggerTests(TestCase):
+    def test_levels(self):
+        logger = ListLogger(Logger.WARN)
+        self.assertFalse(logger.is_enabled_for(Logger.INFO))
+        self.assertTrue(logger.is_enabled_for(Logger.FATAL))
+
+        logger.debug(u'a')
+        logger.info(u'b')
+        logger.warn(u'c')
+        logger.fatal(u'd')
+        self.assertEqual(logger.Lines, [(Logger.WARN, u'c'),
+                                        (Logger.FATAL, u'd')])
+
+        logger.set_level(Logger.DEBUG)
+        logger.debug(u'e')
+        self.assertEqual(logger.Lines[-1], (Logger.DEBUG, u'e'))
+        self.assertRaises(InvalidLoggerError, logger.set_level, 'LOUD')
+
+    def test_lazy_formatting(self):
+        logger = ListLogger(Logger.INFO)
+        logger.debug(u'%s', Unformattable())
+        logger.info(u'%s took %.1fs', 'foo', 0.25)
+        logger.info(u'100%')
+        self.assertEqual(logger.Lines, [(Logger.INFO, u'foo took 0.2s'),
+                                        (Logger.INFO, u'100%')])
+
+        null = NullLogger()
+        self.assertFalse(null.is_enabled_for(Logger.FATAL))
+        null.fatal(u'%s', Unformattable())
+
+    def test_bad_arguments(self):
+        logger = ListLogger()
+        logger.info(u'%d', 'x')
+        self.assertEqual(logger.Lines, [(Logger.INFO, "%r %% %r" %
+                                                      (u'%d', ('x',)))])
+
+    def test_log_message(self):
+        logger = OneArgumentLogger()
+        log_message(logger, Logger.INFO, u'%s took %.1fs', 'foo', 0.25,
+                    command='foo')
+        self.assertEqual(logger.Lines, [u'foo took 0.2s'])
+
+        set_default_logger(logger)
+        try:
+            command = Echo()
+        finally:
+            set_default_logger(None)
+        command(x=1)
+        self.assertEqual(len(logger.Lines), 3)
+
+        logger = ListLogger(Logger.INFO)
+        log_message(logger, Logger.DEBUG, u'%s', Unformattable())
+        self.assertEqual(logger.Lines, [])
+
+class BufferedLoggerTests(TestCase):
+    def test_writes_in_order(self):
+        stream = StringIO()
+        logger = BufferedLogger(stream, batch_size=3)
+        for i in range(10):
+            logger.info(u'message %d' % i)
+        logger.warn(u'last')
+        logger.flush()
+
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 11)
+        self.assertTrue(lines[0].endswith(' INFO message 0'))
+        self.assertTrue(lines[9].endswith(' INFO message 9'))
+        self.assertTrue(lines[10].endswith(' WARN last'))
+        logger.close()
+
+    def test_fatal_flushes(self):
+        stream = StringIO()
+        logger = BufferedLogger(stream)
+        logger.debug(u'a')
+        logger.fatal(u'b')
+        self.assertEqual(len(stream.getvalue().splitlines()), 2)
+        logger.close()
+
+    def test_drop_policy(self):
+        stream = BlockingStream()
+        logger = BufferedLogger(stream, max_queued=2, policy='drop',
+                                batch_size=1)
+        for i in range(20):
+            logger.info(u'message %d' % i)
+
+        self.assertTrue(logger.Dropped > 0)
+        stream.release()
+        logger.close()
+        self.assertEqual(len(stream.Lines) + logger.Dropped, 20)
+        self.assertTrue(stream.Lines[0].endswith(' INFO message 0'))
+
+    def test_level(self):
+        stream = StringIO()
+        logger = BufferedLogger(stream, level=Logger.INFO)
+        logger.debug(u'%s', Unformattable())
+        logger.info(u'%d%%', 50)
+        logger.flush()
+        self.assertTrue(stream.getvalue().endswith(' INFO 50%\n'))
+        logger.close()
+
+    def test_close(self):
+        stream = StringIO()
+        logger = BufferedLogger(stream)
+        logger.info(u'queued')
+        logger.close()
+        self.assertEqual(len(stream.getvalue().splitlines()), 1)
+
+        # Messages logged after closing are written directly.
+        logger.info(u'direct')
+        self.assertEqual(len(stream.getvalue().splitlines()), 2)
+        self.assertFalse(logger._writer.is_alive())
+
+    def test_bad_arguments(self):
+        stream = StringIO()
+        logger = BufferedLogger(stream)
+        logger.info(u'%d', 'x')
+        flushed = threading.Thread(target=logger.flush)
+        flushed.start()
+        flushed.join(5)
+        self.assertFalse(flushed.is_alive())
+        self.assertTrue(stream.getvalue().endswith(" INFO %r %% %r\n" %
+                                                   (u'%d', ('x',))))
+        logger.close()
+
+    def test_formats_when_logged(self):
+        stream = StringIO()
+        logger = BufferedLogger(stream)
+        values = [1]
+        logger.info(u'%s', values)
+        values.append(2)
+        logger.flush()
+        self.assertTrue(stream.getvalue().endswith(' INFO [1]\n'))
+        logger.close()
+
+    def test_exit_hooks(self):
+        logger = BufferedLogger(StringIO())
+        logger.info(u'started')
+        finalizer = logger._finalizer
+
+        # A restart, as in a forked child, doesn't register the hooks again.
+        logger._queue.put(None)
+        logger._writer.join()
+        logger._pid = None
+        logger.info(u'restarted')
+        self.assertTrue(logger._finalizer is finalizer)
+
+        # The hooks don't keep a closed logger alive.
+        logger.close()
+        ref = weakref.ref(logger)
+        del logger, finalizer
+        gc.collect()
+        self.assertEqual(ref(), None)
+
+    def test_dead_writer(self):
+        stream = FailingStream()
+        logger = BufferedLogger(stream)
+        logger.info(u'lost')
+        logger._writer.join(5)
+        self.assertFalse(logger._writer.is_alive())
+
+        # Neither waits for the dead writer, and the next message starts a
+        # new one.
+        logger.flush()
+        logger.info(u'written')
+        logger.flush()
+        self.assertEqual(stream.getvalue().split(' ', 1)[1], u'INFO written\n')
+        logger.close()
+
+    def test_invalid_policy(self):
+        self.assertRaises(InvalidLoggerError, BufferedLogger, policy='spill')
+
+    def test_pickle(self):
+        logger = BufferedLogger(max_queued=5, policy='drop')
+        logger.info(u'started')
+        copy = pickle.loads(pickle.dumps(logger))
+        self.assertEqual(copy.MaxQueued, 5)
+        self.assertEqual(copy.Policy, 'drop')
+        self.assertEqual(copy._writer, None)
+        logger.close()
+
+class JSONLinesLoggerTests(TestCase):
+    def read(self, stream):
+        return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    def test_records(self):
+        stream = StringIO()
+        logger = JSONLinesLogger(stream, level=Logger.INFO)
+        logger.debug(u'%s', Unformattable())
+        logger.info(u'Completed command: %s', 'foo', command='foo',
+                    phase='run', duration=0.5)
+        logger.warn(u'careful', jobs=3)
+
+        records = self.read(stream)
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0]['message'], 'Completed command: foo')
+        self.assertEqual(records[0]['level'], 'INFO')
+        self.assertEqual(records[0]['command'], 'foo')
+        self.assertEqual(records[0]['phase'], 'run')
+        self.assertEqual(records[0]['duration'], 0.5)
+        self.assertTrue(isinstance(records[0]['timestamp'], float))
+        self.assertEqual(records[1]['command'], None)
+        self.assertEqual(records[1]['jobs'], 3)
+
+    def test_ring_buffer(self):
+        stream = StringIO()
+        logger = JSONLinesLogger(stream, ring_size=3)
+        for i in range(5):
+            logger.info(u'message %d', i)
+        self.assertEqual([r['message'] for r in logger.Records],
+                         ['message 2', 'message 3', 'message 4'])
+
+        dumped = StringIO()
+        logger.dump(dumped)
+        self.assertEqual(len(self.read(stream)), 5)
+        self.assertEqual([r['message'] for r in self.read(dumped)],
+                         ['message 2', 'message 3', 'message 4'])
+
+    def test_dump_on_fatal(self):
+        stream = StringIO()
+        logger = JSONLinesLogger(stream, ring_size=2, write=False)
+        logger.info(u'a')
+        logger.info(u'b')
+        logger.info(u'c')
+        self.assertEqual(stream.getvalue(), '')
+
+        logger.fatal(u'failed')
+        self.assertEqual([r['message'] for r in self.read(stream)],
+                         ['c', 'failed'])
+        self.assertEqual(len(logger.Records), 0)
+
+        self.assertRaises(InvalidLoggerError, JSONLinesLogger, write=False)
+
+    def test_command_records(self):
+        stream = StringIO()
+        set_default_logger(JSONLinesLogger(stream))
+        try:
+            command = Echo()
+        finally:
+            set_default_logger(None)
+
+        command(x=1)
+        starting, completed = self.read(stream)
+        self.assertEqual(starting['phase'], 'start')
+        self.assertEqual(completed['phase'], 'run')
+        self.assertTrue(completed['command'].endswith('Echo\'>'))
+        self.assertTrue(completed['duration'] >= 0)
+
+class Echo(Command):
+    CommandIns = ParameterCollection([CommandIn('x', int, 'a number')])
+    CommandOuts = ParameterCollection([CommandOut('x', int, 'the number')])
+
+    def run(self, **kwargs):
+        return {'x': kwargs['x']}
+
+class MultiprocessLoggerTests(TestCase):
+    def test_children(self):
+        stream = StringIO()
+        logger = MultiprocessLogger(stream)
+        logger.info(u'parent')
+
+        pool = multiprocessing.Pool(2)
+        try:
+            pool.map(log_lines, [(logger, i) for i in range(4)])
+        finally:
+            pool.close()
+            pool.join()
+        logger.close()
+
+        lines = stream.getvalue().splitlines()
+        self.assertEqual(len(lines), 13)
+        self.assertTrue(lines[0].endswith(' INFO [%d] parent' % os.getpid()))
+
+        pids = set(int(line.split()[2][1:-1]) for line in lines[1:])
+        self.assertFalse(os.getpid() in pids)
+        self.assertEqual(set(logger.ProcessStats), pids | set([os.getpid()]))
+        self.assertEqual(sum(stats['records'] for stats in
+                             logger.ProcessStats.values()), 13)
+        self.assertEqual(set(logger.throughput()), set(logger.ProcessStats))
+
+        # Each child's lines are written in the order it logged them.
+        for pid in pids:
+            messages = [line.split(None, 3)[3] for line in lines
+                        if line.split()[2] == '[%d]' % pid]
+            for job in set(m.split()[1] for m in messages):
+                self.assertEqual([m for m in messages
+                                  if m.split()[1] == job],
+                                 ['job %s line %d' % (job, j)
+                                  for j in range(3)])
+
+    def test_sink(self):
+        stream = StringIO()
+        logger = MultiprocessLogger(sink=JSONLinesLogger(stream))
+        child = multiprocessing.Process(target=log_lines, args=((logger, 7),))
+        child.start()
+        child.join()
+        logger.close()
+
+        records = [json.loads(line) for line in
+                   stream.getvalue().splitlines()]
+        self.assertEqual([r['message'] for r in records],
+                         ['job 7 line %d' % j for j in range(3)])
+        self.assertEqual(records[0]['pid'], child.pid)
+        self.assertEqual(records[0]['phase'], 'run')
+
+    def test_pickle(self):
+        logger = MultiprocessLogger(StringIO())
+        self.assertTrue(pickle.loads(pickle.dumps(logger)) is logger)
+        logger.close()
+
+        copy = pickle.loads(pickle.dumps(logger))
+        self.assertTrue(isinstance(copy, StdErrLogger))
+
+def log_lines(args):
+    logger, job = args
+    for line in range(3):
+        logger.info(u'job %d line %d', job, line, phase='run')
+
+class DefaultLoggerTests(TestCase):
+    def setUp(self):
+        self.env = dict((name, os.environ.get(name))
+                        for name in ('PYQI_LOGGER', 'PYQI_LOG_LEVEL'))
+        for name in self.env:
+            os.environ.pop(name, None)
+        set_default_logger(None)
+
+    def tearDown(self):
+        for name, value in self.env.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+        set_default_logger(None)
+
+    def test_environment(self):
+        self.assertTrue(isinstance(get_default_logger(), NullLogger))
+
+        set_default_logger(None)
+        os.environ['PYQI_LOGGER'] = 'stderr'
+        logger = get_default_logger()
+        self.assertTrue(isinstance(logger, StdErrLogger))
+        self.assertTrue(get_default_logger() is logger)
+
+        set_default_logger(None)
+        os.environ['PYQI_LOGGER'] = 'buffered'
+        os.environ['PYQI_LOG_LEVEL'] = 'WARN'
+        logger = get_default_logger()
+        self.assertTrue(isinstance(logger, BufferedLogger))
+        self.assertEqual(logger.Level, Logger.WARN)
+
+        set_default_logger(None)
+        os.environ['PYQI_LOGGER'] = 'bogus'
+        self.assertRaises(InvalidLoggerError, get_default_logger)
+
+    def test_commands_use_default(self):
+        logger = BufferedLogger(StringIO())
+        set_default_logger(logger)
+        self.assertTrue(Command()._logger is logger)
+        logger.close()
+
+if __name__ == '__main__':
+    main()
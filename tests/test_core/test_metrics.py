@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import json
+from pyqi.util import is_py2
+
+if is_py2():
+    from StringIO import StringIO
+else:
+    from io import StringIO
+
+from unittest import TestCase, main
+from pyqi.core.command import (Command, CommandIn, CommandOut,
+                               ParameterCollection)
+from pyqi.core.interfaces.optparse import (OptparseOption, OptparseResult,
+                                           OptparseUsageExample,
+                                           optparse_factory)
+from pyqi.core.metrics import (PhaseTimer, LoggerSink, JSONLinesSink,
+                               AggregatingSink)
+
+class PhaseTimerTests(TestCase):
+    def setUp(self):
+        self.interface = optparse_factory(
+                Doubler,
+                [OptparseUsageExample('a', 'b', 'c')],
+                [OptparseOption(Type=int, Parameter=Doubler.CommandIns['x'],
+                                Handler=lambda x: x + 1)],
+                [OptparseResult(Parameter=Doubler.CommandOuts['y'],
+                                Handler=lambda key, data, opt=None: data)],
+                '0.1')
+
+    def test_aggregating_sink(self):
+        sink = AggregatingSink()
+        interface = self.interface()
+        interface.add_phase_hook(PhaseTimer(sink))
+
+        self.assertEqual(interface(['--x', '20']), {'y': 42})
+        self.assertEqual(interface(['--x', '20']), {'y': 42})
+
+        phases = set(phase for _, phase in sink.Stats)
+        self.assertEqual(phases, set(['in_validator', 'input_handler',
+                                      'parse', 'input_handler:x', 'command',
+                                      'out_validator', 'output_handler',
+                                      'output_handler:y']))
+
+        stats = sink.Stats[('Doubler', 'command')]
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(stats['failures'], 0)
+        self.assertTrue(stats['wall_min'] <= stats['wall_max'])
+        self.assertEqual(len(sink.summary()), 8)
+
+    def test_failed_phase(self):
+        sink = AggregatingSink()
+        interface = self.interface()
+        interface.add_phase_hook(PhaseTimer(sink))
+
+        with self.assertRaises(ValueError):
+            interface._run_phase('boom', int, 'not a number')
+        self.assertEqual(sink.Stats[('Doubler', 'boom')]['failures'], 1)
+
+    def test_hooks_not_shared(self):
+        """Instance hooks don't leak into other instances"""
+        interface = self.interface()
+        interface.add_phase_hook(PhaseTimer(AggregatingSink()))
+        self.assertEqual(self.interface.PhaseHooks, ())
+
+    def test_json_lines_sink(self):
+        out = StringIO()
+        sink = JSONLinesSink(out)
+        sink.record({'command': 'Doubler', 'phase': 'command', 'wall': 1.5,
+                     'cpu': 1.0, 'failed': False})
+        self.assertEqual(json.loads(out.getvalue())['wall'], 1.5)
+
+    def test_logger_sink(self):
+        messages = []
+
+        class ListLogger(object):
+            def info(self, msg):
+                messages.append(msg)
+
+        class FieldsLogger(object):
+            StructuredFields = True
+
+            def info(self, msg, **fields):
+                messages.append(fields)
+
+        record = {'command': 'Doubler', 'phase': 'parse', 'wall': 0.5,
+                  'cpu': 0.25, 'failed': True}
+        LoggerSink(ListLogger()).record(record)
+        self.assertEqual(messages, ['Doubler phase parse took 0.500000s '
+                                    '(0.250000s CPU) and failed'])
+
+        LoggerSink(FieldsLogger()).record(record)
+        self.assertEqual(messages[-1]['duration'], 0.5)
+        self.assertEqual(messages[-1]['failed'], True)
+
+class Doubler(Command):
+    CommandIns = ParameterCollection([CommandIn('x', int, 'a number')])
+    CommandOuts = ParameterCollection([CommandOut('y', int, 'twice x')])
+
+    def run(self, **kwargs):
+        return {'y': kwargs['x'] * 2}
+
+if __name__ == '__main__':
+    main()
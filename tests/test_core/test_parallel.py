@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+from unittest import TestCase, main
+from pyqi.core.command import (Command, CommandIn, CommandOut,
+                               ParameterCollection)
+from pyqi.core.exception import (IncompetentDeveloperError,
+                                 MissingParameterError)
+
+class MapTests(TestCase):
+    def setUp(self):
+        self.inputs = [{'x': 1}, {'x': 0}, {'x': 4}, {}]
+
+    def check_results(self, results):
+        results = sorted(results, key=lambda r: r.Index)
+        self.assertEqual([r.Index for r in results], [0, 1, 2, 3])
+        self.assertEqual([r.Succeeded for r in results],
+                         [True, False, True, False])
+
+        self.assertEqual(results[0].Result, {'y': 1.0})
+        self.assertEqual(results[2].Result, {'y': 0.25})
+        self.assertTrue(isinstance(results[1].Error, ZeroDivisionError))
+        self.assertTrue('ZeroDivisionError' in results[1].Traceback)
+        self.assertTrue(isinstance(results[3].Error, MissingParameterError))
+
+        # kwargs are reported as given, without defaults filled in
+        self.assertEqual(results[3].Kwargs, {})
+
+    def test_thread(self):
+        results = list(Reciprocal().map(self.inputs, max_workers=2))
+        self.assertEqual([r.Index for r in results], [0, 1, 2, 3])
+        self.check_results(results)
+
+    def test_process_unordered(self):
+        self.check_results(Reciprocal().map(iter(self.inputs),
+                                            executor='process',
+                                            max_workers=2, ordered=False))
+
+    def test_early_stop(self):
+        results = Reciprocal().map({'x': x} for x in range(1, 1000))
+        self.assertEqual(next(results).Result, {'y': 1.0})
+        results.close()
+
+    def test_bad_arguments(self):
+        """Bad arguments raise before any result is asked for"""
+        cmd = Reciprocal()
+        self.assertRaises(IncompetentDeveloperError, cmd.map, self.inputs,
+                          executor='gpu')
+        self.assertRaises(IncompetentDeveloperError, cmd.map, self.inputs,
+                          max_workers=0)
+        self.assertRaises(IncompetentDeveloperError, cmd.map, self.inputs,
+                          chunksize=0)
+
+class Reciprocal(Command):
+    CommandIns = ParameterCollection([CommandIn('x', int, 'a number',
+                                                Required=True)])
+    CommandOuts = ParameterCollection([CommandOut('y', float,
+                                                  'the reciprocal')])
+
+    def run(self, **kwargs):
+        return {'y': 1 / kwargs['x']}
+
+if __name__ == '__main__':
+    main()
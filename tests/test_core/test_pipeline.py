@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import threading
+from time import time
+from multiprocessing.pool import ThreadPool
+from unittest import TestCase, main
+from pyqi.core.command import (Command, CommandIn, CommandOut,
+                               ParameterCollection)
+from pyqi.core.exception import (IncompetentDeveloperError,
+                                 MissingParameterError,
+                                 UnknownParameterError)
+from pyqi.core.pipeline import Pipeline
+
+class PipelineTests(TestCase):
+    def build(self, max_workers=None, barrier=None, executor='thread'):
+        pipeline = Pipeline(max_workers, executor)
+        source = pipeline.add_step('source', Range(),
+                                   {'n': pipeline.input('n')})
+        pipeline.add_step('total', Sum(barrier),
+                          {'numbers': source.out('numbers')})
+        pipeline.add_step('count', Count(barrier),
+                          {'numbers': source.out('numbers')})
+        return pipeline
+
+    def test_run_parallel(self):
+        # the branches deadlock unless they run concurrently
+        barrier = Rendezvous(2, timeout=5)
+        results = self.build(2, barrier).run({'n': 5})
+        self.assertEqual(results, {'total': {'value': 10},
+                                   'count': {'value': 5}})
+
+    def test_run_serial(self):
+        pipeline = self.build(max_workers=1)
+        self.assertEqual(pipeline.run({'n': 3}, outputs=['source', 'total']),
+                         {'source': {'numbers': [0, 1, 2]},
+                          'total': {'value': 3}})
+
+    def test_executors(self):
+        expected = {'total': {'value': 10}, 'count': {'value': 5}}
+        self.assertEqual(self.build(2, executor='process').run({'n': 5}),
+                         expected)
+        self.assertRaises(ValueError,
+                          self.build(2, executor='process').run, {'n': -1})
+
+        pool = ThreadPool(2)
+        try:
+            barrier = Rendezvous(2, timeout=5)
+            pipeline = self.build(barrier=barrier, executor=pool)
+            self.assertEqual(pipeline.run({'n': 5}), expected)
+            # the pool is left running for its owner
+            self.assertEqual(pool.apply(len, ([1],)), 1)
+        finally:
+            pool.terminate()
+            pool.join()
+
+        self.assertRaises(IncompetentDeveloperError, Pipeline,
+                          executor='gpu')
+
+    def test_unpicklable_result(self):
+        pipeline = Pipeline(executor='process')
+        pipeline.add_step('stream', GeneratorRange(), {'n': 3})
+        self.assertRaises(RuntimeError, pipeline.run)
+
+    def test_run_errors(self):
+        pipeline = self.build()
+        self.assertRaises(MissingParameterError, pipeline.run)
+        self.assertRaises(UnknownParameterError, pipeline.run,
+                          {'n': 1, 'm': 2})
+        self.assertRaises(UnknownParameterError, pipeline.run, {'n': 1},
+                          ['nope'])
+
+        # the failing step's exception is raised
+        self.assertRaises(ValueError, pipeline.run, {'n': -1})
+
+    def test_wiring_validation(self):
+        pipeline = Pipeline()
+        source = pipeline.add_step('source', Range(), {'n': 3})
+
+        self.assertRaises(IncompetentDeveloperError, pipeline.add_step,
+                          'source', Range(), {'n': 3})
+        self.assertRaises(UnknownParameterError, source.out, 'nope')
+        self.assertRaises(UnknownParameterError, pipeline.add_step, 'a',
+                          Sum(), {'nope': 1})
+        self.assertRaises(MissingParameterError, pipeline.add_step, 'a',
+                          Sum(), {})
+
+        # DataTypes must be compatible
+        self.assertRaises(IncompetentDeveloperError, pipeline.add_step, 'a',
+                          Range(), {'n': source.out('numbers')})
+
+        # steps from other pipelines can't be used
+        other = Pipeline().add_step('other', Range(), {'n': 1})
+        self.assertRaises(IncompetentDeveloperError, pipeline.add_step, 'a',
+                          Sum(), {'numbers': other.out('numbers')})
+
+    def test_streaming_used_once(self):
+        pipeline = Pipeline()
+        source = pipeline.add_step('source', StreamRange(), {'n': 3})
+        pipeline.add_step('total', Sum(), {'numbers': source.out('numbers')})
+        self.assertRaises(IncompetentDeveloperError, pipeline.add_step,
+                          'count', Count(), {'numbers': source.out('numbers')})
+        self.assertEqual(pipeline.run(), {'total': {'value': 3}})
+
+class Range(Command):
+    CommandIns = ParameterCollection([CommandIn('n', int, '', Required=True)])
+    CommandOuts = ParameterCollection([CommandOut('numbers', list, '')])
+
+    def run(self, **kwargs):
+        if kwargs['n'] < 0:
+            raise ValueError("n must be positive")
+        return {'numbers': list(range(kwargs['n']))}
+
+class StreamRange(Range):
+    CommandOuts = ParameterCollection([CommandOut('numbers', list, '',
+                                                  Streaming=True)])
+
+    def run(self, **kwargs):
+        return {'numbers': iter(range(kwargs['n']))}
+
+class GeneratorRange(StreamRange):
+    def run(self, **kwargs):
+        return {'numbers': (i for i in range(kwargs['n']))}
+
+class Rendezvous(object):
+    """Block until ``parties`` threads are waiting (like Python 3's
+    ``threading.Barrier``, used once)"""
+    def __init__(self, parties, timeout):
+        self.Parties = parties
+        self.Timeout = timeout
+        self._waiting = 0
+        self._condition = threading.Condition()
+
+    def wait(self):
+        deadline = time() + self.Timeout
+        with self._condition:
+            self._waiting += 1
+            self._condition.notify_all()
+            while self._waiting < self.Parties:
+                remaining = deadline - time()
+                if remaining <= 0:
+                    raise RuntimeError("Only %d of %d threads arrived." %
+                                       (self._waiting, self.Parties))
+                self._condition.wait(remaining)
+
+class _Reduce(Command):
+    CommandIns = ParameterCollection([CommandIn('numbers', list, '',
+                                                Required=True)])
+    CommandOuts = ParameterCollection([CommandOut('value', int, '')])
+
+    def __init__(self, barrier=None, **kwargs):
+        super(_Reduce, self).__init__(**kwargs)
+        self.Barrier = barrier
+
+    def run(self, **kwargs):
+        if self.Barrier is not None:
+            self.Barrier.wait()
+        return {'value': self.reduce(kwargs['numbers'])}
+
+class Sum(_Reduce):
+    reduce = staticmethod(sum)
+
+class Count(_Reduce):
+    reduce = staticmethod(lambda numbers: len(list(numbers)))
+
+if __name__ == '__main__':
+    main()
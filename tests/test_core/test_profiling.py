@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import os
+from pyqi.util import is_py2
+
+if is_py2():
+    from StringIO import StringIO
+else:
+    from io import StringIO
+
+from shutil import rmtree
+from tempfile import mkdtemp
+from unittest import TestCase, main
+from pyqi.core.command import (Command, CommandIn, CommandOut,
+                               ParameterCollection)
+from pyqi.core.interfaces.optparse import (OptparseOption, OptparseResult,
+                                           OptparseUsageExample,
+                                           optparse_factory)
+from pyqi.core.profiling import PhaseProfiler
+
+class PhaseProfilerTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+        self.interface = optparse_factory(
+                Doubler,
+                [OptparseUsageExample('a', 'b', 'c')],
+                [OptparseOption(Type=int, Parameter=Doubler.CommandIns['x'])],
+                [OptparseResult(Parameter=Doubler.CommandOuts['y'],
+                                Handler=lambda key, data, opt=None: data)],
+                '0.1')
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def test_run_phase_nesting(self):
+        """Time is charged to the innermost phase"""
+        profiler = PhaseProfiler()
+        obs = profiler.run_phase('outer', profiler.run_phase, 'inner',
+                                 lambda x: x + 1, 41)
+        self.assertEqual(obs, 42)
+        self.assertEqual(profiler.Phases, ['outer', 'inner'])
+        self.assertTrue(profiler.PhaseTimes['inner'] >= 0)
+
+    def test_wrap_interface(self):
+        profiler = PhaseProfiler()
+        obs = profiler.wrap_interface(self.interface)()(['--x', '21'])
+
+        self.assertEqual(obs, {'y': 42})
+        self.assertEqual(profiler.Phases,
+                         ['in_validator', 'input_handler', 'parse', 'command',
+                          'out_validator', 'output_handler',
+                          'output_handler:y'])
+
+        written = profiler.dump(self.tmp_dir, 'doubler')
+        self.assertTrue(os.path.join(self.tmp_dir, 'doubler.stats') in
+                        written)
+        self.assertTrue(os.path.join(self.tmp_dir, 'doubler.command.stats') in
+                        written)
+
+        report = StringIO()
+        profiler.report(report, sort_key='tottime', limit=5)
+        self.assertTrue('=== Phase: command ===' in report.getvalue())
+
+    def test_phase_names(self):
+        """Phase names are made safe for filenames and fit the report"""
+        profiler = PhaseProfiler()
+        long_phase = 'input_handler:a_rather_long_option_name'
+        profiler.run_phase('parse', sum, range(1000))
+        profiler.run_phase(long_phase, sum, range(1000))
+
+        written = profiler.dump(self.tmp_dir, 'my command')
+        self.assertTrue(os.path.join(self.tmp_dir, 'my_command.input_handler_'
+                                     'a_rather_long_option_name.stats') in
+                        written)
+        self.assertFalse(any(':' in os.path.basename(fp) for fp in written))
+
+        report = StringIO()
+        profiler.report(report)
+        lines = report.getvalue().splitlines()[1:3]
+        self.assertEqual(lines[0].index('s '), lines[1].index('s '))
+
+    def test_collapsed(self):
+        profiler = PhaseProfiler(collapsed=True)
+        profiler.wrap_interface(self.interface)()(['--x', '21'])
+
+        fp, = profiler.dump(self.tmp_dir, 'doubler')
+        with open(fp) as f:
+            lines = f.read().splitlines()
+
+        stacks = [line.rsplit(' ', 1)[0] for line in lines]
+        self.assertTrue(all(s.startswith('[') for s in stacks))
+        self.assertTrue(any(s.startswith('[input_handler]') and '[parse]' in s
+                            for s in stacks))
+        self.assertTrue(any('%s:run' % __name__ in s for s in stacks))
+
+class Doubler(Command):
+    CommandIns = ParameterCollection([CommandIn('x', int, 'a number')])
+    CommandOuts = ParameterCollection([CommandOut('y', int, 'twice x')])
+
+    def run(self, **kwargs):
+        return {'y': kwargs['x'] * 2}
+
+if __name__ == '__main__':
+    main()
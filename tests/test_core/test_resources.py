@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import json
+from shutil import rmtree
+from tempfile import mkdtemp
+from os.path import join
+from threading import Thread
+from unittest import TestCase, main
+from pyqi.core.command import (Command, CommandIn, CommandOut,
+                               ParameterCollection)
+from pyqi.core.interfaces.optparse import (OptparseOption, OptparseResult,
+                                           OptparseUsageExample,
+                                           optparse_factory)
+from pyqi.core.resources import IO_FIELDS, ResourceMonitor, ResourceReport
+
+class ResourceUsageTests(TestCase):
+    def setUp(self):
+        self.tmp_dir = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.tmp_dir)
+
+    def test_monitor(self):
+        monitor = ResourceMonitor().start()
+        sum(range(100000))
+        usage = monitor.stop()
+
+        self.assertTrue(usage['wall'] >= 0)
+        self.assertTrue(usage['user_cpu'] >= 0)
+        self.assertTrue(usage['system_cpu'] >= 0)
+        self.assertTrue(usage['peak_rss'] is None or usage['peak_rss'] > 0)
+        for field in IO_FIELDS:
+            self.assertTrue(field in usage)
+
+    def test_command_usage(self):
+        cmd = Allocate()
+        cmd(n=10)
+        self.assertEqual(cmd.ResourceUsage, None)
+
+        cmd.RecordResourceUsage = True
+        result = cmd(n=10)
+        # the usage is a side channel, not part of the result
+        self.assertEqual(result, {'size': 10})
+        self.assertEqual(cmd.ResourceUsage['failed'], False)
+        self.assertTrue('Allocate' in cmd.ResourceUsage['command'])
+
+        self.assertRaises(ValueError, cmd, n=-1)
+        self.assertEqual(cmd.ResourceUsage['failed'], True)
+
+        # calls answered from the result cache used nothing
+        cmd.enable_result_cache()
+        cmd(n=10)
+        self.assertEqual(cmd.ResourceUsage['failed'], False)
+        cmd(n=10)
+        self.assertEqual(cmd.ResourceUsage, None)
+
+    def test_per_thread_usage(self):
+        cmd = Allocate()
+        cmd.RecordResourceUsage = True
+        cmd(n=10)
+
+        # a call from another thread doesn't replace this thread's usage
+        thread = Thread(target=self.assertRaises, args=(ValueError, cmd),
+                        kwargs={'n': -1})
+        thread.start()
+        thread.join()
+        self.assertEqual(cmd.ResourceUsage['failed'], False)
+
+    def test_report(self):
+        interface = optparse_factory(
+                Allocate, [OptparseUsageExample('a', 'b', 'c')],
+                [OptparseOption(Type=int, Parameter=Allocate.CommandIns['n'])],
+                [OptparseResult(Parameter=Allocate.CommandOuts['size'],
+                                Handler=lambda key, data, opt=None: data)],
+                '0.1')()
+        report = ResourceReport().start()
+        interface.add_phase_hook(report)
+        interface(['--n', '1000'])
+
+        report_fp = join(self.tmp_dir, 'report.json')
+        report.write(report_fp, command='allocate')
+        with open(report_fp) as f:
+            obs = json.load(f)
+
+        self.assertEqual(obs['command'], 'allocate')
+        self.assertEqual(len(obs['commands']), 1)
+        self.assertFalse(obs['invocation']['peak_rss_reset'])
+        if obs['invocation']['peak_rss'] is not None:
+            self.assertTrue(obs['invocation']['peak_rss'] >=
+                            obs['commands'][0]['peak_rss'])
+
+class Allocate(Command):
+    CommandIns = ParameterCollection([CommandIn('n', int, '', Required=True)])
+    CommandOuts = ParameterCollection([CommandOut('size', int, '')])
+
+    def run(self, **kwargs):
+        if kwargs['n'] < 0:
+            raise ValueError("n must be positive")
+        return {'size': len(bytearray(kwargs['n']))}
+
+if __name__ == '__main__':
+    main()
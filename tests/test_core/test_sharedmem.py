@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+#-----------------------------------------------------------------------------
+# Copyright (c) 2013, The BiPy Development Team.
+#
+# Distributed under the terms of the Modified BSD License.
+#
+# The full license is in the file COPYING.txt, distributed with this software.
+#-----------------------------------------------------------------------------
+
+from __future__ import division
+
+__credits__ = ["Greg Caporaso", "Daniel McDonald", "Doug Wendel",
+               "Jai Ram Rideout"]
+
+import gc
+from array import array
+from unittest import TestCase, main, skipUnless
+from pyqi.core.command import (Command, CommandIn, CommandOut,
+                               ParameterCollection)
+from pyqi.core.exception import CommandTimeoutError
+from pyqi.core.interfaces.optparse import (OptparseOption, OptparseResult,
+                                           OptparseUsageExample,
+                                           optparse_factory)
+from pyqi.core.sharedmem import (_attached, _unclosed, is_shared,
+                                 release_shared, run_in_process,
+                                 shared_memory)
+
+@skipUnless(shared_memory is not None, "requires Python 3.8+")
+class RunInProcessTests(TestCase):
+    def tearDown(self):
+        gc.collect()
+        self.assertEqual(len(_attached), 0)
+
+    def test_shared_values(self):
+        result = run_in_process(make_buffers, (1000,), min_bytes=1024)
+
+        self.assertTrue(isinstance(result['big'], memoryview))
+        self.assertEqual(result['big'].tobytes(), b'x' * 8000)
+        self.assertEqual(result['small'], b'ab')
+        self.assertEqual(result['count'], 3)
+        self.assertEqual(result['doubles'].format, 'd')
+        self.assertEqual(result['doubles'].shape, (1000,))
+        self.assertEqual(result['doubles'][10], 10.0)
+        self.assertEqual(len(_attached), 2)
+
+        # Segment names are removed once the parent has mapped them.
+        for _, shm in _attached.values():
+            self.assertRaises(FileNotFoundError, shared_memory.SharedMemory,
+                              name=shm.name)
+
+        release_shared(result, keep=[result['doubles']])
+        self.assertEqual(len(_attached), 1)
+        self.assertRaises(ValueError, result['big'].tobytes)
+        self.assertEqual(result['doubles'][10], 10.0)
+
+        release_shared(result)
+        self.assertEqual(len(_attached), 0)
+
+    def test_release_with_slices(self):
+        """Segments still viewed elsewhere are unmapped once they can be"""
+        result = run_in_process(make_buffers, (1000,), min_bytes=1024)
+        head = result['big'][:4]
+        release_shared(result)
+        self.assertEqual(len(_attached), 0)
+        self.assertEqual(len(_unclosed), 1)
+        self.assertEqual(head.tobytes(), b'xxxx')
+
+        del head
+        gc.collect()
+        release_shared(None)
+        self.assertEqual(len(_unclosed), 0)
+
+    def test_single_value(self):
+        value = run_in_process(bytes, (100000,))
+        self.assertTrue(isinstance(value, memoryview))
+        self.assertEqual(value.nbytes, 100000)
+        del value
+
+    def test_exception(self):
+        self.assertRaises(KeyError, run_in_process, fail)
+
+    def test_cancelled(self):
+        command = Sleeper()
+        command.Timeout = 0.2
+        command.TimeoutEnforcement = 'cooperative'
+        self.assertRaises(CommandTimeoutError, command, seconds=30)
+
+@skipUnless(shared_memory is not None, "requires Python 3.8+")
+class InterfaceTests(TestCase):
+    def test_released_after_output(self):
+        written = []
+        interface = optparse_factory(
+                BufferMaker,
+                [OptparseUsageExample('a', 'b', 'c')],
+                [OptparseOption(Type=int, Parameter=BufferMaker.CommandIns['n'])],
+                [OptparseResult(Parameter=BufferMaker.CommandOuts['data'],
+                                Handler=lambda key, data, opt=None:
+                                        written.append(data.tobytes()))],
+                '0.1')()
+
+        interface(['--n', '100000'])
+        self.assertEqual(written, [b'\0' * 100000])
+        self.assertEqual(len(_attached), 0)
+
+    def test_not_cached(self):
+        """Results are released after output, so they aren't cached"""
+        cmd = BufferMaker()
+        cache = cmd.enable_result_cache()
+        result = cmd(n=100000)
+        self.assertTrue(is_shared(result['data']))
+        self.assertEqual(len(cache), 0)
+
+        release_shared(result)
+        self.assertFalse(is_shared(result['data']))
+        self.assertEqual(cmd(n=10)['data'], b'\0' * 10)
+        self.assertEqual(len(cache), 1)
+
+def make_buffers(n):
+    return {'big': b'x' * (n * 8), 'small': b'ab', 'count': 3,
+            'doubles': array('d', range(n))}
+
+def fail():
+    raise KeyError('boom')
+
+def sleep(seconds):
+    from time import sleep
+    sleep(seconds)
+
+class Sleeper(Command):
+    CommandIns = ParameterCollection([CommandIn('seconds', float, 'time')])
+    CommandOuts = ParameterCollection([])
+
+    def run(self, **kwargs):
+        run_in_process(sleep, (kwargs['seconds'],))
+        return {}
+
+class BufferMaker(Command):
+    CommandIns = ParameterCollection([CommandIn('n', int, 'size')])
+    CommandOuts = ParameterCollection([CommandOut('data', memoryview,
+                                                  'zero bytes')])
+
+    def run(self, **kwargs):
+        return run_in_process(make_zeros, (kwargs['n'],))
+
+def make_zeros(n):
+    return {'data': bytes(n)}
+
+if __name__ == '__main__':
+    main()